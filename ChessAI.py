@@ -0,0 +1,337 @@
+"""
+The AI opponent. A negamax alpha-beta search over the GameState with iterative deepening under a depth, time or node
+budget, a fixed-size transposition table keyed by the Zobrist key, a quiescence search over captures, and move ordering
+by transposition table move, MVV-LVA, killer moves and the history heuristic. Can be run headless, e.g.
+    python ChessAI.py --time 5
+    python ChessAI.py --depth 4 --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+"""
+import time
+
+import ChessEngine
+
+CHECKMATE = 100000
+MATE_BOUND = CHECKMATE - 1000  # scores beyond this are mates, stored relative to the node in the transposition table
+INFINITY = CHECKMATE + 1
+
+# Material values and piece-square tables live in the engine, which keeps their totals up to date move by move
+pieceScore = ChessEngine.pieceScore
+piecePositionScores = ChessEngine.piecePositionScores
+mvvLva = ChessEngine.mvvLva
+
+# Transposition table entry bounds
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+'''
+Score the position in centipawns from the point of view of the side to move: material plus piece-square tables. The
+game state keeps both totals up to date in makeMove/undoMove, so this is O(1).
+'''
+def evaluate(gs):
+    score = gs.material['w'] - gs.material['b'] + gs.positionalScore
+    return score if gs.whiteToMove else -score
+
+
+class TranspositionTable():
+    '''
+    A fixed number of slots indexed by the low bits of the Zobrist key, so memory stays bounded however long the
+    search runs. A slot is replaced when the new entry searched at least as deep, or the old one is from an earlier
+    search.
+    '''
+    def __init__(self, size=1 << 18):
+        self.size = 1 << max(size - 1, 1).bit_length()  # round up to a power of two
+        self.mask = self.size - 1
+        self.entries = [None] * self.size  # (key, depth, score, flag, moveID, age)
+        self.age = 0
+
+    def newSearch(self):
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.age = 0
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, moveID):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, flag, moveID, self.age)
+
+    def usage(self):
+        return sum(1 for entry in self.entries if entry is not None) / self.size
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, depth, nodes, seconds, pv):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = nodes / seconds if seconds > 0 else 0.0
+        self.pv = pv
+
+    def __repr__(self):
+        return "depth %d score %s nodes %d nps %.0f time %.2fs pv %s" % (
+            self.depth, formatScore(self.score), self.nodes, self.nps, self.seconds,
+            " ".join(move.getChessNotation() for move in self.pv))
+
+
+class SearchAborted(Exception):
+    pass
+
+
+def formatScore(score):
+    if score > MATE_BOUND:
+        return "mate %d" % ((CHECKMATE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -%d" % ((CHECKMATE + score + 1) // 2)
+    return "cp %d" % score
+
+
+class Searcher():
+    def __init__(self, ttSize=1 << 18, book=None, tablebases=None):
+        self.tt = TranspositionTable(ttSize)
+        self.book = book  # a ChessBook.PolyglotBook, whose moves are played without searching
+        self.tablebases = tablebases  # a ChessTablebase.Tablebases, probed for the exact score of 3 piece endings
+        self.nodes = 0
+        self.killers = []
+        self.history = {}
+        self.rootMoveIDs = None
+        self.shouldStop = None
+
+    '''
+    Search gs with iterative deepening until maxDepth is complete or the time (seconds) or node budget runs out, and
+    return the SearchResult of the deepest completed iteration. onIteration is called with each iteration's result.
+    rootMoveIDs restricts the root to those moves, for splitting the root between parallel workers. shouldStop is
+    polled during the search and cancels it, even before the first iteration completes, when it returns True.
+    While the position is in the opening book a book move is returned at once, as a depth 0 result.
+    The game state is returned unchanged.
+    '''
+    def search(self, gs, maxDepth=64, timeLimit=None, nodeLimit=None, onIteration=None, rootMoveIDs=None,
+               shouldStop=None):
+        if self.book is not None and rootMoveIDs is None:
+            start = time.perf_counter()
+            bookMove = self.book.chooseMove(gs)
+            if bookMove is not None:
+                return SearchResult(bookMove, 0, 0, 0, time.perf_counter() - start, [bookMove])
+        self.tt.newSearch()
+        self.rootMoveIDs = rootMoveIDs
+        self.shouldStop = shouldStop
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(maxDepth + 64)]
+        self.history = {}
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.canAbort = False
+        gameOverFlags = gs.checkmate, gs.stalemate, gs.draw, gs.drawReason  # the search sets these on every node
+        result = None
+        try:
+            for depth in range(1, maxDepth + 1):
+                try:
+                    score, pv = self.negamax(gs, depth, -INFINITY, INFINITY, 0)
+                except SearchAborted:
+                    break
+                seconds = time.perf_counter() - self.startTime
+                result = SearchResult(pv[0] if pv else None, score, depth, self.nodes, seconds, pv)
+                if onIteration is not None:
+                    onIteration(result)
+                self.canAbort = True  # from here on there is always a completed iteration to fall back on
+                if not pv or abs(score) > MATE_BOUND:
+                    break  # no moves, or a forced mate has been found
+                if self.deadline is not None and time.perf_counter() > self.deadline:
+                    break
+        finally:
+            gs.checkmate, gs.stalemate, gs.draw, gs.drawReason = gameOverFlags
+        if result is not None:
+            result.nodes = self.nodes
+            result.seconds = time.perf_counter() - self.startTime
+            result.nps = result.nodes / result.seconds if result.seconds > 0 else 0.0
+        return result
+
+    def checkBudget(self):
+        if self.shouldStop is not None and self.shouldStop():
+            raise SearchAborted()
+        if not self.canAbort:
+            return
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchAborted()
+
+    '''
+    Return (score, principal variation) for the side to move, searching depth plies and then quiescence
+    '''
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+        if ply > 0 and (gs.repetitionCount() > 1 or gs.isInsufficientMaterial()):
+            return 0, []  # a repetition inside the search is scored as a draw, it could be repeated again
+        if ply > 0 and self.tablebases is not None and len(gs.pieceSquares['w']) + len(gs.pieceSquares['b']) == 3:
+            result = self.tablebases.probe(gs)
+            if result is not None:
+                outcome, plies = result  # WIN, DRAW and LOSS are 1, 0 and -1
+                return outcome * (CHECKMATE - ply - plies), []
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply), []
+
+        key = gs.zobristKey
+        alphaOriginal = alpha
+        ttMoveID = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttMoveID = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = entry[2]
+                if score > MATE_BOUND:
+                    score -= ply
+                elif score < -MATE_BOUND:
+                    score += ply
+                if entry[3] == EXACT or (entry[3] == LOWER_BOUND and score >= beta) or \
+                        (entry[3] == UPPER_BOUND and score <= alpha):
+                    return score, []
+
+        if ply > 0 and gs.halfmoveClock >= 100 and (not gs.inCheck() or gs.hasLegalMove()):
+            return 0, []  # fifty-move rule, unless this move was checkmate
+
+        rootMoveIDs = self.rootMoveIDs if ply == 0 else None
+        legalMoves = 0
+        bestScore = -INFINITY
+        bestMove = None
+        bestPv = []
+        for move in gs.generateMoves(ttMoveID, self.killers[ply], self.historyScore):
+            legalMoves += 1
+            if rootMoveIDs is not None and move.moveID not in rootMoveIDs:
+                continue
+            gs.makeMove(move)
+            try:
+                score, childPv = self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                gs.undoMove()
+            score = -score
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                bestPv = [move] + childPv
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not move.isCapture:
+                    killers = self.killers[ply]
+                    if killers[0] != move.moveID:
+                        killers[1] = killers[0]
+                        killers[0] = move.moveID
+                    historyKey = (move.pieceMoved, move.moveID)
+                    self.history[historyKey] = self.history.get(historyKey, 0) + depth * depth
+                break
+        if legalMoves == 0:
+            return (-CHECKMATE + ply if gs.inCheck() else 0), []
+        if bestMove is None:  # none of this worker's root moves
+            return -INFINITY, []
+
+        if bestScore <= alphaOriginal:
+            flag = UPPER_BOUND
+        elif bestScore >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        storedScore = bestScore
+        if storedScore > MATE_BOUND:
+            storedScore += ply
+        elif storedScore < -MATE_BOUND:
+            storedScore -= ply
+        if ply > 0 or self.rootMoveIDs is None:  # a root searched over some of its moves isn't the true root score
+            self.tt.store(key, depth, storedScore, flag, bestMove.moveID)
+        return bestScore, bestPv
+
+    '''
+    Search only captures and promotions until the position is quiet, so the static evaluation is never taken in the
+    middle of an exchange
+    '''
+    def quiescence(self, gs, alpha, beta, ply):
+        standPat = evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        legalMoves = 0
+        for move in gs.generateMoves(capturesOnly=True):
+            legalMoves += 1
+            self.nodes += 1
+            if self.nodes & 1023 == 0:
+                self.checkBudget()
+            gs.makeMove(move)
+            try:
+                score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            finally:
+                gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        if legalMoves == 0 and gs.inCheck() and not gs.hasLegalMove():
+            return -CHECKMATE + ply
+        return alpha
+
+    '''
+    Quiet move ordering: how often the move caused a cutoff, weighted by depth
+    '''
+    def historyScore(self, move):
+        return self.history.get((move.pieceMoved, move.moveID), 0)
+
+
+'''
+Convenience wrapper for the GUI: the best move for the side to move within the given budget, or None when there are
+no legal moves
+'''
+def findBestMove(gs, depth=64, timeLimit=None, nodeLimit=None, searcher=None):
+    if searcher is None:
+        searcher = Searcher()
+    result = searcher.search(gs, depth, timeLimit, nodeLimit)
+    return result.bestMove if result is not None else None
+
+
+def main():
+    import argparse
+    import ChessPerft
+    parser = argparse.ArgumentParser(description="Search a position and report depth, nodes, nps and the PV")
+    parser.add_argument("--fen", default=ChessPerft.START_FEN)
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--time", type=float, help="time budget in seconds")
+    parser.add_argument("--nodes", type=int, help="node budget")
+    parser.add_argument("--tt-size", type=int, default=1 << 18, help="transposition table slots")
+    parser.add_argument("--book", help="Polyglot opening book (.bin) to play from before searching")
+    parser.add_argument("--tablebases", help="directory of ChessTablebase tables to probe in the search")
+    args = parser.parse_args()
+    if args.time is None and args.nodes is None and args.depth == 64:
+        args.time = 5.0
+    gs = ChessEngine.GameState.fromFen(args.fen)
+    book = None
+    if args.book:
+        import ChessBook
+        book = ChessBook.PolyglotBook(args.book)
+    tablebases = None
+    if args.tablebases:
+        import ChessTablebase
+        tablebases = ChessTablebase.Tablebases(args.tablebases)
+    searcher = Searcher(args.tt_size, book, tablebases)
+    result = searcher.search(gs, args.depth, args.time, args.nodes, onIteration=print)
+    if book is not None:
+        book.close()
+    if tablebases is not None:
+        tablebases.close()
+    if result is None or result.bestMove is None:
+        print("no legal moves")
+        return
+    print("bestmove %s  (tt usage %.1f%%)" % (result.bestMove.getChessNotation(), searcher.tt.usage() * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Batch position encoding and evaluation with NumPy, for building datasets and scoring many positions at once. Boards are
+turned into an (N, 64) int8 array of piece codes, 0 for an empty square and 1 + ChessBinary.PIECE_CODES index for a
+piece, straight from the board strings or from a ChessBinary buffer; from there every step is whole-array arithmetic.
+    codes, whiteToMove = encodeStates(states)
+    planes = oneHot(codes)                      # (N, 12, 8, 8) int8
+    scores = evaluateBatch(codes, whiteToMove)  # centipawns for the side to move, like ChessAI.evaluate
+NumPy is only needed for this module; the rest of the engine runs without it.
+"""
+import itertools
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import ChessBinary
+import ChessEngine
+
+PIECE_CODES = ChessBinary.PIECE_CODES  # plane i of the one-hot encoding holds PIECE_CODES[i]
+MOBILITY_WEIGHT = 4  # centipawns per pseudo-legal knight, bishop, rook and queen move
+
+_KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+_ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+_DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("ChessBatch needs NumPy: pip install numpy")
+
+
+_tables = {}
+
+
+'''
+Lookup tables built on first use: square text to piece code, and per piece code the material and piece-square score
+of every square from white's point of view
+'''
+def _getTables():
+    if not _tables:
+        requireNumpy()
+        squareCodes = np.zeros(1 << 16, dtype=np.int8)  # indexed by the two ASCII bytes of a board square
+        material = np.zeros(13, dtype=np.int32)
+        positional = np.zeros((13, 64), dtype=np.int32)
+        for i, piece in enumerate(PIECE_CODES):
+            squareCodes[ord(piece[0]) << 8 | ord(piece[1])] = i + 1
+            material[i + 1] = ChessEngine.pieceScore[piece[1]] * (1 if piece[0] == 'w' else -1)
+            positional[i + 1] = np.array(ChessEngine.SIGNED_POSITION_SCORES[piece]).ravel()
+        _tables.update(squareCodes=squareCodes, material=material, positional=positional)
+    return _tables
+
+
+'''
+Encode a sequence of game states as (codes, whiteToMove): an (N, 64) int8 array of piece codes in square order and an
+(N,) bool array. The boards are joined into one byte string and decoded in a single lookup.
+'''
+def encodeStates(states):
+    requireNumpy()
+    states = list(states)
+    text = "".join(itertools.chain.from_iterable(itertools.chain.from_iterable(gs.board for gs in states)))
+    squares = np.frombuffer(text.encode("ascii"), dtype=">u2").reshape(len(states), 64)
+    codes = _getTables()["squareCodes"][squares]
+    whiteToMove = np.fromiter((gs.whiteToMove for gs in states), dtype=bool, count=len(states))
+    return codes, whiteToMove
+
+
+'''
+Encode a ChessBinary buffer of packed positions without building any GameState: the occupancy bits say which squares
+hold a piece, and the nibbles are handed out to them in square order
+'''
+def encodePacked(buffer):
+    requireNumpy()
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if raw.size % ChessBinary.POSITION_SIZE:
+        raise ValueError("buffer length %d is not a multiple of %d" % (raw.size, ChessBinary.POSITION_SIZE))
+    raw = raw.reshape(-1, ChessBinary.POSITION_SIZE)
+    occupied = np.unpackbits(raw[:, :8], axis=1).astype(bool)  # most significant bit first, so square order
+    nibbles = np.empty((len(raw), 32), dtype=np.int8)
+    nibbles[:, 0::2] = raw[:, 8:24] >> 4
+    nibbles[:, 1::2] = raw[:, 8:24] & 0x0F
+    pieceIndex = np.cumsum(occupied, axis=1) - 1  # the how-manieth piece each occupied square holds
+    codes = np.where(occupied, np.take_along_axis(nibbles, np.clip(pieceIndex, 0, 31), axis=1) + 1, 0)
+    return codes.astype(np.int8), (raw[:, 24] & 1) == 0
+
+
+'''
+One-hot planes from piece codes: an (N, 12, 8, 8) array, plane i set where PIECE_CODES[i] stands
+'''
+def oneHot(codes, dtype=None):
+    requireNumpy()
+    planes = codes[:, None, :] == np.arange(1, 13, dtype=np.int8)[None, :, None]
+    return planes.reshape(len(codes), 12, 8, 8).astype(dtype if dtype is not None else np.int8)
+
+
+'''
+Material and piece-square score of every position, from white's point of view
+'''
+def staticScores(codes):
+    tables = _getTables()
+    material = tables["material"][codes].sum(axis=1)
+    positional = tables["positional"][codes, np.arange(64)].sum(axis=1)
+    return material + positional
+
+
+def _fileMask(files):  # the squares of the given columns, as a bitboard with bit r * 8 + c for (r, c)
+    return sum(1 << (r * 8 + c) for r in range(8) for c in files)
+
+
+# (square offset, squares a step may land on) for each direction, so nothing wraps around the board edge
+def _step(dr, dc):
+    return dr * 8 + dc, _fileMask([c for c in range(8) if 0 <= c - dc < 8])
+
+
+_KNIGHT_SHIFTS = [_step(dr, dc) for dr, dc in _KNIGHT_STEPS]
+_ORTHOGONAL_SHIFTS = [_step(dr, dc) for dr, dc in _ORTHOGONAL]
+_DIAGONAL_SHIFTS = [_step(dr, dc) for dr, dc in _DIAGONAL]
+
+
+def _shift(bitboards, offset, landing):
+    shifted = bitboards << np.uint64(offset) if offset > 0 else bitboards >> np.uint64(-offset)
+    return shifted & np.uint64(landing)
+
+
+def _bitboards(mask):  # an (N, 64) bool array to N uint64 bitboards
+    return np.packbits(mask, axis=1, bitorder="little").view("<u8").ravel()
+
+
+def _popCount(bitboards):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bitboards).astype(np.int32)
+    return np.unpackbits(bitboards.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.int32)
+
+
+'''
+Pseudo-legal knight, bishop, rook and queen moves of each side, as an (N, 2) array of white and black counts. Pins and
+checks are ignored. The pieces are packed into one 64-bit bitboard per position, and sliders are walked one step at a
+time in every direction for all positions together.
+'''
+def mobility(codes):
+    requireNumpy()
+    empty = _bitboards(codes == 0)
+    counts = np.zeros((len(codes), 2), dtype=np.int32)
+    for side, color in enumerate("wb"):
+        first = PIECE_CODES.index(color + 'P') + 1
+        targets = ~_bitboards((codes >= first) & (codes < first + 6))  # anything but our own pieces
+        knights = _bitboards(codes == first + 1)
+        queens = codes == first + 4
+        for offset, landing in _KNIGHT_SHIFTS:
+            counts[:, side] += _popCount(_shift(knights, offset, landing) & targets)
+        for shifts, sliders in ((_DIAGONAL_SHIFTS, _bitboards((codes == first + 2) | queens)),
+                                (_ORTHOGONAL_SHIFTS, _bitboards((codes == first + 3) | queens))):
+            for offset, landing in shifts:
+                ray = sliders
+                for _ in range(7):
+                    ray = _shift(ray, offset, landing)
+                    counts[:, side] += _popCount(ray & targets)
+                    ray &= empty  # a capture or a blocked square ends the ray
+                    if not ray.any():
+                        break
+    return counts
+
+
+'''
+Score every position in centipawns for the side to move: material, piece-square tables and mobility. With
+mobilityWeight 0 the scores equal ChessAI.evaluate.
+'''
+def evaluateBatch(codes, whiteToMove, mobilityWeight=MOBILITY_WEIGHT):
+    scores = staticScores(codes)
+    if mobilityWeight:
+        counts = mobility(codes)
+        scores = scores + mobilityWeight * (counts[:, 0] - counts[:, 1])
+    return np.where(whiteToMove, scores, -scores)
+
+
+'''
+Feature rows for the learned evaluators: the 768 one-hot piece-square inputs and a side to move input
+'''
+def features(codes, whiteToMove):
+    planes = oneHot(codes, np.float32).reshape(len(codes), 768)
+    return np.concatenate([planes, whiteToMove[:, None].astype(np.float32)], axis=1)
+
+
+class LinearEvaluator():
+    '''
+    A weight per feature, scoring from white's point of view. fromStatic() reproduces the material and piece-square
+    evaluation exactly; fit() learns the weights from scored positions by least squares.
+    '''
+    def __init__(self, weights, bias=0.0):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+
+    @classmethod
+    def fromStatic(cls):
+        tables = _getTables()
+        weights = np.zeros(769, dtype=np.float32)
+        weights[:768] = (tables["material"][1:, None] + tables["positional"][1:]).ravel()
+        return cls(weights)
+
+    @classmethod
+    def fit(cls, featureRows, targets):
+        design = np.concatenate([featureRows, np.ones((len(featureRows), 1), dtype=np.float32)], axis=1)
+        solution = np.linalg.lstsq(design, np.asarray(targets, dtype=np.float32), rcond=None)[0]
+        return cls(solution[:-1], solution[-1])
+
+    def evaluate(self, featureRows):
+        return featureRows @ self.weights + self.bias
+
+
+class MLPEvaluator():
+    '''
+    One hidden ReLU layer over the same features, from white's point of view, trained by full batch gradient descent
+    on the mean squared error
+    '''
+    def __init__(self, hidden=32, seed=0):
+        requireNumpy()
+        rng = np.random.default_rng(seed)
+        self.w1 = rng.normal(0, 1 / np.sqrt(769), (769, hidden)).astype(np.float32)
+        self.b1 = np.zeros(hidden, dtype=np.float32)
+        self.w2 = rng.normal(0, 1 / np.sqrt(hidden), hidden).astype(np.float32)
+        self.b2 = np.float32(0)
+
+    def evaluate(self, featureRows):
+        return np.maximum(featureRows @ self.w1 + self.b1, 0) @ self.w2 + self.b2
+
+    '''
+    Train on (featureRows, targets) in centipawns; returns the final root mean squared error in centipawns
+    '''
+    def fit(self, featureRows, targets, epochs=200, learningRate=0.05, scale=100.0):
+        targets = np.asarray(targets, dtype=np.float32) / scale  # train in pawns so the step size is sensible
+        self.w2 /= scale
+        self.b2 /= scale
+        for _ in range(epochs):
+            hidden = np.maximum(featureRows @ self.w1 + self.b1, 0)
+            error = hidden @ self.w2 + self.b2 - targets
+            gradOut = 2 * error / len(targets)
+            gradHidden = np.outer(gradOut, self.w2) * (hidden > 0)
+            self.w2 -= learningRate * hidden.T @ gradOut
+            self.b2 -= learningRate * gradOut.sum()
+            self.w1 -= learningRate * featureRows.T @ gradHidden
+            self.b1 -= learningRate * gradHidden.sum(axis=0)
+        self.w2 *= scale
+        self.b2 *= scale
+        return float(np.sqrt(np.mean((self.evaluate(featureRows) - targets * scale) ** 2)))
+
+    def save(self, path):
+        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        evaluator = cls(data["w1"].shape[1])
+        evaluator.w1, evaluator.b1, evaluator.w2, evaluator.b2 = data["w1"], data["b1"], data["w2"], data["b2"][()]
+        return evaluator
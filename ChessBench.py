@@ -0,0 +1,487 @@
+"""
+Benchmarks for the chess engine. They run headless and print their results, e.g.
+    python ChessBench.py backends
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from array import array
+
+import ChessEngine
+import ChessBitboard
+import ChessParallel
+import ChessPerft
+
+
+'''
+Play seeded random games and collect the positions along the way as (game state, move log) pairs
+'''
+def samplePositions(games=20, plies=80, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(games):
+        gs = ChessEngine.GameState()
+        line = []
+        for _ in range(plies):
+            moves = gs.getValidMoves()
+            if len(moves) == 0:
+                break
+            move = moves[rng.randrange(len(moves))]
+            line.append((move.startRow, move.startCol, move.endRow, move.endCol))
+            gs.makeMove(move)
+        lines.append(line)
+    return lines
+
+
+'''
+Replay a line of (startRow, startCol, endRow, endCol) moves on a fresh game state of the given class
+'''
+def replay(gameStateClass, line):
+    gs = gameStateClass()
+    for startRow, startCol, endRow, endCol in line:
+        for move in gs.getValidMoves():
+            if (move.startRow, move.startCol, move.endRow, move.endCol) == (startRow, startCol, endRow, endCol):
+                gs.makeMove(move)
+                break
+    return gs
+
+
+def benchBackends(args):
+    backends = (("list of strings", ChessEngine.GameState), ("bitboards", ChessBitboard.BitboardGameState))
+    lines = samplePositions(args.games, args.plies, args.seed)
+    results = {}
+    for name, gameStateClass in backends:
+        states = [replay(gameStateClass, line[:i]) for line in lines for i in range(0, len(line), 4)]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for gs in states:
+                gs.getValidMoves()
+        movegenTime = time.perf_counter() - start
+        start = time.perf_counter()
+        nodes = ChessPerft.perft(gameStateClass(), args.depth)
+        treeTime = time.perf_counter() - start
+        results[name] = (len(states) * args.repeat / movegenTime, nodes / treeTime)
+        print("%-16s getValidMoves: %9.0f positions/s   depth %d tree: %d nodes, %9.0f nodes/s" %
+              (name, results[name][0], args.depth, nodes, results[name][1]))
+    base, fast = results["list of strings"], results["bitboards"]
+    print("speedup: getValidMoves x%.2f, tree walk x%.2f" % (fast[0] / base[0], fast[1] / base[1]))
+
+
+def benchMoves(args):
+    gs = ChessEngine.GameState()
+    board = gs.board
+    perMove = min(timeit.repeat(lambda: ChessEngine.Move((6, 4), (4, 4), board), number=args.count, repeat=5))
+    print("Move construction: %.3f us/move" % (perMove / args.count * 1e6))
+    tracemalloc.start()
+    moves = [ChessEngine.Move((6, 4), (4, 4), board) for _ in range(args.count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Move memory: %.1f bytes/move (%d moves)" % (size / len(moves), len(moves)))
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        moves = gs.getValidMoves()
+    print("getValidMoves (start position): %.1f us/call" % ((time.perf_counter() - start) / args.repeat * 1e6))
+
+
+def benchParallel(args):
+    positions = [ChessEngine.GameState.fromFen(fen) for fen in args.fen]
+    print("depth %d search over %d positions" % (args.depth, len(positions)))
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        with ChessParallel.ParallelSearcher(workers) as searcher:
+            searcher.search(positions[0], 1)  # start the worker processes before timing
+            start = time.perf_counter()
+            nodes = 0
+            for gs in positions:
+                nodes += searcher.search(gs, args.depth).nodes
+            seconds = time.perf_counter() - start
+        if baseline is None:
+            baseline = seconds
+        print("%2d workers: %6.2fs  %8d nodes  %8.0f nodes/s  speedup x%.2f" %
+              (workers, seconds, nodes, nodes / seconds, baseline / seconds))
+
+
+'''
+The undo state of a game from the start position before each of its moves and after the last, decoded from the
+engine's own undo stack as (castling mask, en passant square, halfmove clock, Zobrist key)
+'''
+def _undoStates(gs):
+    states = []
+    for i, state in enumerate(gs.undoStack):
+        enpassantCol = (state >> 4) & 15
+        enpassantPossible = ChessEngine.SQUARES[5 if i % 2 else 2][enpassantCol - 1] if enpassantCol else ()
+        states.append((state & 15, enpassantPossible, state >> 8, gs.zobristLog[i]))
+    states.append((gs.castlingRights, gs.enpassantPossible, gs.halfmoveClock, gs.zobristKey))
+    return states
+
+
+'''
+The undo bookkeeping makeMove and undoMove did before the packed undo stack: a CastleRights copy, the en passant
+square, the halfmove clock and the Zobrist key appended to four lists for every move, and popped back on undo. The
+undo returns the state it restored last, the one at the start of the game.
+'''
+def _listUndoHistory(states):
+    castleRightsLog, enpassantPossibleLog, halfmoveClockLog, zobristLog = [], [], [], []
+    for rights, enpassantPossible, halfmoveClock, zobristKey in states:
+        castleRightsLog.append(ChessEngine.CastleRights.fromMask(rights))
+        enpassantPossibleLog.append(enpassantPossible)
+        halfmoveClockLog.append(halfmoveClock)
+        zobristLog.append(zobristKey)
+    return castleRightsLog, enpassantPossibleLog, halfmoveClockLog, zobristLog
+
+
+def _listUndo(history):
+    castleRightsLog, enpassantPossibleLog, halfmoveClockLog, zobristLog = history
+    restored = None
+    while len(zobristLog) > 1:
+        castleRightsLog.pop()
+        enpassantPossibleLog.pop()
+        halfmoveClockLog.pop()
+        zobristLog.pop()
+        rights = castleRightsLog[-1]
+        restored = (ChessEngine.CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs), enpassantPossibleLog[-1],
+                    halfmoveClockLog[-1], zobristLog[-1])
+    return restored and (restored[0].toMask(),) + restored[1:]
+
+
+'''
+The same with the packed undo stack makeMove and undoMove use now: one int per move, decoded the way undoMove does,
+and an array of Zobrist keys
+'''
+def _packedUndoHistory(states):
+    undoStack, zobristLog = array('I'), array('Q')
+    for rights, enpassantPossible, halfmoveClock, zobristKey in states[:-1]:
+        undoStack.append(rights | (enpassantPossible[1] + 1 if enpassantPossible else 0) << 4 | halfmoveClock << 8)
+        zobristLog.append(zobristKey)
+    zobristLog.append(states[-1][3])
+    return undoStack, zobristLog, len(undoStack) % 2 == 0  # white is to move after an even number of moves
+
+
+def _packedUndo(history):
+    undoStack, zobristLog, whiteToMove = history
+    restored = None
+    while undoStack:
+        whiteToMove = not whiteToMove
+        state = undoStack.pop()
+        enpassantCol = (state >> 4) & 15
+        zobristLog.pop()
+        restored = (state & 15, ChessEngine.SQUARES[2 if whiteToMove else 5][enpassantCol - 1] if enpassantCol else (),
+                    state >> 8, zobristLog[-1])
+    return restored
+
+
+'''
+makeMove + undoMove pairs/s and the memory of the undo history. Next to them, a micro-benchmark of the undo
+bookkeeping alone, in the lists makeMove/undoMove used to keep against the packed stack they keep now. It times only
+the pushing and popping of that state, not whole moves, so it shows what the packing saves, not a change in nodes/s.
+'''
+def benchMakeUndo(args):
+    states = []
+    for line in samplePositions(args.games, args.plies, args.seed):
+        for i in range(0, len(line), 4):
+            gs = replay(ChessEngine.GameState, line[:i])
+            states.append((gs, gs.getValidMoves()))
+    pairs = sum(len(moves) for _, moves in states)
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for gs, moves in states:
+            for move in moves:
+                gs.makeMove(move)
+                gs.undoMove()
+        best = min(best, time.perf_counter() - start)
+    print("makeMove + undoMove: %9.0f pairs/s (best of %d)" % (pairs / best, args.repeat))
+
+    # micro-benchmark: the undo bookkeeping alone, in the lists it replaced against the packed stack, over whole games
+    lines = samplePositions(args.games, args.plies, args.seed)
+    games = [_undoStates(replay(ChessEngine.GameState, line)) for line in lines]
+    plies = sum(len(states) - 1 for states in games)
+    for label, build, undo in (("old lists", _listUndoHistory, _listUndo),
+                               ("packed stack", _packedUndoHistory, _packedUndo)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            restored = [undo(build(states)) for states in games]
+            best = min(best, time.perf_counter() - start)
+        assert restored == [states[0] if len(states) > 1 else None for states in games], label
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        histories = [build(states) for states in games]
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del histories
+        print("undo bookkeeping only, %-12s %9.0f push + pop/s  %6.1f bytes/ply" %
+              (label, plies / best, held / plies))
+
+    # memory held per ply of game history: play a line out with the moves already built, then measure the state
+    gs, line = ChessEngine.GameState(), []
+    for _ in range(args.plies):
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            break
+        line.append(moves[0])
+        gs.makeMove(moves[0])
+    while gs.moveLog:
+        gs.undoMove()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for move in line:
+        gs.makeMove(move)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("undo history: %.1f bytes/ply over %d plies" % (held / len(line), len(line)))
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        nodes = ChessPerft.perft(ChessEngine.GameState(), args.depth)
+        best = min(best, time.perf_counter() - start)
+    print("perft depth %d: %.0f nodes/s (best of %d)" % (args.depth, nodes / best, args.repeat))
+
+
+'''
+Probe latency of the tablebases: random legal positions of every table found, with the strong side either color
+'''
+def benchTablebase(args):
+    import ChessTablebase
+    rng = random.Random(args.seed)
+    with ChessTablebase.Tablebases(args.dir) as tablebases:
+        if not tablebases.tables:
+            print("no tables in %s, build them with: python ChessTablebase.py generate --dir %s" % (args.dir, args.dir))
+            return
+        for name in tablebases.tables:
+            states = []
+            while len(states) < args.positions:
+                whiteKing, blackKing, piece = rng.sample(range(64), 3)
+                if name[1] == 'P' and not 8 <= piece < 56:
+                    continue
+                strong, weak = ('w', 'b') if len(states) % 2 == 0 else ('b', 'w')
+                board = [["--"] * 8 for _ in range(8)]
+                board[whiteKing >> 3][whiteKing & 7] = strong + 'K'
+                board[blackKing >> 3][blackKing & 7] = weak + 'K'
+                board[piece >> 3][piece & 7] = strong + name[1]
+                gs = ChessEngine.GameState()
+                gs.setPosition(board, rng.random() < 0.5, 0)
+                if tablebases.probe(gs) is not None:  # skips the illegal ones
+                    states.append(gs)
+            latencies = []
+            for gs in states:
+                start = time.perf_counter_ns()
+                tablebases.probe(gs)
+                latencies.append(time.perf_counter_ns() - start)
+            latencies.sort()
+            best = min(timeit.repeat(lambda: [tablebases.probe(gs) for gs in states], number=1, repeat=args.repeat))
+            print("%s probe: median %.2f us, p99 %.2f us, %9.0f probes/s (best of %d over %d positions)" %
+                  (name, latencies[len(latencies) // 2] / 1000, latencies[len(latencies) * 99 // 100] / 1000,
+                   len(states) / best, args.repeat, len(states)))
+
+
+'''
+The multi-game server: memory held per idle game against a GameState per game, then move request latency over the
+socket with every game open, from several concurrent clients
+'''
+def benchServer(args):
+    import asyncio
+    import ChessServer
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [ChessEngine.GameState() for _ in range(min(args.games, 1000))]
+    perState = (tracemalloc.get_traced_memory()[0] - before) / len(states)
+    del states
+    gc.collect()  # a GameState refers to itself through its bound move functions, so only the collector frees it
+    server = ChessServer.GameServer(args.workers, args.max_pending, args.depth)
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(args.games):
+        server.newGame()
+    perGame = (tracemalloc.get_traced_memory()[0] - before) / args.games
+    tracemalloc.stop()
+    server.games.clear()
+    print("memory per idle game: %.0f bytes (a GameState: %.0f bytes)" % (perGame, perState))
+
+    async def client(port, gameIDs, latencies):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for i in range(args.requests // args.clients):
+            command = "go %d %d" % (gameIDs[i % len(gameIDs)], args.depth) if i % 2 else \
+                "fen %d" % gameIDs[i % len(gameIDs)]
+            start = time.perf_counter()
+            writer.write((command + "\n").encode("ascii"))
+            answer = (await reader.readline()).decode("ascii")
+            latencies[command.split()[0]].append(time.perf_counter() - start)
+            if not answer.startswith("ok"):
+                raise RuntimeError("%s: %s" % (command, answer))
+        writer.close()
+
+    async def run():
+        ready = asyncio.get_running_loop().create_future()
+        serving = asyncio.ensure_future(server.serve(port=0, ready=ready))
+        port = await ready
+        gameIDs = [server.newGame() for _ in range(args.games)]
+        warmUp = [server.execute("go %d 1" % gameID) for gameID in gameIDs[:args.workers]]
+        await asyncio.gather(*warmUp)  # start the worker processes before timing
+        latencies = {"go": [], "fen": []}
+        start = time.perf_counter()
+        await asyncio.gather(*(client(port, gameIDs[i::args.clients], latencies) for i in range(args.clients)))
+        seconds = time.perf_counter() - start
+        serving.cancel()
+        return latencies, seconds
+
+    try:
+        latencies, seconds = asyncio.run(run())
+    finally:
+        server.close()
+    print("%d open games, %d clients, %d workers:" % (args.games, args.clients, args.workers))
+    for command, label in (("fen", "fen (no search)"), ("go", "go depth %d" % args.depth)):
+        times = sorted(latencies[command])
+        print("  %-16s median %7.2f ms  p99 %7.2f ms  over %d requests" %
+              (label, times[len(times) // 2] * 1000, times[len(times) * 99 // 100] * 1000, len(times)))
+    print("  %.0f requests/s" % (sum(len(times) for times in latencies.values()) / seconds))
+
+
+'''
+NumPy batch encoding and evaluation throughput in positions/s, against ChessAI.evaluate one position at a time
+'''
+def benchBatch(args):
+    import ChessAI
+    import ChessBatch
+    import ChessBinary
+    ChessBatch.requireNumpy()
+    sample = [replay(ChessEngine.GameState, line[:i]) for line in samplePositions(args.games, args.plies, args.seed)
+              for i in range(0, len(line), 4)]
+    states = (sample * (args.positions // len(sample) + 1))[:args.positions]
+    packed = ChessBinary.packPositions(states)
+
+    def rate(label, function):
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        print("%-34s %10.0f positions/s" % (label, len(states) / best))
+
+    rate("ChessAI.evaluate, one at a time", lambda: [ChessAI.evaluate(gs) for gs in states])
+    rate("encode GameStates", lambda: ChessBatch.encodeStates(states))
+    rate("encode ChessBinary buffer", lambda: ChessBatch.encodePacked(packed))
+    codes, whiteToMove = ChessBatch.encodeStates(states)
+    rate("one-hot (N, 12, 8, 8)", lambda: ChessBatch.oneHot(codes))
+    rate("material + piece-square", lambda: ChessBatch.evaluateBatch(codes, whiteToMove, 0))
+    rate("material + piece-square + mobility", lambda: ChessBatch.evaluateBatch(codes, whiteToMove))
+    featureRows = ChessBatch.features(codes, whiteToMove)
+    linear = ChessBatch.LinearEvaluator.fromStatic()
+    rate("linear evaluator", lambda: linear.evaluate(featureRows))
+    mlp = ChessBatch.MLPEvaluator(args.hidden)
+    rate("MLP evaluator (%d hidden)" % args.hidden, lambda: mlp.evaluate(featureRows))
+
+
+IMPORT_PROBE = ("import sys, time; start = time.perf_counter(); import %s; "
+                "print(time.perf_counter() - start, 'pygame' in sys.modules)")
+
+
+def benchStartup(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in ("ChessEngine", "ChessPerft", "ChessAI"):
+        times = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-c", IMPORT_PROBE % module], cwd=here, capture_output=True,
+                                    text=True, check=True).stdout.split()
+            times.append(float(output[0]))
+        print("import %-12s median %6.1f ms over %d fresh interpreters, pygame imported: %s" %
+              (module, statistics.median(times) * 1000, args.runs, output[1]))
+
+    # GUI side: decoding and scaling the 12 piece PNGs, against building and then reusing the cached atlas
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.chdir(here)
+    import pygame
+    import ChessMain
+    pygame.display.init()
+    pygame.display.set_mode((ChessMain.WIDTH, ChessMain.HEIGHT))
+    start = time.perf_counter()
+    for piece in ChessMain.PIECES:
+        pygame.transform.scale(pygame.image.load("images/" + piece + ".png"), (ChessMain.SQ_SIZE, ChessMain.SQ_SIZE))
+    print("sprites: decode + scale 12 PNGs  %7.1f ms" % ((time.perf_counter() - start) * 1000))
+    atlasDir = ChessMain.ATLAS_DIR
+    with tempfile.TemporaryDirectory() as scratch:
+        ChessMain.ATLAS_DIR = scratch  # a cold cache without touching the user's cached atlas
+        try:
+            for label in ("atlas, cold (build + save)", "atlas, cached on disk"):
+                ChessMain.IMAGES.clear()
+                start = time.perf_counter()
+                ChessMain.IMAGES["wP"]
+                print("sprites: %-26s %7.1f ms" % (label, (time.perf_counter() - start) * 1000))
+        finally:
+            ChessMain.ATLAS_DIR = atlasDir
+            ChessMain.IMAGES.clear()
+    pygame.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chess engine benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    backends = subparsers.add_parser("backends", help="list-of-strings board vs bitboard backend")
+    backends.add_argument("--games", type=int, default=20)
+    backends.add_argument("--plies", type=int, default=80)
+    backends.add_argument("--seed", type=int, default=1)
+    backends.add_argument("--repeat", type=int, default=3)
+    backends.add_argument("--depth", type=int, default=3)
+    backends.set_defaults(run=benchBackends)
+
+    moves = subparsers.add_parser("moves", help="Move construction time and memory")
+    moves.add_argument("--count", type=int, default=100000)
+    moves.add_argument("--repeat", type=int, default=2000)
+    moves.set_defaults(run=benchMoves)
+
+    parallel = subparsers.add_parser("parallel", help="parallel search speedup from 1 to N worker processes")
+    parallel.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parallel.add_argument("--depth", type=int, default=4)
+    parallel.add_argument("--fen", action="append", default=None)
+    parallel.set_defaults(run=benchParallel)
+
+    makeUndo = subparsers.add_parser("makeundo", help="makeMove/undoMove speed and history memory")
+    makeUndo.add_argument("--games", type=int, default=20)
+    makeUndo.add_argument("--plies", type=int, default=80)
+    makeUndo.add_argument("--seed", type=int, default=1)
+    makeUndo.add_argument("--repeat", type=int, default=3)
+    makeUndo.add_argument("--depth", type=int, default=3)
+    makeUndo.set_defaults(run=benchMakeUndo)
+
+    tablebase = subparsers.add_parser("tablebase", help="tablebase probe latency")
+    tablebase.add_argument("--dir", default="tablebases")
+    tablebase.add_argument("--positions", type=int, default=20000)
+    tablebase.add_argument("--seed", type=int, default=1)
+    tablebase.add_argument("--repeat", type=int, default=3)
+    tablebase.set_defaults(run=benchTablebase)
+
+    server = subparsers.add_parser("server", help="multi-game server memory per game and request latency")
+    server.add_argument("--games", type=int, default=5000)
+    server.add_argument("--clients", type=int, default=16)
+    server.add_argument("--requests", type=int, default=2000)
+    server.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    server.add_argument("--max-pending", type=int, default=64)
+    server.add_argument("--depth", type=int, default=1)
+    server.set_defaults(run=benchServer)
+
+    batch = subparsers.add_parser("batch", help="NumPy batch encoding and evaluation throughput")
+    batch.add_argument("--positions", type=int, default=100000)
+    batch.add_argument("--games", type=int, default=20)
+    batch.add_argument("--plies", type=int, default=80)
+    batch.add_argument("--seed", type=int, default=1)
+    batch.add_argument("--repeat", type=int, default=3)
+    batch.add_argument("--hidden", type=int, default=32)
+    batch.set_defaults(run=benchBatch)
+
+    startup = subparsers.add_parser("startup", help="engine import time and GUI sprite loading")
+    startup.add_argument("--runs", type=int, default=7)
+    startup.set_defaults(run=benchStartup)
+
+    args = parser.parse_args()
+    if args.benchmark == "parallel" and args.fen is None:
+        args.fen = [ChessPerft.START_FEN, ChessPerft.REFERENCE_POSITIONS["kiwipete"][0]]
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Packed binary positions. Every position takes exactly POSITION_SIZE (32) bytes, so a stream of positions is just a
+bytes-like buffer that can be sliced with a memoryview, written to a file or sent between processes without FEN text or
+pickled GameState objects. The layout, big endian:
+    bytes  0-7   occupancy: bit r * 8 + c is set when (r, c) holds a piece
+    bytes  8-23  a 4-bit piece code per occupied square in square order, high nibble first (at most 32 pieces)
+    byte   24    bit 0 black to move, bits 1-4 castling rights wks, wqs, bks, bqs
+    byte   25    en passant column + 1, 0 for none (the row follows from the side to move)
+    bytes 26-27  halfmove clock
+    bytes 28-29  fullmove number
+    bytes 30-31  zero
+"""
+import struct
+
+import ChessEngine
+
+POSITION_SIZE = 32
+_LAYOUT = struct.Struct(">Q16sBBHH2x")
+
+PIECE_CODES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+_CODE_OF = {piece: code for code, piece in enumerate(PIECE_CODES)}
+
+
+'''
+Write the packed form of gs into buffer at offset
+'''
+def packPositionInto(gs, buffer, offset=0):
+    occupancy = 0
+    nibbles = bytearray(16)
+    count = 0
+    bit = 1 << 63  # square (0, 0) is the most significant bit, so occupied squares come out in square order
+    for row in gs.board:
+        for piece in row:
+            if piece != "--":
+                if count == 32:
+                    raise ValueError("more than 32 pieces on the board")
+                occupancy |= bit
+                if count & 1:
+                    nibbles[count >> 1] |= _CODE_OF[piece]
+                else:
+                    nibbles[count >> 1] = _CODE_OF[piece] << 4
+                count += 1
+            bit >>= 1
+    flags = (not gs.whiteToMove) | gs.castlingRights << 1  # the mask bits are already in wks, wqs, bks, bqs order
+    enpassant = gs.enpassantPossible[1] + 1 if gs.enpassantPossible != () else 0
+    if not (0 <= gs.halfmoveClock <= 0xFFFF and 0 <= gs.fullmoveNumber <= 0xFFFF):
+        raise ValueError("move counters don't fit in 16 bits")
+    _LAYOUT.pack_into(buffer, offset, occupancy, bytes(nibbles), flags, enpassant, gs.halfmoveClock,
+                      gs.fullmoveNumber)
+
+
+def packPosition(gs):
+    buffer = bytearray(POSITION_SIZE)
+    packPositionInto(gs, buffer)
+    return bytes(buffer)
+
+
+'''
+Pack a sequence of game states into one buffer of len(states) * POSITION_SIZE bytes
+'''
+def packPositions(states):
+    states = list(states)
+    buffer = bytearray(len(states) * POSITION_SIZE)
+    for i, gs in enumerate(states):
+        packPositionInto(gs, buffer, i * POSITION_SIZE)
+    return buffer
+
+
+'''
+Load the position packed at offset of a bytes-like buffer into gs (a new ChessEngine.GameState when None) and return it
+'''
+def unpackPosition(buffer, gs=None, offset=0):
+    occupancy, nibbles, flags, enpassant, halfmoveClock, fullmoveNumber = _LAYOUT.unpack_from(buffer, offset)
+    board = []
+    count = 0
+    bit = 1 << 63
+    for r in range(8):
+        row = []
+        for c in range(8):
+            if occupancy & bit:
+                code = nibbles[count >> 1] & 0x0F if count & 1 else nibbles[count >> 1] >> 4
+                if code >= len(PIECE_CODES):
+                    raise ValueError("bad piece code %d in packed position" % code)
+                row.append(PIECE_CODES[code])
+                count += 1
+            else:
+                row.append("--")
+            bit >>= 1
+        board.append(row)
+    whiteToMove = not flags & 1
+    enpassantPossible = ((2 if whiteToMove else 5), enpassant - 1) if enpassant else ()
+    if gs is None:
+        gs = ChessEngine.GameState()
+    gs.setPosition(board, whiteToMove, (flags >> 1) & ChessEngine.ALL_CASTLING, enpassantPossible, halfmoveClock,
+                   fullmoveNumber)
+    return gs
+
+
+'''
+Decode every position of a packed buffer in order. The buffer is read through a memoryview, so nothing is copied. With
+gs given, every position is loaded into that same object, which saves allocating a GameState per position when each one
+is used and dropped before the next.
+'''
+def unpackPositions(buffer, gs=None, gameStateClass=ChessEngine.GameState):
+    view = memoryview(buffer)
+    if len(view) % POSITION_SIZE:
+        raise ValueError("buffer length %d is not a multiple of %d" % (len(view), POSITION_SIZE))
+    for offset in range(0, len(view), POSITION_SIZE):
+        yield unpackPosition(view, gs if gs is not None else gameStateClass(), offset)
@@ -0,0 +1,284 @@
+"""
+Optional bitboard backend for the GameState. Every piece type of each color is kept as a 64-bit integer (bit r*8+c is
+set when that piece stands on row r, col c), next to the usual list-of-strings board so that ChessMain keeps working
+unchanged. Knight, king and pawn attacks come from precomputed tables and sliding attacks from per-square tables that
+are indexed by the blocking pieces on the slider's lines, filled the first time each occupancy is seen.
+
+The slider tables are a deliberate simplification of magic bitboards: a dict keyed by the masked occupancy stands in
+for the magic multiply and shift. In CPython the 64-bit multiply is a bignum operation, and a magic lookup measured
+about 25% slower than the dict lookup, while filling the full magic tables up front took about 0.45s at import. With
+the dicts, `ChessBench.py backends` measures this backend at x1.6-2.1 the getValidMoves rate of the list-of-strings
+board and x1.1-1.7 its depth 3 tree walk (noisy runs on one machine).
+"""
+
+from ChessEngine import GameState, Move
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def _bit(r, c):
+    return 1 << (r * 8 + c)
+
+
+def _leaperTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= _bit(r + dr, c + dc)
+        table.append(bb)
+    return table
+
+
+def _slide(sq, directions, occupied):
+    r, c = divmod(sq, 8)
+    bb = 0
+    for dr, dc in directions:
+        endRow, endCol = r + dr, c + dc
+        while 0 <= endRow < 8 and 0 <= endCol < 8:
+            bb |= _bit(endRow, endCol)
+            if occupied & _bit(endRow, endCol):
+                break
+            endRow += dr
+            endCol += dc
+    return bb
+
+
+def _relevantMask(sq, directions):
+    """The squares whose occupancy can change the slider's attacks (the board edge never blocks anything)."""
+    r, c = divmod(sq, 8)
+    bb = 0
+    for dr, dc in directions:
+        endRow, endCol = r + dr, c + dc
+        while 0 <= endRow + dr < 8 and 0 <= endCol + dc < 8:
+            bb |= _bit(endRow, endCol)
+            endRow += dr
+            endCol += dc
+    return bb
+
+
+KNIGHT_ATTACKS = _leaperTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _leaperTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+PAWN_ATTACKS = {'w': _leaperTable(((-1, -1), (-1, 1))), 'b': _leaperTable(((1, -1), (1, 1)))}
+ROOK_MASKS = [_relevantMask(sq, ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_MASKS = [_relevantMask(sq, BISHOP_DIRECTIONS) for sq in range(64)]
+ROOK_TABLES = [{} for _ in range(64)]
+BISHOP_TABLES = [{} for _ in range(64)]
+
+
+def _lineTables():
+    """BETWEEN[a][b] holds the squares strictly between two aligned squares, LINE[a][b] the whole line through both."""
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full = _slide(sq, ((dr, dc), (-dr, -dc)), 0) | (1 << sq)
+            squaresBetween = 0
+            for i in range(1, 8):
+                endRow, endCol = r + dr * i, c + dc * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                    break
+                between[sq][endRow * 8 + endCol] = squaresBetween
+                line[sq][endRow * 8 + endCol] = full
+                squaresBetween |= _bit(endRow, endCol)
+    return between, line
+
+
+BETWEEN, LINE = _lineTables()
+
+
+def rookAttacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    table = ROOK_TABLES[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = _slide(sq, ROOK_DIRECTIONS, key)
+    return attacks
+
+
+def bishopAttacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    table = BISHOP_TABLES[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = _slide(sq, BISHOP_DIRECTIONS, key)
+    return attacks
+
+
+def squares(bb):
+    """Yield the square index of every set bit, lowest first."""
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+class BitboardGameState(GameState):
+    def __init__(self):
+        super().__init__()
+        self.syncBitboards()
+
+    '''
+    Rebuild every bitboard from self.board
+    '''
+    def syncBitboards(self):
+        self.bitboards = dict.fromkeys(PIECES, 0)
+        self.occupancy = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[piece] |= _bit(r, c)
+                    self.occupancy[piece[0]] |= _bit(r, c)
+
+    def refreshDerivedState(self):
+        super().refreshDerivedState()
+        self.syncBitboards()
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.toggleMoveBits(move)
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            super().undoMove()
+            self.toggleMoveBits(move)
+
+    '''
+    Flip the bits changed by a move. XOR is its own inverse, so the same call applies the move and takes it back.
+    '''
+    def toggleMoveBits(self, move):
+        bitboards = self.bitboards
+        color = move.pieceMoved[0]
+        fromBit = _bit(move.startRow, move.startCol)
+        toBit = _bit(move.endRow, move.endCol)
+        bitboards[move.pieceMoved] ^= fromBit
+        bitboards[color + 'Q' if move.isPawnPromotion else move.pieceMoved] ^= toBit
+        self.occupancy[color] ^= fromBit | toBit
+        if move.pieceCaptured != "--":
+            captureBit = _bit(move.startRow, move.endCol) if move.isEnpassantMove else toBit
+            bitboards[move.pieceCaptured] ^= captureBit
+            self.occupancy[move.pieceCaptured[0]] ^= captureBit
+        if move.isCastleMove:
+            if move.endCol - move.startCol == 2:  # King side castle
+                rookBits = _bit(move.endRow, move.endCol + 1) | _bit(move.endRow, move.endCol - 1)
+            else:  # Queen side castle
+                rookBits = _bit(move.endRow, move.endCol - 2) | _bit(move.endRow, move.endCol + 1)
+            bitboards[color + 'R'] ^= rookBits
+            self.occupancy[color] ^= rookBits
+
+    '''
+    Return a bitboard of the pieces of the given color attacking square sq, given the occupied squares
+    '''
+    def attackersTo(self, sq, color, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[color + 'Q']
+        return (KNIGHT_ATTACKS[sq] & bitboards[color + 'N']) | (KING_ATTACKS[sq] & bitboards[color + 'K']) | \
+            (PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & bitboards[color + 'P']) | \
+            (rookAttacks(sq, occupied) & (bitboards[color + 'R'] | queens)) | \
+            (bishopAttacks(sq, occupied) & (bitboards[color + 'B'] | queens))
+
+    def squareUnderAttack(self, r, c):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.attackersTo(r * 8 + c, enemyColor, self.occupancy['w'] | self.occupancy['b']) != 0
+
+    '''
+    All legal moves, generated with bitboards. Produces the same moves as GameState.getValidMoves.
+    '''
+    def getValidMoves(self):
+        allyColor, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        bitboards = self.bitboards
+        board = self.board
+        allies = self.occupancy[allyColor]
+        enemies = self.occupancy[enemyColor]
+        occupied = allies | enemies
+        kingSq = bitboards[allyColor + 'K'].bit_length() - 1
+        checkers = self.attackersTo(kingSq, enemyColor, occupied)
+        moves = []
+
+        # King moves: the king is lifted off the board so that sliders see through its old square
+        kingRow, kingCol = divmod(kingSq, 8)
+        withoutKing = occupied ^ (1 << kingSq)
+        for sq in squares(KING_ATTACKS[kingSq] & ~allies):
+            if not self.attackersTo(sq, enemyColor, withoutKing):
+                moves.append(Move((kingRow, kingCol), divmod(sq, 8), board))
+
+        if checkers & (checkers - 1):  # double check, only the king can move
+            self.setGameOverFlags(moves, True)
+            return moves
+
+        if checkers:
+            checkerSq = checkers.bit_length() - 1
+            targetMask = checkers | BETWEEN[kingSq][checkerSq]
+        else:
+            targetMask = ~allies & 0xFFFFFFFFFFFFFFFF
+
+        # Pinned pieces: enemy sliders that would see the king if exactly one of our pieces were removed
+        pinLines = {}
+        queens = bitboards[enemyColor + 'Q']
+        snipers = (rookAttacks(kingSq, enemies) & (bitboards[enemyColor + 'R'] | queens)) | \
+            (bishopAttacks(kingSq, enemies) & (bitboards[enemyColor + 'B'] | queens))
+        for sniperSq in squares(snipers):
+            blockers = BETWEEN[kingSq][sniperSq] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & allies:
+                pinLines[blockers.bit_length() - 1] = LINE[kingSq][sniperSq]
+
+        for pieceType in ('N', 'B', 'R', 'Q'):
+            for sq in squares(bitboards[allyColor + pieceType]):
+                if pieceType == 'N':
+                    attacks = KNIGHT_ATTACKS[sq]
+                elif pieceType == 'B':
+                    attacks = bishopAttacks(sq, occupied)
+                elif pieceType == 'R':
+                    attacks = rookAttacks(sq, occupied)
+                else:
+                    attacks = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+                attacks &= targetMask & ~allies
+                if sq in pinLines:
+                    attacks &= pinLines[sq]
+                startSq = divmod(sq, 8)
+                for endSq in squares(attacks):
+                    moves.append(Move(startSq, divmod(endSq, 8), board))
+
+        self.getPawnBitboardMoves(allyColor, enemyColor, kingSq, occupied, targetMask, pinLines, moves)
+
+        if not checkers:
+            self.getCastleMoves(kingRow, kingCol, moves)
+        self.setGameOverFlags(moves, checkers != 0)
+        return moves
+
+    def getPawnBitboardMoves(self, allyColor, enemyColor, kingSq, occupied, targetMask, pinLines, moves):
+        board = self.board
+        enemies = self.occupancy[enemyColor]
+        step = -8 if allyColor == 'w' else 8
+        startRow = 6 if allyColor == 'w' else 1
+        epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1] if self.enpassantPossible != () else -1
+        for sq in squares(self.bitboards[allyColor + 'P']):
+            lineMask = pinLines.get(sq, 0xFFFFFFFFFFFFFFFF)
+            startSq = divmod(sq, 8)
+            pushSq = sq + step
+            if not occupied & (1 << pushSq):  # 1 square pawn advance
+                if (1 << pushSq) & targetMask & lineMask:
+                    moves.append(Move(startSq, divmod(pushSq, 8), board))
+                doubleSq = pushSq + step
+                if startSq[0] == startRow and not occupied & (1 << doubleSq) and (1 << doubleSq) & targetMask & lineMask:
+                    moves.append(Move(startSq, divmod(doubleSq, 8), board))
+            attacks = PAWN_ATTACKS[allyColor][sq]
+            for endSq in squares(attacks & enemies & targetMask & lineMask):
+                moves.append(Move(startSq, divmod(endSq, 8), board))
+            if epSq >= 0 and attacks & (1 << epSq):
+                capturedSq = startSq[0] * 8 + epSq % 8
+                # Play the capture out on the bitboards: both pawns leave the rank, which can uncover the king
+                after = (occupied ^ (1 << sq) ^ (1 << capturedSq)) | (1 << epSq)
+                enemyPawns = self.bitboards[enemyColor + 'P']
+                self.bitboards[enemyColor + 'P'] = enemyPawns ^ (1 << capturedSq)
+                safe = not self.attackersTo(kingSq, enemyColor, after)
+                self.bitboards[enemyColor + 'P'] = enemyPawns
+                if safe:
+                    moves.append(Move(startSq, divmod(epSq, 8), board, isEnpassantMove=True))
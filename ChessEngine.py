@@ -2,8 +2,171 @@
 This class is responsible for storing all the information about the current state of a chess game. It will also be
 responsible for determining the valid moves at the current state. It will also keep a move log.
 """
+from array import array
+
+
+def _targets(offsets):
+    return [[[(r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8]
+             for c in range(8)] for r in range(8)]
+
+
+def _rays(directions):
+    return [[[[(r + dr * i, c + dc * i) for i in range(1, 8) if 0 <= r + dr * i < 8 and 0 <= c + dc * i < 8]
+              for dr, dc in directions] for c in range(8)] for r in range(8)]
+
+
+# Precomputed target squares for every (row, col), used by the attack queries
+KNIGHT_TARGETS = _targets(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_TARGETS = _targets(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+ROOK_RAYS = _rays(((-1, 0), (0, -1), (1, 0), (0, 1)))
+BISHOP_RAYS = _rays(((-1, -1), (-1, 1), (1, -1), (1, 1)))
+
+def _splitmix64(seed):
+    """Deterministic stream of 64-bit pseudo random numbers; avoids importing random just to seed the Zobrist keys."""
+    mask = (1 << 64) - 1
+    while True:
+        seed = (seed + 0x9E3779B97F4A7C15) & mask
+        z = ((seed ^ (seed >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        yield z ^ (z >> 31)
+
+
+# Zobrist keys: one random 64-bit number per (piece, row, col), for black to move, per castling right and per en passant
+# column. A position's key is the XOR of the numbers for everything in it. The seed is fixed so keys are stable.
+_zobristRandom = _splitmix64(0x5EED)
+ZOBRIST_PIECES = {color + piece: [[next(_zobristRandom) for c in range(8)] for r in range(8)]
+                  for color in "wb" for piece in "PNBRQK"}
+ZOBRIST_BLACK_TO_MOVE = next(_zobristRandom)
+ZOBRIST_CASTLING = {right: next(_zobristRandom) for right in ("wks", "bks", "wqs", "bqs")}
+ZOBRIST_ENPASSANT = [next(_zobristRandom) for c in range(8)]
+
+# Castling rights are kept as a 4-bit mask of these
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+ALL_CASTLING = WKS | WQS | BKS | BQS
+
+# The rights that survive a move from or to each square: moving the king or a rook, or capturing a rook on its corner,
+# clears the matching rights
+CASTLING_KEPT = [[ALL_CASTLING] * 8 for r in range(8)]
+CASTLING_KEPT[7][4] = ALL_CASTLING & ~(WKS | WQS)
+CASTLING_KEPT[7][7] = ALL_CASTLING & ~WKS
+CASTLING_KEPT[7][0] = ALL_CASTLING & ~WQS
+CASTLING_KEPT[0][4] = ALL_CASTLING & ~(BKS | BQS)
+CASTLING_KEPT[0][7] = ALL_CASTLING & ~BKS
+CASTLING_KEPT[0][0] = ALL_CASTLING & ~BQS
+
+# Each castling right with the home squares its king and rook must stand on
+CASTLING_HOMES = ((WKS, "wK", (7, 4), (7, 7)), (WQS, "wK", (7, 4), (7, 0)),
+                  (BKS, "bK", (0, 4), (0, 7)), (BQS, "bK", (0, 4), (0, 0)))
+
+# Zobrist key of every castling mask
+ZOBRIST_CASTLING_KEYS = [(ZOBRIST_CASTLING["wks"] if mask & WKS else 0) ^ (ZOBRIST_CASTLING["wqs"] if mask & WQS else 0) ^
+                         (ZOBRIST_CASTLING["bks"] if mask & BKS else 0) ^ (ZOBRIST_CASTLING["bqs"] if mask & BQS else 0)
+                         for mask in range(16)]
+
+# Material value of each piece type in centipawns
+pieceScore = {'K': 0, 'Q': 900, 'R': 500, 'B': 330, 'N': 320, 'P': 100}
+
+# Piece-square tables from white's point of view, row 0 is the 8th rank. Black reads them mirrored.
+knightScores = [[-50, -40, -30, -30, -30, -30, -40, -50],
+                [-40, -20, 0, 0, 0, 0, -20, -40],
+                [-30, 0, 10, 15, 15, 10, 0, -30],
+                [-30, 5, 15, 20, 20, 15, 5, -30],
+                [-30, 0, 15, 20, 20, 15, 0, -30],
+                [-30, 5, 10, 15, 15, 10, 5, -30],
+                [-40, -20, 0, 5, 5, 0, -20, -40],
+                [-50, -40, -30, -30, -30, -30, -40, -50]]
+bishopScores = [[-20, -10, -10, -10, -10, -10, -10, -20],
+                [-10, 0, 0, 0, 0, 0, 0, -10],
+                [-10, 0, 5, 10, 10, 5, 0, -10],
+                [-10, 5, 5, 10, 10, 5, 5, -10],
+                [-10, 0, 10, 10, 10, 10, 0, -10],
+                [-10, 10, 10, 10, 10, 10, 10, -10],
+                [-10, 5, 0, 0, 0, 0, 5, -10],
+                [-20, -10, -10, -10, -10, -10, -10, -20]]
+rookScores = [[0, 0, 0, 0, 0, 0, 0, 0],
+              [5, 10, 10, 10, 10, 10, 10, 5],
+              [-5, 0, 0, 0, 0, 0, 0, -5],
+              [-5, 0, 0, 0, 0, 0, 0, -5],
+              [-5, 0, 0, 0, 0, 0, 0, -5],
+              [-5, 0, 0, 0, 0, 0, 0, -5],
+              [-5, 0, 0, 0, 0, 0, 0, -5],
+              [0, 0, 0, 5, 5, 0, 0, 0]]
+queenScores = [[-20, -10, -10, -5, -5, -10, -10, -20],
+               [-10, 0, 0, 0, 0, 0, 0, -10],
+               [-10, 0, 5, 5, 5, 5, 0, -10],
+               [-5, 0, 5, 5, 5, 5, 0, -5],
+               [0, 0, 5, 5, 5, 5, 0, -5],
+               [-10, 5, 5, 5, 5, 5, 0, -10],
+               [-10, 0, 5, 0, 0, 0, 0, -10],
+               [-20, -10, -10, -5, -5, -10, -10, -20]]
+pawnScores = [[0, 0, 0, 0, 0, 0, 0, 0],
+              [50, 50, 50, 50, 50, 50, 50, 50],
+              [10, 10, 20, 30, 30, 20, 10, 10],
+              [5, 5, 10, 25, 25, 10, 5, 5],
+              [0, 0, 0, 20, 20, 0, 0, 0],
+              [5, -5, -10, 0, 0, -10, -5, 5],
+              [5, 10, 10, -20, -20, 10, 10, 5],
+              [0, 0, 0, 0, 0, 0, 0, 0]]
+kingScores = [[-30, -40, -40, -50, -50, -40, -40, -30],
+              [-30, -40, -40, -50, -50, -40, -40, -30],
+              [-30, -40, -40, -50, -50, -40, -40, -30],
+              [-30, -40, -40, -50, -50, -40, -40, -30],
+              [-20, -30, -30, -40, -40, -30, -30, -20],
+              [-10, -20, -20, -20, -20, -20, -20, -10],
+              [20, 20, 0, 0, 0, 0, 20, 20],
+              [20, 30, 10, 0, 0, 10, 30, 20]]
+piecePositionScores = {'wN': knightScores, 'bN': knightScores[::-1], 'wB': bishopScores, 'bB': bishopScores[::-1],
+                       'wR': rookScores, 'bR': rookScores[::-1], 'wQ': queenScores, 'bQ': queenScores[::-1],
+                       'wP': pawnScores, 'bP': pawnScores[::-1], 'wK': kingScores, 'bK': kingScores[::-1]}
+
+# The piece-square score of every piece on every square from white's point of view (negative for black pieces), so the
+# positional total is a plain sum
+SIGNED_POSITION_SCORES = {piece: [[value if piece[0] == 'w' else -value for value in row] for row in table]
+                          for piece, table in piecePositionScores.items()}
+
+# One shared (row, col) tuple per square, so king moves and en passant squares don't build new tuples
+SQUARES = [[(r, c) for c in range(8)] for r in range(8)]
+
+# FEN letter to board piece, e.g. 'n' -> "bN"
+FEN_PIECES = {(letter if color == 'w' else letter.lower()): color + letter for color in "wb" for letter in "PNBRQK"}
+
+# EPD opcodes whose operand is a quoted string
+EPD_STRING_OPCODES = {"id"} | {"c%d" % i for i in range(10)}
+
+'''
+Split the operations part of an EPD line into a dict of opcode to operand. Semicolons inside quoted operands don't end
+the operation, and the quotes around a string operand are dropped.
+'''
+def parseEpdOperations(text):
+    operations = {}
+    current = ""
+    inQuotes = False
+    for char in text + ";":
+        if char == '"':
+            inQuotes = not inQuotes
+        elif char == ';' and not inQuotes:
+            parts = current.strip().split(None, 1)
+            if parts:
+                operand = parts[1] if len(parts) > 1 else ""
+                operations[parts[0]] = operand
+            current = ""
+            continue
+        current += char
+    for opcode, operand in operations.items():
+        if len(operand) >= 2 and operand[0] == operand[-1] == '"':
+            operations[opcode] = operand[1:-1]
+    return operations
+
+
+'''
+Most valuable victim, least valuable attacker: prefer capturing big pieces with small ones
+'''
+def mvvLva(move):
+    victim = pieceScore['P'] if move.isEnpassantMove else pieceScore.get(move.pieceCaptured[1], 0)
+    if move.isPawnPromotion:
+        victim += pieceScore['Q']
+    return victim * 10 - pieceScore[move.pieceMoved[1]] // 10
 
-from pygame.constants import WINDOWHITTEST
 
 
 class GameState():
@@ -33,23 +196,36 @@ class GameState():
         self.blackKingLocation = (0, 4)
         self.checkmate = False
         self.stalemate = False
+        self.draw = False   # set by getValidMoves along with checkmate and stalemate, with the reason in drawReason
+        self.drawReason = None
         self.enpassantPossible = ()     #coordinates for the square where en passant capture is possible
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.castlingRights = ALL_CASTLING  # mask of WKS, WQS, BKS, BQS
+        self.halfmoveClock = 0  # plies since the last capture or pawn move, for the fifty move rule
+        self.fullmoveNumber = 1  # starts at 1 and goes up after every black move, as in FEN
+        # What undoMove can't work out from the move itself, one packed int per move: castling mask, en passant
+        # column + 1 and halfmove clock from before the move. Restoring is by value, nothing is allocated per move.
+        self.undoStack = array('I')
+        self.zobristKey = self.computeZobristKey()  # 64-bit identity of the position, updated by makeMove/undoMove
+        self.zobristLog = array('Q', [self.zobristKey])  # key of every position in the game, for repetitions
+        self.countPieces()
 
     '''
     Takes a move as a paramater and executes it (This will not work for castling, en-passant, and pawn promotion)
     '''
     def makeMove(self, move):
+        oldEnpassantPossible = self.enpassantPossible
+        oldCastlingRights = self.castlingRights
+        self.undoStack.append(oldCastlingRights | (oldEnpassantPossible[1] + 1 if oldEnpassantPossible else 0) << 4 |
+                              self.halfmoveClock << 8)
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)  # log the move so we can undo it later
         self.whiteToMove = not self.whiteToMove  # swap players
         #     Update King's Location if moved
         if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
+            self.whiteKingLocation = SQUARES[move.endRow][move.endCol]
         elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
+            self.blackKingLocation = SQUARES[move.endRow][move.endCol]
 
         # Pawn Promotion
         if move.isPawnPromotion:
@@ -62,7 +238,7 @@ class GameState():
         
         # Update enpassantPossible variable 
         if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow)//2, move.startCol)
+            self.enpassantPossible = SQUARES[(move.startRow + move.endRow)//2][move.startCol]
         else:
             self.enpassantPossible = ()
 
@@ -78,7 +254,60 @@ class GameState():
 
         # Update Castling Rights - whenever its a rook or a king move
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+
+        # Move counters
+        if move.pieceMoved[1] == 'P' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
+
+        # Update the Zobrist key with only what this move changed
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE  # side to move always changes
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol]
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]  # promoted piece too
+        if move.pieceCaptured != '--':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][captureRow][move.endCol]
+        if move.isCastleMove:
+            rookKeys = ZOBRIST_PIECES[move.pieceMoved[0] + 'R'][move.endRow]
+            if move.endCol - move.startCol == 2:    #King side castle
+                key ^= rookKeys[move.endCol+1] ^ rookKeys[move.endCol-1]
+            else:   #Queen side castle
+                key ^= rookKeys[move.endCol-2] ^ rookKeys[move.endCol+1]
+        if oldEnpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[oldEnpassantPossible[1]]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        key ^= ZOBRIST_CASTLING_KEYS[oldCastlingRights] ^ ZOBRIST_CASTLING_KEYS[self.castlingRights]
+        self.zobristKey = key
+        self.zobristLog.append(key)
+
+        # Piece lists, material and piece-square scores
+        color = move.pieceMoved[0]
+        ownSquares = self.pieceSquares[color]
+        ownSquares.remove(SQUARES[move.startRow][move.startCol])
+        ownSquares.add(SQUARES[move.endRow][move.endCol])
+        positionalScore = self.positionalScore - SIGNED_POSITION_SCORES[move.pieceMoved][move.startRow][move.startCol] + \
+            SIGNED_POSITION_SCORES[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
+        if move.isPawnPromotion:
+            self.material[color] += pieceScore['Q'] - pieceScore['P']
+        if move.pieceCaptured != '--':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            self.pieceSquares[move.pieceCaptured[0]].remove(SQUARES[captureRow][move.endCol])
+            self.material[move.pieceCaptured[0]] -= pieceScore[move.pieceCaptured[1]]
+            positionalScore -= SIGNED_POSITION_SCORES[move.pieceCaptured][captureRow][move.endCol]
+        if move.isCastleMove:
+            rookScores = SIGNED_POSITION_SCORES[color + 'R'][move.endRow]
+            if move.endCol - move.startCol == 2:    #King side castle
+                rookFrom, rookTo = move.endCol+1, move.endCol-1
+            else:   #Queen side castle
+                rookFrom, rookTo = move.endCol-2, move.endCol+1
+            ownSquares.remove(SQUARES[move.endRow][rookFrom])
+            ownSquares.add(SQUARES[move.endRow][rookTo])
+            positionalScore += rookScores[rookTo] - rookScores[rookFrom]
+        self.positionalScore = positionalScore
 
 
     '''
@@ -93,24 +322,23 @@ class GameState():
             self.whiteToMove = not self.whiteToMove  # Switch turns back
             #     Update King's Location if moved
             if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
+                self.whiteKingLocation = SQUARES[move.startRow][move.startCol]
             elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
+                self.blackKingLocation = SQUARES[move.startRow][move.startCol]
             
             # Undo en passant
             if move.isEnpassantMove:    
                 self.board[move.endRow][move.endCol] = '--'     #leave landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            
-            # Undo a 2 square enpassant move
-            if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
 
-            # Undo Castling rights
-            self.castleRightsLog.pop()  #Get rid of new castle rights from the move we're doing
-            newRights = self.castleRightsLog[-1]    #set the current castle rights to the last one in the list
-            self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs, )
+            # Restore the castle rights, en passant square and halfmove clock from before the move
+            state = self.undoStack.pop()
+            self.castlingRights = state & 15
+            enpassantCol = (state >> 4) & 15
+            self.enpassantPossible = SQUARES[2 if self.whiteToMove else 5][enpassantCol - 1] if enpassantCol else ()
+            self.halfmoveClock = state >> 8
+            if move.pieceMoved[0] == 'b':
+                self.fullmoveNumber -= 1
 
             # Undo the castle moves
             if move.isCastleMove:
@@ -121,77 +349,579 @@ class GameState():
                     self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
                     self.board[move.endRow][move.endCol+1] = '--'
 
+            # Restore the Zobrist key from before the move
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+
+            # Piece lists, material and piece-square scores
+            color = move.pieceMoved[0]
+            ownSquares = self.pieceSquares[color]
+            ownSquares.remove(SQUARES[move.endRow][move.endCol])
+            ownSquares.add(SQUARES[move.startRow][move.startCol])
+            placed = color + 'Q' if move.isPawnPromotion else move.pieceMoved
+            positionalScore = self.positionalScore - SIGNED_POSITION_SCORES[placed][move.endRow][move.endCol] + \
+                SIGNED_POSITION_SCORES[move.pieceMoved][move.startRow][move.startCol]
+            if move.isPawnPromotion:
+                self.material[color] -= pieceScore['Q'] - pieceScore['P']
+            if move.pieceCaptured != '--':
+                captureRow = move.startRow if move.isEnpassantMove else move.endRow
+                self.pieceSquares[move.pieceCaptured[0]].add(SQUARES[captureRow][move.endCol])
+                self.material[move.pieceCaptured[0]] += pieceScore[move.pieceCaptured[1]]
+                positionalScore += SIGNED_POSITION_SCORES[move.pieceCaptured][captureRow][move.endCol]
+            if move.isCastleMove:
+                rookScores = SIGNED_POSITION_SCORES[color + 'R'][move.endRow]
+                if move.endCol - move.startCol == 2:    #Kingside
+                    rookFrom, rookTo = move.endCol+1, move.endCol-1
+                else:   #Queenside
+                    rookFrom, rookTo = move.endCol-2, move.endCol+1
+                ownSquares.remove(SQUARES[move.endRow][rookTo])
+                ownSquares.add(SQUARES[move.endRow][rookFrom])
+                positionalScore += rookScores[rookFrom] - rookScores[rookTo]
+            self.positionalScore = positionalScore
+
+    '''
+    Compute the Zobrist key of the position from scratch. makeMove/undoMove keep self.zobristKey up to date
+    incrementally, so this is only needed for a new position and for checking the incremental key while debugging.
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key ^ ZOBRIST_CASTLING_KEYS[self.castlingRights]
+
     '''
-    Update the castle rights given the move
+    Rebuild the piece lists (the set of (row, col) squares of each side's pieces), the material of each side and the
+    piece-square total (white minus black) from the board. makeMove/undoMove keep all three up to date after that.
+    '''
+    def countPieces(self):
+        self.pieceSquares = {'w': set(), 'b': set()}
+        self.material = {'w': 0, 'b': 0}
+        self.positionalScore = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.pieceSquares[piece[0]].add(SQUARES[r][c])
+                    self.material[piece[0]] += pieceScore[piece[1]]
+                    self.positionalScore += SIGNED_POSITION_SCORES[piece][r][c]
+
+    '''
+    The castling rights as a CastleRights object. This is a snapshot for code that wants named flags; the engine
+    itself keeps the castlingRights mask, and assigning a CastleRights here sets it.
+    '''
+    @property
+    def currentCastlingRight(self):
+        return CastleRights.fromMask(self.castlingRights)
+
+    @currentCastlingRight.setter
+    def currentCastlingRight(self, rights):
+        self.castlingRights = rights.toMask()
+
+    '''
+    Replace the whole position. board is an 8x8 list like self.board, castlingRights a mask of WKS, WQS, BKS and BQS
+    and enpassantPossible the (row, col) a pawn can capture onto, or (). Castling rights whose king or rook is not on
+    its home square are dropped. The move log starts empty from here.
+    '''
+    def setPosition(self, board, whiteToMove, castlingRights, enpassantPossible=(), halfmoveClock=0, fullmoveNumber=1):
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        self.moveLog = []
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = SQUARES[r][c]
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = SQUARES[r][c]
+        self.checkmate = False
+        self.stalemate = False
+        self.draw = False
+        self.drawReason = None
+        self.enpassantPossible = SQUARES[enpassantPossible[0]][enpassantPossible[1]] if enpassantPossible else ()
+        for right, king, (kingRow, kingCol), (rookRow, rookCol) in CASTLING_HOMES:
+            if self.board[kingRow][kingCol] != king or self.board[rookRow][rookCol] != king[0] + 'R':
+                castlingRights &= ~right
+        self.castlingRights = castlingRights
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.undoStack = array('I')
+        self.refreshDerivedState()
+
+    '''
+    Recompute everything that is derived from the board after setPosition. Subclasses that keep their own view of the
+    board (the bitboard backend) extend this.
+    '''
+    def refreshDerivedState(self):
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = array('Q', [self.zobristKey])
+        self.countPieces()
+
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls()
+        gs.loadFen(fen)
+        return gs
+
+    '''
+    Set up the position from a FEN string. The move counters are optional, so the first four fields of an EPD line
+    load too. Raises ValueError for a malformed string, and for a position that can't be reached: a side without
+    exactly one king, a pawn on the first or last rank, or an en passant square on the wrong rank for the side to move.
+    Castling rights the pieces no longer allow are dropped.
+    '''
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: %r" % fen)
+        placement, side, castling, enpassant = fields[:4]
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN board needs 8 ranks: %r" % placement)
+        board = []
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    row.append(FEN_PIECES[char])
+                else:
+                    raise ValueError("bad piece %r in FEN" % char)
+            if len(row) != 8:
+                raise ValueError("FEN rank %r is not 8 squares wide" % rank)
+            board.append(row)
+        if side not in ('w', 'b') or castling.strip("KQkq") not in ('', '-'):
+            raise ValueError("bad side to move or castling field in FEN: %r" % fen)
+        enpassantPossible = ()
+        if enpassant != '-':
+            if len(enpassant) != 2 or enpassant[0] not in Move.filesToCol or enpassant[1] not in Move.rankToRows:
+                raise ValueError("bad en passant square %r in FEN" % enpassant)
+            enpassantPossible = (Move.rankToRows[enpassant[1]], Move.filesToCol[enpassant[0]])
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("bad move counters in FEN: %r" % fen) from None
+        for king, color in (("wK", "white"), ("bK", "black")):
+            kings = sum(row.count(king) for row in board)
+            if kings != 1:
+                raise ValueError("FEN needs exactly one %s king, not %d: %r" % (color, kings, fen))
+        if any(piece[1] == 'P' for piece in board[0] + board[7]):
+            raise ValueError("pawn on the first or last rank in FEN: %r" % fen)
+        if enpassantPossible and enpassantPossible[0] != (2 if side == 'w' else 5):
+            raise ValueError("en passant square %s is on the wrong rank for the side to move" % enpassant)
+        castlingRights = 0
+        for letter, right in (('K', WKS), ('Q', WQS), ('k', BKS), ('q', BQS)):
+            if letter in castling:
+                castlingRights |= right
+        self.setPosition(board, side == 'w', castlingRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+
+    '''
+    The FEN string of the current position
+    '''
+    def getFen(self):
+        return "%s %d %d" % (self.getEpdPosition(), self.halfmoveClock, self.fullmoveNumber)
+
+    '''
+    The first four FEN fields: placement, side to move, castling rights and en passant square
+    '''
+    def getEpdPosition(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+        rights = self.castlingRights
+        castling = ("K" if rights & WKS else "") + ("Q" if rights & WQS else "") + \
+                   ("k" if rights & BKS else "") + ("q" if rights & BQS else "")
+        if self.enpassantPossible != ():
+            r, c = self.enpassantPossible
+            enpassant = Move.colsToFiles[c] + Move.rowsToRank[r]
+        else:
+            enpassant = "-"
+        return "%s %s %s %s" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enpassant)
+
+    '''
+    Set up the position from an EPD line and return its operations as a dict of opcode to operand string, e.g.
+    {"bm": "Nf3", "id": "WAC.001"}. The hmvc and fmvn operations set the move counters.
+    '''
+    def loadEpd(self, epd):
+        fields = epd.split(None, 4)
+        operations = parseEpdOperations(fields[4]) if len(fields) > 4 else {}
+        self.loadFen(" ".join(fields[:4]))
+        if "hmvc" in operations or "fmvn" in operations:
+            self.halfmoveClock = int(operations.get("hmvc", self.halfmoveClock))
+            self.fullmoveNumber = int(operations.get("fmvn", self.fullmoveNumber))
+        return operations
+
+    '''
+    The EPD line of the current position followed by the given operations (a dict of opcode to operand)
+    '''
+    def getEpd(self, operations=None):
+        epd = self.getEpdPosition()
+        for opcode, operand in (operations or {}).items():
+            operand = str(operand)
+            if opcode in EPD_STRING_OPCODES:
+                operand = '"%s"' % operand
+            epd += " %s %s;" % (opcode, operand) if operand else " %s;" % opcode
+        return epd
+
+    '''
+    Update the castle rights given the move: a move from or to the king's or a rook's home square clears the rights
+    that depend on it
     '''
     def updateCastleRights(self, move):
-        if move.pieceMoved == "wK":
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == "bK":
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7:
-                if move.startCol == 0:  #left Rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:    #right Rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 0:
-                if move.startCol == 0:  #left Rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7:    #right Rook
-                    self.currentCastlingRight.bks = False
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.bks = False
-
-
-    '''
-    All moves cosidering checks
+        self.castlingRights &= CASTLING_KEPT[move.startRow][move.startCol] & CASTLING_KEPT[move.endRow][move.endCol]
+
+    '''
+    All moves considering checks. Rather than making every pseudo-legal move and asking whether the king hangs,
+    the checkers and pinned pieces are found once by looking outward from the king, and only legal moves are kept:
+    <-> In double check only the king can move.
+    <-> In single check other pieces must capture the checker or block its ray.
+    <-> A pinned piece may only slide along the line between its king and the pinning piece.
+    <-> King moves and en passant captures (which can uncover a check along the rank) are verified on the board.
+    This is the list form of generateMoves, which also sets the checkmate, stalemate and draw flags.
     '''
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)     #Copy the current castling rights
-        # Naïve algorithm
-        # 1. generate all possible moves
-        moves = self.getAllPossibleMoves()
-
-        # 2. for each move, make the move
-        for i in range(len(moves) - 1, -1, -1):  # when removing from a list go backwards through that list
-            self.makeMove(moves[i])
-            # 3. generate opponent's all possible moves
-            # 4. for each of your opponent's moves, see if they attack your king
-            self.whiteToMove = not self.whiteToMove  # Swapping terms as it will understand that it is black's turn
-            if self.inCheck():
-                moves.remove(moves[i])  # 5. if they do attack your king, then it's not a valid move
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+        legality = self.getLegalityInfo()
+        moves = list(self.generateMoves(legality=legality))
+        self.setGameOverFlags(moves, len(legality[3]) != 0)
+        return moves
+
+    '''
+    What the legality checks need to know about the side to move's king: (kingRow, kingCol, pins, checks,
+    validSquares), where validSquares holds the squares that capture or block the checker when in single check
+    '''
+    def getLegalityInfo(self):
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        validSquares = None
+        if len(checks) == 1:  # single check, block the check ray or capture the checker
+            checkRow, checkCol, dr, dc = checks[0]
+            if self.board[checkRow][checkCol][1] == 'N':  # a knight check can't be blocked
+                validSquares = {(checkRow, checkCol)}
+            else:
+                validSquares = set()
+                for i in range(1, 8):
+                    square = (kingRow + dr * i, kingCol + dc * i)
+                    validSquares.add(square)
+                    if square == (checkRow, checkCol):
+                        break
+        return kingRow, kingCol, pins, checks, validSquares
+
+    '''
+    Yield the legal moves in stages, building each stage only when the consumer asks for more, so a search that cuts
+    off early never generates the quiet moves:
+    <-> the hash move (hashMoveID), when it is legal here
+    <-> captures, en passant and promotions, best first by MVV-LVA
+    <-> the killer moves (killerIDs), when they are legal quiet moves here
+    <-> the remaining quiet moves, sorted by quietKey(move) highest first when given
+    With capturesOnly the generator stops after the captures, as quiescence search wants. The position must be the
+    same every time the generator resumes, i.e. every move made in between is undone.
+    '''
+    def generateMoves(self, hashMoveID=None, killerIDs=(), quietKey=None, capturesOnly=False, legality=None):
+        if legality is None:
+            legality = self.getLegalityInfo()
+        kingRow, kingCol, pins, checks, _ = legality
+        board = self.board
+        if len(checks) > 1:  # double check, the king has to move
+            squares = [(kingRow, kingCol)]
+        else:
+            squares = self.pieceSquares['w' if self.whiteToMove else 'b']
+        done = set()  # IDs already yielded by the hash and killer stages
+
+        if hashMoveID is not None:
+            move = self.findMove(hashMoveID, legality)
+            if move is not None and (not capturesOnly or move.isCapture or move.isPawnPromotion):
+                done.add(hashMoveID)
+                yield move
+
+        captures = []
+        for r, c in squares:
+            piece = board[r][c][1]
+            if piece == 'N' and (r, c) in pins:
+                continue  # a pinned knight can never move
+            self.getCaptureMoves(r, c, piece, captures)
+        captures.sort(key=mvvLva, reverse=True)
+        for move in captures:
+            if move.moveID not in done and self.isLegal(move, legality):
+                yield move
+        if capturesOnly:
+            return
+
+        for killerID in killerIDs:
+            if killerID is not None and killerID not in done:
+                move = self.findMove(killerID, legality, quietOnly=True)
+                if move is not None:
+                    done.add(killerID)
+                    yield move
+
+        quiets = []
+        for r, c in squares:
+            piece = board[r][c][1]
+            if piece == 'N' and (r, c) in pins:
+                continue
+            self.getQuietMoves(r, c, piece, quiets)
+            if piece == 'K' and not checks:
+                self.getCastleMoves(r, c, quiets)
+        if quietKey is not None:
+            quiets.sort(key=quietKey, reverse=True)
+        for move in quiets:
+            if move.moveID not in done and self.isLegal(move, legality):
+                yield move
+
+    '''
+    Whether the side to move has any legal move at all. Stops at the first one found, trying the king first since
+    it is the only piece that can move in double check. Castling never needs checking: when it is legal, so is the
+    king's step towards the rook.
+    '''
+    def hasLegalMove(self):
+        legality = self.getLegalityInfo()
+        kingRow, kingCol, pins, checks, _ = legality
+        board = self.board
+        moves = []
+        self.getCaptureMoves(kingRow, kingCol, 'K', moves)
+        self.getQuietMoves(kingRow, kingCol, 'K', moves)
+        for move in moves:
+            if self.isKingMoveSafe(move):
+                return True
+        if len(checks) > 1:
+            return False
+        for r, c in self.pieceSquares['w' if self.whiteToMove else 'b']:
+            piece = board[r][c][1]
+            if piece == 'K' or (piece == 'N' and (r, c) in pins):
+                continue
+            moves = []
+            self.getCaptureMoves(r, c, piece, moves)
+            self.getQuietMoves(r, c, piece, moves)
+            for move in moves:
+                if self.isLegal(move, legality):
+                    return True
+        return False
+
+    '''
+    Whether the game is over here: checkmate, stalemate or a draw. Unlike getValidMoves this only looks for one legal
+    move and leaves the flags alone.
+    '''
+    def isTerminal(self):
+        return not self.hasLegalMove() or self.getDrawReason() is not None
+
+    '''
+    The result of the game as written in PGN: "1-0", "0-1", "1/2-1/2", or "*" while it goes on
+    '''
+    def getResult(self):
+        if not self.hasLegalMove():
+            if not self.inCheck():
+                return "1/2-1/2"
+            return "0-1" if self.whiteToMove else "1-0"
+        return "1/2-1/2" if self.getDrawReason() is not None else "*"
+
+    '''
+    Build a MoveIndex of the legal moves, setting the game over flags like getValidMoves
+    '''
+    def getMoveIndex(self):
+        return MoveIndex(self.getValidMoves())
+
+    '''
+    The legal move with the given moveID, or None. Only the moves of the piece on the start square are generated.
+    '''
+    def findMove(self, moveID, legality, quietOnly=False):
+        r, c = moveID >> 9, (moveID >> 6) & 7
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        candidates = []
+        if not quietOnly:
+            self.getCaptureMoves(r, c, piece[1], candidates)
+        self.getQuietMoves(r, c, piece[1], candidates)
+        if piece[1] == 'K' and not legality[3]:
+            self.getCastleMoves(r, c, candidates)
+        for move in candidates:
+            if move.moveID == moveID:
+                return move if self.isLegal(move, legality) else None
+        return None
+
+    '''
+    Whether a pseudo-legal move of the side to move is legal, given getLegalityInfo(). Castle moves are only
+    generated when legal, so they always pass.
+    '''
+    def isLegal(self, move, legality):
+        kingRow, kingCol, pins, checks, validSquares = legality
+        if move.pieceMoved[1] == 'K':
+            return move.isCastleMove or self.isKingMoveSafe(move)
+        if len(checks) > 1:
+            return False
+        if move.isEnpassantMove:
+            return self.isEnpassantSafe(move, kingRow, kingCol)
+        pin = pins.get((move.startRow, move.startCol))
+        if pin is not None and (move.endRow - kingRow) * pin[1] != (move.endCol - kingCol) * pin[0]:
+            return False  # moving off the pin line would expose the king
+        if checks and (move.endRow, move.endCol) not in validSquares:
+            return False
+        return True
+
+    '''
+    Set the checkmate and stalemate flags from the legal moves of the side to move
+    '''
+    def setGameOverFlags(self, moves, inCheck):
+        self.checkmate = False
+        self.stalemate = False
+        self.draw = False
+        self.drawReason = None
         if len(moves) == 0:  # Either Checkmate or stalemate
-            if self.inCheck():
+            if inCheck:
                 self.checkmate = True
-                print("CHECKMATE")
             else:
                 self.stalemate = True
-                print("STALEMATE")
+        else:
+            self.drawReason = self.getDrawReason()
+            self.draw = self.drawReason is not None
+
+    '''
+    Why the current position is a draw other than by stalemate ("fifty-move rule", "threefold repetition" or
+    "insufficient material"), or None. Checkmate on the last move before the fifty-move limit still wins, so
+    getValidMoves only asks this when there are legal moves.
+    '''
+    def getDrawReason(self):
+        if self.halfmoveClock >= 100:
+            return "fifty-move rule"
+        if self.repetitionCount() >= 3:
+            return "threefold repetition"
+        if self.isInsufficientMaterial():
+            return "insufficient material"
+        return None
+
+    '''
+    How many times the current position has occurred, counting this one. No position from before the last capture or
+    pawn move can come back, so only the last halfmoveClock plies are scanned, comparing Zobrist keys of the positions
+    with the same side to move.
+    '''
+    def repetitionCount(self):
+        log = self.zobristLog
+        key = self.zobristKey
+        last = len(log) - 1
+        count = 1
+        for i in range(last - 2, max(last - self.halfmoveClock, 0) - 1, -2):
+            if log[i] == key:
+                count += 1
+        return count
 
+    '''
+    True when neither side has the material to checkmate: bare kings, a single minor piece, or only bishops that all
+    stand on squares of one colour
+    '''
+    def isInsufficientMaterial(self):
+        if len(self.pieceSquares['w']) + len(self.pieceSquares['b']) > 4:
+            return False  # kings and at most two minor pieces
+        minors = []
+        for squares in self.pieceSquares.values():
+            for r, c in squares:
+                kind = self.board[r][c][1]
+                if kind == 'P' or kind == 'R' or kind == 'Q':
+                    return False
+                if kind == 'N' or kind == 'B':
+                    minors.append((kind, (r + c) % 2))
+        if len(minors) <= 1:
+            return True
+        return all(kind == 'B' for kind, _ in minors) and len({colour for _, colour in minors}) == 1
+
+    '''
+    Look outward from the king at (r, c) and return the pinned pieces and the checking pieces.
+    pins maps the square of each pinned piece to the direction (from the king) of its pin line.
+    checks is a list of (row, col, dr, dc) for each enemy piece giving check.
+    '''
+    def checkForPinsAndChecks(self, r, c):
+        pins = {}
+        checks = []
         if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+            enemyColor, allyColor = 'b', 'w'
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
-        return moves
+            enemyColor, allyColor = 'w', 'b'
+        pawnRowStep = -1 if self.whiteToMove else 1  # enemy pawns attack the king from this row offset
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j, d in enumerate(directions):
+            possiblePin = None
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8):  # OffBoard
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin is None:  # first allied piece on the ray could be pinned
+                        possiblePin = (endRow, endCol)
+                        continue
+                    break  # second allied piece, no pin or check from this direction
+                if endPiece[0] == enemyColor:
+                    pieceType = endPiece[1]
+                    # <-> orthogonally away from the king and the piece is a rook
+                    # <-> diagonally away from the king and the piece is a bishop
+                    # <-> 1 square away diagonally in front of the king and the piece is a pawn
+                    # <-> any direction and the piece is a queen
+                    # <-> any direction 1 square away and the piece is the king
+                    if (0 <= j <= 3 and pieceType == 'R') or (4 <= j <= 7 and pieceType == 'B') or \
+                            (i == 1 and pieceType == 'P' and j >= 4 and d[0] == pawnRowStep) or \
+                            pieceType == 'Q' or (i == 1 and pieceType == 'K'):
+                        if possiblePin is None:
+                            checks.append((endRow, endCol, d[0], d[1]))
+                        else:
+                            pins[possiblePin] = d
+                break
+        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        for m in knightMoves:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == enemyColor and endPiece[1] == 'N':
+                    checks.append((endRow, endCol, m[0], m[1]))
+        return pins, checks
+
+    '''
+    Determine if a king move leaves the king out of check. The king is lifted off its square first so that
+    sliders attacking through it are still seen.
+    '''
+    def isKingMoveSafe(self, move):
+        board = self.board
+        board[move.startRow][move.startCol] = "--"
+        board[move.endRow][move.endCol] = move.pieceMoved
+        _, checks = self.checkForPinsAndChecks(move.endRow, move.endCol)
+        board[move.endRow][move.endCol] = move.pieceCaptured
+        board[move.startRow][move.startCol] = move.pieceMoved
+        return len(checks) == 0
+
+    '''
+    Determine if an en passant capture leaves the king out of check. Both pawns leave the same rank, which can
+    uncover a rook or queen, so the capture is played out on the board and the king is checked again.
+    '''
+    def isEnpassantSafe(self, move, kingRow, kingCol):
+        board = self.board
+        board[move.startRow][move.startCol] = "--"
+        board[move.startRow][move.endCol] = "--"
+        board[move.endRow][move.endCol] = move.pieceMoved
+        _, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        board[move.endRow][move.endCol] = "--"
+        board[move.startRow][move.endCol] = move.pieceCaptured
+        board[move.startRow][move.startCol] = move.pieceMoved
+        return len(checks) == 0
 
     '''
     Determine if the current player is in check
@@ -203,28 +933,57 @@ class GameState():
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
     '''
-    Determine if the enemy can attack the square r, c
+    Determine if the enemy can attack the square r, c. Looks outward from the square and stops at the first attacker.
     '''
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # Switch to opponents turn
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # Switch the turns back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:  # the square is under attack
-                return True
+        for _ in self.iterAttackers(r, c, 'b' if self.whiteToMove else 'w'):
+            return True
         return False
 
+    '''
+    Return the set of squares holding pieces of the given color (the enemy by default) that attack the square r, c
+    '''
+    def getAttackers(self, r, c, color=None):
+        if color is None:
+            color = 'b' if self.whiteToMove else 'w'
+        return set(self.iterAttackers(r, c, color))
+
+    '''
+    Yield the squares of the pieces of the given color that attack the square r, c. Knight, pawn and king squares
+    are looked up first, then each slider ray is walked from the square until it hits a piece.
+    '''
+    def iterAttackers(self, r, c, color):
+        board = self.board
+        knight, king, pawn, queen = color + 'N', color + 'K', color + 'P', color + 'Q'
+        for endRow, endCol in KNIGHT_TARGETS[r][c]:
+            if board[endRow][endCol] == knight:
+                yield endRow, endCol
+        for endRow, endCol in KING_TARGETS[r][c]:
+            if board[endRow][endCol] == king:
+                yield endRow, endCol
+        pawnRow = r + 1 if color == 'w' else r - 1  # white pawns attack upwards, so they sit one row below
+        if 0 <= pawnRow < 8:
+            if c - 1 >= 0 and board[pawnRow][c - 1] == pawn:
+                yield pawnRow, c - 1
+            if c + 1 <= 7 and board[pawnRow][c + 1] == pawn:
+                yield pawnRow, c + 1
+        for sliders, rays in ((color + 'R', ROOK_RAYS[r][c]), (color + 'B', BISHOP_RAYS[r][c])):
+            for ray in rays:
+                for endRow, endCol in ray:
+                    endPiece = board[endRow][endCol]
+                    if endPiece != "--":
+                        if endPiece == sliders or endPiece == queen:
+                            yield endRow, endCol
+                        break
+
     '''
     All moves without considering checks
     '''
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)):  # no. of rows
-            for c in range(len(self.board[r])):  # no. of cols in the given row
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)  # calls appropriate move functions based on piece type
+        for r, c in self.pieceSquares['w' if self.whiteToMove else 'b']:  # squares of the side to move's pieces
+            piece = self.board[r][c][1]
+            self.moveFunctions[piece](r, c, moves)  # calls appropriate move functions based on piece type
         return moves
 
     '''
@@ -342,26 +1101,88 @@ class GameState():
                     moves.append(Move((r, c), (endRow, endCol), self.board))
 
     '''
-    Generate all valid vastle moves for the King at (r, c)and add them to the list of moves
+    Generate all valid vastle moves for the King at (r, c)and add them to the list of moves. The rook has to be on its
+    corner too, since make/undo move it and keep the piece lists, whatever the castling rights claim.
     '''
     def getCastleMoves(self, r, c, moves):
         if self.squareUnderAttack(r, c):
             return #Can't castle while we're in check
-        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-            self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
-            self.getQueensideCastleMoves(r, c, moves)
+        rook = ('w' if self.whiteToMove else 'b') + 'R'
+        if self.castlingRights & (WKS if self.whiteToMove else BKS):
+            self.getKingsideCastleMoves(r, c, moves, rook)
+        if self.castlingRights & (WQS if self.whiteToMove else BQS):
+            self.getQueensideCastleMoves(r, c, moves, rook)
 
-    def getKingsideCastleMoves(self, r, c, moves):
-        if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
+    def getKingsideCastleMoves(self, r, c, moves, rook):
+        if c == 4 and self.board[r][c+1] == '--' and self.board[r][c+2] == '--' and self.board[r][c+3] == rook:
             if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
                 moves.append(Move((r, c), (r, c+2), self.board, isCastleMove = True))
 
-    def getQueensideCastleMoves(self, r, c, moves):
-        if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
+    def getQueensideCastleMoves(self, r, c, moves, rook):
+        if c == 4 and self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--' and \
+                self.board[r][c-4] == rook:
             if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
                 moves.append(Move((r, c), (r, c-2), self.board, isCastleMove=True))
 
+    '''
+    Add the captures, en passant captures and promotions of the piece at (r, c) to moves. piece is its type letter.
+    '''
+    def getCaptureMoves(self, r, c, piece, moves):
+        board = self.board
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        if piece == 'P':
+            endRow = r - 1 if self.whiteToMove else r + 1
+            if (endRow == 0 or endRow == 7) and board[endRow][c] == "--":  # promotion by a push
+                moves.append(Move((r, c), (endRow, c), board))
+            for endCol in (c - 1, c + 1):
+                if 0 <= endCol < 8:
+                    if board[endRow][endCol][0] == enemyColor:
+                        moves.append(Move((r, c), (endRow, endCol), board))
+                    elif (endRow, endCol) == self.enpassantPossible:
+                        moves.append(Move((r, c), (endRow, endCol), board, isEnpassantMove=True))
+        elif piece == 'N' or piece == 'K':
+            for endRow, endCol in (KNIGHT_TARGETS if piece == 'N' else KING_TARGETS)[r][c]:
+                if board[endRow][endCol][0] == enemyColor:
+                    moves.append(Move((r, c), (endRow, endCol), board))
+        else:
+            rays = ROOK_RAYS[r][c] if piece == 'R' else BISHOP_RAYS[r][c] if piece == 'B' else \
+                ROOK_RAYS[r][c] + BISHOP_RAYS[r][c]
+            for ray in rays:
+                for endRow, endCol in ray:
+                    endPiece = board[endRow][endCol]
+                    if endPiece != "--":
+                        if endPiece[0] == enemyColor:
+                            moves.append(Move((r, c), (endRow, endCol), board))
+                        break
+
+    '''
+    Add the moves of the piece at (r, c) that capture nothing and don't promote to moves, castling aside
+    '''
+    def getQuietMoves(self, r, c, piece, moves):
+        board = self.board
+        if piece == 'P':
+            if self.whiteToMove:
+                endRow, startRow, step = r - 1, 6, -1
+            else:
+                endRow, startRow, step = r + 1, 1, 1
+            if endRow != 0 and endRow != 7 and board[endRow][c] == "--":
+                moves.append(Move((r, c), (endRow, c), board))
+                if r == startRow and board[endRow + step][c] == "--":  # 2 square advance
+                    moves.append(Move((r, c), (endRow + step, c), board))
+        elif piece == 'N' or piece == 'K':
+            for endRow, endCol in (KNIGHT_TARGETS if piece == 'N' else KING_TARGETS)[r][c]:
+                if board[endRow][endCol] == "--":
+                    moves.append(Move((r, c), (endRow, endCol), board))
+        else:
+            rays = ROOK_RAYS[r][c] if piece == 'R' else BISHOP_RAYS[r][c] if piece == 'B' else \
+                ROOK_RAYS[r][c] + BISHOP_RAYS[r][c]
+            for ray in rays:
+                for endRow, endCol in ray:
+                    if board[endRow][endCol] != "--":
+                        break
+                    moves.append(Move((r, c), (endRow, endCol), board))
+
+
 class CastleRights():
     def __init__(self, wks, bks, wqs, bqs):
         self.wks = wks
@@ -369,6 +1190,42 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    @classmethod
+    def fromMask(cls, mask):
+        return cls(bool(mask & WKS), bool(mask & BKS), bool(mask & WQS), bool(mask & BQS))
+
+    def toMask(self):
+        return (WKS if self.wks else 0) | (BKS if self.bks else 0) | (WQS if self.wqs else 0) | (BQS if self.bqs else 0)
+
+
+class MoveIndex():
+    '''
+    A list of moves, indexed by start square and by moveID (which packs the start and end squares), so the UI can
+    look up a piece's targets or match a click to a move without scanning the whole list
+    '''
+    def __init__(self, moves):
+        self.moves = moves
+        self.byStartSquare = {}
+        self.byID = {}
+        for move in moves:
+            self.byStartSquare.setdefault((move.startRow, move.startCol), []).append(move)
+            self.byID[move.moveID] = move
+
+    def __iter__(self):
+        return iter(self.moves)
+
+    '''
+    The moves of the piece on (r, c)
+    '''
+    def movesFrom(self, r, c):
+        return self.byStartSquare.get((r, c), [])
+
+    '''
+    The move from startSq to endSq, both (row, col), or None when there is no such move
+    '''
+    def find(self, startSq, endSq):
+        return self.byID.get((startSq[0] << 9) | (startSq[1] << 6) | (endSq[0] << 3) | endSq[1])
+
 
 class Move():
     # maps keys to values
@@ -378,30 +1235,49 @@ class Move():
     filesToCol = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
     colsToFiles = {v: k for k, v in filesToCol.items()}
 
+    # Moves are built by the thousand for every getValidMoves call, so they carry no instance __dict__
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'isEnpassantMove', 'isCastleMove', 'moveID')
+
     def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
 
-        # Pawn Promotion
-        self.isPawnPromotion = (self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7)
+        # Pawn Promotion (pawns only ever reach the last row of their opponent)
+        self.isPawnPromotion = pieceMoved[1] == 'P' and (endRow == 0 or endRow == 7)
 
         # En Passant
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = "wP" if self.pieceMoved == "bP" else "bP"
+        if isEnpassantMove:
+            self.pieceCaptured = "wP" if pieceMoved == "bP" else "bP"
+        else:
+            self.pieceCaptured = board[endRow][endCol]
 
         # castle move
         self.isCastleMove = isCastleMove
 
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # from and to squares packed into 12 bits: startRow, startCol, endRow, endCol take 3 bits each
+        self.moveID = (startRow << 9) | (startCol << 6) | (endRow << 3) | endCol
 
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
+        return NotImplemented
+
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "Move(" + self.getChessNotation() + ")"
+
+    @property
+    def isCapture(self):
+        return self.pieceCaptured != "--"
 
     def getChessNotation(self):
         # You can add to make this real chess notation
@@ -1,29 +1,104 @@
 """
 This is our main driver file. It will be responsible for handling user input and the current GameState object.
 """
+import os
+import time
+
 import pygame as p
 import ChessEngine
+import ChessStats
+import ChessWorker
 
 WIDTH = HEIGHT = 720
 DIMENSION = 8  # Dimensions are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 60
-IMAGES = {}
+IDLE_WAIT_MS = 250  # with nothing to draw and no engine work pending, sleep up to this long waiting for input
+PIECES = ["wP", "wR", "wN", "wB", "wQ", "wK", "bP", "bR", "bN", "bB", "bQ", "bK"]
+ATLAS_DIR = os.path.join("images", ".cache")  # pre-scaled sprite atlases, one per SQ_SIZE
+SURFACES = {}       # pre-rendered board background and highlight sprites, built once by loadSurfaces()
+colors = [p.Color(240,217,181), p.Color(181, 136, 99)]
+playerOne = True    # True if a human is playing white, False if the AI is
+playerTwo = False   # True if a human is playing black, False if the AI is
+AI_THINK_TIME = 3   # seconds the AI may search for a move
+OPENING_BOOK = None  # path of a Polyglot .bin book; while in book the AI plays its moves instantly
+TABLEBASE_DIR = None  # directory of KQK/KRK/KPK tables from ChessTablebase.py, which the AI then plays perfectly
+SHOW_STATS = False  # start with the stats overlay on; 's' toggles it, and ChessStats only measures while it is shown
+
+
+class SpriteAtlas(dict):
+    '''
+    The piece images, scaled to SQ_SIZE. Nothing is decoded until the first image is asked for.
+    '''
+    def __missing__(self, piece):
+        loadImages()
+        return dict.__getitem__(self, piece)
+
 
 '''
-Initialize a global dictionary of image. This will be called once in the main
+Path of the cached sprite atlas for the current SQ_SIZE
+'''
+def atlasPath():
+    return os.path.join(ATLAS_DIR, "atlas-%d.png" % SQ_SIZE)
+
+
+'''
+Fill IMAGES from one atlas image holding all 12 pieces side by side, already scaled to SQ_SIZE. Decoding and scaling the
+full-size piece PNGs is slow, so the atlas is built once per SQ_SIZE and cached on disk; it is rebuilt when a piece
+image is newer than the cache.
 '''
 def loadImages():
-    # Alter: IMAGES["wP"] = p.image.load("images/wP.png")---------But this is not an effective way as we will
-    # have to assign pieces separately
-    pieces = ["wP", "wR", "wN", "wB", "wQ", "wK", "bP", "bR", "bN", "bB", "bQ", "bK"]
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+    path = atlasPath()
+    sources = ["images/" + piece + ".png" for piece in PIECES]
+    atlas = None
+    if os.path.exists(path) and os.path.getmtime(path) >= max(os.path.getmtime(source) for source in sources):
+        try:
+            atlas = p.image.load(path)
+        except p.error:
+            atlas = None    # unreadable cache, build it again
+    if atlas is None:
+        atlas = p.Surface((SQ_SIZE * len(PIECES), SQ_SIZE), p.SRCALPHA)
+        for i, source in enumerate(sources):
+            sprite = p.transform.scale(p.image.load(source), (SQ_SIZE, SQ_SIZE))
+            atlas.blit(sprite, (i * SQ_SIZE, 0), special_flags=p.BLEND_RGBA_MAX)  # copy the pixels, alpha included
+        try:
+            os.makedirs(ATLAS_DIR, exist_ok=True)
+            p.image.save(atlas, path)
+        except (OSError, p.error):
+            pass    # read-only install, keep the atlas in memory only
+    if p.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+    for i, piece in enumerate(PIECES):
+        IMAGES[piece] = atlas.subsurface(p.Rect(i * SQ_SIZE, 0, SQ_SIZE, SQ_SIZE))
     # NOTE: We can access an image by saying "IMAGES['wP']"
 
 
+IMAGES = SpriteAtlas()
+
+
 '''
-The main driver for our code. This will handle the user input and updating the graphics
+Pre-render the board background and the highlight sprites once, instead of rebuilding them every frame. Needs the
+display to be set up (convert/convert_alpha match the surfaces to the screen format for fast blits).
+'''
+def loadSurfaces():
+    board = p.Surface((WIDTH, HEIGHT))
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            p.draw.rect(board, colors[((r+c)%2)], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    SURFACES['board'] = board.convert()
+    selected = p.Surface((SQ_SIZE, SQ_SIZE))
+    selected.set_alpha(100)  # transparency value for square highlight
+    selected.fill(p.Color(20, 85, 30))
+    SURFACES['selected'] = selected.convert()
+    target = p.Surface((SQ_SIZE, SQ_SIZE), p.SRCALPHA).convert_alpha()
+    p.draw.circle(target, (20, 85, 30, 60), (SQ_SIZE // 2, SQ_SIZE // 2), SQ_SIZE // 6)
+    SURFACES['target'] = target
+
+
+'''
+The main driver for our code. This will handle the user input and updating the graphics. All engine work (the valid
+moves of the next position, the AI's search and pondering) runs in a ChessWorker process; the loop only polls it, so
+the window keeps drawing and handling events at MAX_FPS however long the engine thinks.
 '''
 def main():
     p.init()
@@ -35,21 +110,33 @@ def main():
     "gs" is a game state object for calling the constructor and so this calls the initialise 
     constructor (The one in ChessEngine.py and it creates the three variables "board", "whiteToMove", "moveLog")
     '''
-    validMoves = gs.getValidMoves()
+    worker = ChessWorker.EngineWorker(bookPath=OPENING_BOOK, tablebaseDir=TABLEBASE_DIR)
+    validMoves = None   # MoveIndex of the legal moves, None while the worker is still generating them
+    worker.requestValidMoves(gs)
     moveMade = False    #flag variable when a move is made
     animate = False     #flag variable when we should animate a move
-    loadImages()    # only do this once, before the while loop
+    loadSurfaces()
+    shownStates = None  # what each square showed at the last draw, None to redraw everything
+    shownText = None    # the game over text on screen, if any
     running = True
     sqSelected = ()         # no square is selected, Keep track of last click of the user (tuple:(row,col))
     playerClicks = []       #keep tracks of player clicks (two Tuples: [(6,4), (4,4]
     gameOver = False
+    predictedReply = None   # the AI's expected answer to its own move, pondered on while the human thinks
+    showStats = SHOW_STATS
+    if showStats:
+        ChessStats.enable()
+    engineNps = 0.0         # nodes/s of the AI's last search, for the stats overlay
+    engineShares = {}       # share of the AI's last search spent in each timed GameState method, for the overlay
     while running:
+        frameStart = time.perf_counter()
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
             # Mouse Handlers
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn and validMoves is not None:
                     location = p.mouse.get_pos()    # (x,y) location of mouse
                     col = location[0]//SQ_SIZE
                     row = location[1]//SQ_SIZE
@@ -60,51 +147,139 @@ def main():
                         sqSelected = (row, col)
                         playerClicks.append(sqSelected)     #append for both first and second click
                     if len(playerClicks) == 2:  #after the 2nd click
-                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                        print(move.getChessNotation())
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                moveMade = True
-                                animate = True
-                                sqSelected = ()     #reset user clicks
-                                playerClicks = []
+                        move = validMoves.find(playerClicks[0], playerClicks[1])
+                        if move is not None:
+                            print(move.getChessNotation())
+                            gs.makeMove(move)
+                            validMoves = None   # so later clicks in this batch can't match the old position's moves
+                            moveMade = True
+                            animate = True
+                            sqSelected = ()     #reset user clicks
+                            playerClicks = []
                         if not moveMade:
                             playerClicks = [sqSelected]
             # Key Handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  #Undo when 'z' is pressed
+                    worker.cancel()     # stop thinking about a position that no longer exists
                     gs.undoMove()
+                    # against the AI also take back its reply, or it would just play again straight away
+                    aiToMove = not ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo))
+                    if aiToMove and (playerOne or playerTwo) and gs.moveLog:
+                        gs.undoMove()
+                    sqSelected = ()
+                    playerClicks = []
+                    predictedReply = None
+                    validMoves = None   # requested again below, before any further click can use it
+                    humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
                     moveMade = True
                     animate = False
                 if e.key == p.K_r:     #Reset the board OR Rematch
+                    worker.cancel()
                     gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
+                    validMoves = None
+                    worker.requestValidMoves(gs)
+                    humanTurn = playerOne
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
+                if e.key == p.K_s:     # stats overlay on/off
+                    showStats = not showStats
+                    if showStats:
+                        ChessStats.enable()
+                    else:
+                        ChessStats.disable()
+                    shownStates = None
+        eventsDone = time.perf_counter()
+
+        # AI move finder
+        if not gameOver and not humanTurn and not moveMade and validMoves is not None and \
+                not worker.isBusy(ChessWorker.SEARCH):
+            worker.requestSearch(gs, timeLimit=AI_THINK_TIME, stats=showStats)
+
+        for kind, value in worker.poll():
+            if kind == ChessWorker.MOVES:
+                moves, gs.checkmate, gs.stalemate, gs.drawReason, seconds = value
+                ChessStats.record("worker.getValidMoves", seconds)
+                validMoves = ChessEngine.MoveIndex(moves)
+                gs.draw = gs.drawReason is not None
+            elif kind == ChessWorker.SEARCH and value[0] is not None and value[0].bestMove is not None:
+                result, timers = value
+                gs.makeMove(result.bestMove)
+                predictedReply = result.pv[1] if len(result.pv) > 1 else None
+                engineNps = result.nps
+                if timers is not None:
+                    engineShares = {name: seconds / max(result.seconds, 1e-9) for name, seconds in timers.items()}
+                moveMade = True
+                animate = True
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                with ChessStats.phase("frame.animateMove"):
+                    animateMove(gs.moveLog[-1], screen, gs.board, clock)
+            worker.cancel()
+            validMoves = None
+            worker.requestValidMoves(gs)
+            humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+            if humanTurn and predictedReply is not None and animate:
+                gs.makeMove(predictedReply)
+                worker.ponder(gs)   # the worker gets its own copy of the position
+                gs.undoMove()
+            predictedReply = None
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
-        if gs.checkmate:
-            gameOver = True
-            if gs.whiteToMove:
-                drawText(screen, "Black wins by checkmate")
-            else:
-                drawText(screen, "White wins by checkmate")
-        elif gs.stalemate:
-            gameOver = True
-            drawText(screen, "Draw")
+        text = None
+        if validMoves is not None:  # the flags only describe this position once the worker has answered for it
+            if gs.checkmate:
+                text = "Black wins by checkmate" if gs.whiteToMove else "White wins by checkmate"
+            elif gs.stalemate:
+                text = "Draw by stalemate"
+            elif gs.draw:
+                text = "Draw by " + gs.drawReason
+        gameOver = text is not None
+        if text != shownText:
+            shownStates = None  # the text covers several squares, so redraw the whole board under or without it
+            shownText = text
 
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        engineDone = time.perf_counter()
+
+        # Only squares whose piece or highlight changed are redrawn, and only their rectangles are pushed to the display
+        states = squareStates(gs, validMoves, sqSelected)
+        if shownStates is None:
+            drawGameState(screen, gs, validMoves, sqSelected)
+            if text is not None:
+                drawText(screen, text)
+            if showStats:
+                drawStats(screen, engineNps, engineShares)
+            p.display.flip()
+        else:
+            dirtyRects = drawChangedSquares(screen, states, shownStates)
+            if showStats:
+                dirtyRects.append(drawStats(screen, engineNps, engineShares))
+            if dirtyRects:
+                p.display.update(dirtyRects)
+        changed = shownStates != states
+        shownStates = states
+        if showStats:
+            frameEnd = time.perf_counter()
+            ChessStats.record("frame.events", eventsDone - frameStart)
+            ChessStats.record("frame.engine", engineDone - eventsDone)  # polling the worker, and animating a move
+            ChessStats.record("frame.drawGameState", frameEnd - engineDone)
+            ChessStats.record("frame", frameEnd - frameStart)
+
+        # Idle while nothing is happening: wait for input instead of spinning at MAX_FPS. While the worker owes us a
+        # result, wake up once per frame to poll it.
+        if changed or worker.pending:
+            clock.tick(MAX_FPS)
+        else:
+            e = p.event.wait(IDLE_WAIT_MS)
+            if e.type != p.NOEVENT:
+                p.event.post(e)
+            clock.tick()    # keep the clock in step without delaying
+
+    worker.close()
 
 '''
 Highlight square selected and moves for a piece selected
@@ -114,27 +289,10 @@ def highlightSquares(screen, gs, validMoves, sqSelected):
         r, c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):  # sqselected is a piece that can be moved
             # Highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)  # transparency value for square highlight
-            s.fill(p.Color(20, 85, 30))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-
+            screen.blit(SURFACES['selected'], (c * SQ_SIZE, r * SQ_SIZE))
             # Draw circles on valid move squares with transparency
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    # Create a new surface for the circle with per-pixel alpha
-                    circle_surface = p.Surface((SQ_SIZE, SQ_SIZE), p.SRCALPHA)
-                    circle_surface = circle_surface.convert_alpha()  # Ensure surface supports alpha
-                    
-                    center = (SQ_SIZE // 2, SQ_SIZE // 2)
-                    radius = SQ_SIZE // 6
-                    
-                    circle_color = (20, 85, 30, 60)  
-                    p.draw.circle(circle_surface, circle_color, center, radius)
-                    blit_pos = (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE)
-                    screen.blit(circle_surface, blit_pos)
-
-
+            for move in (validMoves.movesFrom(r, c) if validMoves is not None else []):
+                screen.blit(SURFACES['target'], (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
 
 
 '''
@@ -146,16 +304,49 @@ def drawGameState(screen, gs, validMoves, sqSelected):  # This function draws th
     drawPieces(screen, gs.board)    # draw pieces on top of those squares
 
 
+'''
+What every square shows, as a tuple of (piece, highlight) per square in row order. The highlight is 'selected',
+'target' or None, following the same rules as highlightSquares.
+'''
+def squareStates(gs, validMoves, sqSelected):
+    highlights = {}
+    if sqSelected != ():
+        r, c = sqSelected
+        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+            for move in (validMoves.movesFrom(r, c) if validMoves is not None else []):
+                highlights[(move.endRow, move.endCol)] = 'target'
+            highlights[sqSelected] = 'selected'
+    return tuple((gs.board[r][c], highlights.get((r, c))) for r in range(DIMENSION) for c in range(DIMENSION))
+
+
+'''
+Redraw the squares whose state differs from the previous frame and return their rectangles
+'''
+def drawChangedSquares(screen, states, previousStates):
+    dirtyRects = []
+    for i in range(DIMENSION * DIMENSION):
+        if states[i] != previousStates[i]:
+            r, c = divmod(i, DIMENSION)
+            square = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            drawSquare(screen, square, states[i])
+            dirtyRects.append(square)
+    return dirtyRects
+
+
+def drawSquare(screen, square, state):
+    piece, highlight = state
+    screen.blit(SURFACES['board'], square, square)  # the background of just this square
+    if highlight is not None:
+        screen.blit(SURFACES[highlight], square)
+    if piece != "--":
+        screen.blit(IMAGES[piece], square)
+
+
 '''
 Draw the squares on the board.
 '''
 def drawBoard(screen):
-    global colors
-    colors = [p.Color(240,217,181), p.Color(181, 136, 99)]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c)%2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    screen.blit(SURFACES['board'], (0, 0))
 
 '''
 Draw the pieces on the board using the current GameState.board
@@ -168,31 +359,59 @@ def drawPieces(screen, board):
                 screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
 '''
-Animating a move
+Animating a move. The board behind the moving piece is rendered once into a layer; each frame only restores the
+piece's previous rectangle from that layer, draws the piece at its new position and updates those two rectangles.
 '''
 def animateMove(move, screen, board, clock):
-    global colors
-    coords = []     #list of coords that the animation will move through
     dR = move.endRow - move.startRow
     dC = move.endCol - move.startCol
     framesPerSquare = 5    #Frames to move one square
     frameCount = (abs(dR) + abs(dC)) * framesPerSquare
+    endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    layer = SURFACES['board'].copy()
+    drawPieces(layer, board)
+    # Erase the piece moved from its ending square, and draw the captured piece there until it is taken
+    layer.blit(SURFACES['board'], endSquare, endSquare)
+    if move.pieceCaptured != '--' and not move.isEnpassantMove:
+        layer.blit(IMAGES[move.pieceCaptured], endSquare)
+    previous = p.Rect(move.startCol*SQ_SIZE, move.startRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
     for frame in range(frameCount+1):
         r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # Erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        # draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
+        current = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(layer, previous, previous)
+        screen.blit(layer, current, current)
         # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
+        screen.blit(IMAGES[move.pieceMoved], current)
+        p.display.update(previous.union(current))
+        previous = current
         clock.tick(60)
 
+'''
+Draw the stats overlay in the top left corner: frame time, the AI's nodes/s and move generation latency percentiles,
+and where the AI's last search spent its time. Returns the rectangle it covers.
+'''
+def drawStats(screen, engineNps, engineShares):
+    frame = ChessStats.getTimer("frame")
+    movegen = ChessStats.getTimer("worker.getValidMoves")
+    frameMean = frame.total / max(frame.calls, 1)
+    lines = ["frame  mean %.1f ms  p99 %.1f ms" % (frameMean * 1000, frame.percentile(99) * 1000),
+             "engine %.0f nodes/s" % engineNps,
+             "movegen p50 %.2f  p90 %.2f  p99 %.2f ms" % tuple(movegen.percentile(q) * 1000 for q in (50, 90, 99)),
+             "search " + "  ".join("%s %.0f%%" % (name, share * 100) for name, share in engineShares.items()
+                                   if name in ("generateMoves", "isLegal", "makeMove"))]
+    if 'statsFont' not in SURFACES:
+        SURFACES['statsFont'] = p.font.SysFont("monospace", 14)
+    font = SURFACES['statsFont']
+    rendered = [font.render(line, True, p.Color('white')) for line in lines]
+    width = max(line.get_width() for line in rendered) + 12
+    area = p.Rect(0, 0, width, sum(line.get_height() for line in rendered) + 8)
+    screen.fill(p.Color(0, 0, 0), area)
+    y = 4
+    for line in rendered:
+        screen.blit(line, (6, y))
+        y += line.get_height()
+    return area
+
 def drawText(screen, text):
     font = p.font.SysFont("Helvitca", 40, True, False)
     textObject = font.render(text, 0, p.Color('Red'))
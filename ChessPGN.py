@@ -0,0 +1,323 @@
+"""
+Streaming PGN replay and analysis. Games are read lazily, one at a time, so archives far larger than memory can be
+processed; each game is replayed on a GameState by matching its SAN moves against getValidMoves, optionally with a
+search of every position, and one JSON line per game is written as soon as it is done. e.g.
+    python ChessPGN.py games.pgn --workers 4 --out results.jsonl
+    python ChessPGN.py games.pgn --analyse --depth 2 --max-games 100
+"""
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class IllegalMoveError(ValueError):
+    pass
+
+
+'''
+Yield the text of each game in a PGN stream (an iterable of lines, such as an open file) without reading ahead of it
+'''
+def readGames(lines):
+    game = []
+    inMoves = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('[') and inMoves:  # the tag section of the next game
+            yield "".join(game)
+            game = []
+            inMoves = False
+        elif stripped and not stripped.startswith('[') and not stripped.startswith('%'):
+            inMoves = True
+        if stripped or game:
+            game.append(line)
+    if inMoves or any(line.strip() for line in game):
+        yield "".join(game)
+
+
+'''
+Split the text of one game into a dict of its tags and the list of its SAN moves. Comments, variations, NAGs, move
+numbers and the result marker are dropped.
+'''
+def parseGame(text):
+    headers = {}
+    movetext = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']') and not movetext:
+            name, _, value = stripped[1:-1].partition(' ')
+            headers[name] = value.strip().strip('"')
+        elif stripped and not stripped.startswith('%'):
+            movetext.append(line)
+
+    sans = []
+    token = ""
+    braceComment = False
+    lineComment = False
+    variationDepth = 0
+    for char in "\n".join(movetext) + "\n":
+        if braceComment:
+            braceComment = char != '}'
+            continue
+        if lineComment:
+            lineComment = char != '\n'
+            continue
+        if char in " \t\r\n{};()":
+            if token and variationDepth == 0:
+                sans.extend(sanTokens(token))
+            token = ""
+            if char == '{':
+                braceComment = True
+            elif char == ';':
+                lineComment = True
+            elif char == '(':
+                variationDepth += 1
+            elif char == ')':
+                variationDepth = max(variationDepth - 1, 0)
+            continue
+        token += char
+    return headers, sans
+
+
+def sanTokens(token):
+    if token.startswith('$') or token in RESULTS:
+        return []
+    if token.startswith("0-0"):  # castling written with zeros, which would look like a move number below
+        return [token]
+    token = token.lstrip("0123456789").lstrip('.')  # move numbers, also when glued to the move as in "12.e4"
+    return [token] if token and token not in RESULTS else []
+
+
+'''
+Find the move in moves (gs.getValidMoves() when not given) that the SAN string names. Raises IllegalMoveError when no
+move or more than one move matches.
+'''
+def parseSan(gs, san, moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0"):
+        candidates = [move for move in moves if move.isCastleMove and move.endCol == 6]
+    elif text in ("O-O-O", "0-0-0"):
+        candidates = [move for move in moves if move.isCastleMove and move.endCol == 2]
+    else:
+        promotion = None
+        if '=' in text:
+            text, promotion = text.split('=', 1)
+        elif len(text) > 2 and text[-1] in "NBRQ" and text[-2].isdigit():
+            text, promotion = text[:-1], text[-1]
+        if promotion is not None and promotion != 'Q':
+            raise IllegalMoveError("%s: the engine only promotes to a queen" % san)
+        piece = text[0] if text and text[0] in "NBRQK" else 'P'
+        body = (text[1:] if piece != 'P' else text).replace('x', '').replace('-', '')
+        if len(body) < 2 or body[-2] not in ChessEngine.Move.filesToCol or body[-1] not in ChessEngine.Move.rankToRows:
+            raise IllegalMoveError("can't parse SAN move %r" % san)
+        endRow = ChessEngine.Move.rankToRows[body[-1]]
+        endCol = ChessEngine.Move.filesToCol[body[-2]]
+        disambiguation = body[:-2]
+        candidates = []
+        for move in moves:
+            if move.pieceMoved[1] != piece or move.endRow != endRow or move.endCol != endCol:
+                continue
+            start = move.getRankFile(move.startRow, move.startCol)
+            if all(char in start for char in disambiguation):
+                candidates.append(move)
+    if len(candidates) != 1:
+        raise IllegalMoveError("%s move %r in %s" % ("ambiguous" if candidates else "illegal", san, gs.getFen()))
+    return candidates[0]
+
+
+'''
+The SAN of a legal move of gs, e.g. "Nbd7", "exd5", "O-O" or "e8=Q#". moves (gs.getValidMoves() when not given) are
+the legal moves, used to disambiguate. The move is played and taken back to find check and mate.
+'''
+def moveToSan(gs, move, moves=None):
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    else:
+        piece = move.pieceMoved[1]
+        end = move.getRankFile(move.endRow, move.endCol)
+        if piece == 'P':
+            san = (move.colsToFiles[move.startCol] + 'x' + end) if move.isCapture else end
+            if move.isPawnPromotion:
+                san += "=Q"
+        else:
+            if moves is None:
+                moves = gs.getValidMoves()
+            rivals = [other for other in moves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow
+                      and other.endCol == move.endCol and other.moveID != move.moveID]
+            disambiguation = ""
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    disambiguation = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    disambiguation = move.rowsToRank[move.startRow]
+                else:
+                    disambiguation = move.getRankFile(move.startRow, move.startCol)
+            san = piece + disambiguation + ('x' if move.isCapture else '') + end
+    gs.makeMove(move)
+    if gs.inCheck():
+        san += '+' if gs.hasLegalMove() else '#'
+    gs.undoMove()
+    return san
+
+
+'''
+PGN text for one game: the tag pairs in the given order, then the SAN moves numbered and wrapped at 80 columns
+'''
+def formatGame(headers, sans, result, startWhite=True, startNumber=1):
+    lines = ['[%s "%s"]' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in headers.items()]
+    tokens = []
+    number, white = startNumber, startWhite
+    for i, san in enumerate(sans):
+        if white:
+            tokens.append("%d." % number)
+        elif i == 0:
+            tokens.append("%d..." % number)
+        tokens.append(san)
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(result)
+    movetext = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            movetext.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    movetext.append(line)
+    return "\n".join(lines) + "\n\n" + "\n".join(movetext) + "\n"
+
+
+'''
+Replay one game given as PGN text and return a JSON-ready dict about it. With analyseDepth, every position is also
+searched to that depth and the score, best move and played move are listed per ply.
+'''
+def processGame(text, analyseDepth=None, searcher=None):
+    headers, sans = parseGame(text)
+    record = {"white": headers.get("White", "?"), "black": headers.get("Black", "?"),
+              "result": headers.get("Result", "*"), "plies": 0, "error": None}
+    try:
+        gs = ChessEngine.GameState.fromFen(headers["FEN"]) if "FEN" in headers else ChessEngine.GameState()
+    except ValueError as error:
+        record["error"] = str(error)
+        return record
+    analysis = [] if analyseDepth else None
+    if analyseDepth and searcher is None:
+        import ChessAI
+        searcher = ChessAI.Searcher(1 << 16)
+    for san in sans:
+        moves = gs.getValidMoves()
+        try:
+            move = parseSan(gs, san, moves)
+        except IllegalMoveError as error:
+            record["error"] = str(error)
+            break
+        if analysis is not None:
+            result = searcher.search(gs, analyseDepth)
+            analysis.append({"played": move.getChessNotation(), "best": result.bestMove.getChessNotation(),
+                             "score": result.score})
+        gs.makeMove(move)
+        record["plies"] += 1
+    record["fen"] = gs.getFen()
+    if analysis is not None:
+        record["analysis"] = analysis
+    return record
+
+
+_workerSearcher = None
+
+
+def _initWorker():
+    global _workerSearcher
+    import ChessAI
+    _workerSearcher = ChessAI.Searcher(1 << 16)
+
+
+def _processInWorker(text, analyseDepth):
+    return processGame(text, analyseDepth, _workerSearcher if analyseDepth else None)
+
+
+'''
+Process every game of a PGN stream and write one JSON line per game to out, in input order. With more than one worker
+the games go to a process pool, with at most a few games per worker in flight so memory stays bounded however long the
+stream is. Returns (games, positions, seconds).
+'''
+def processStream(lines, out, workers=1, analyseDepth=None, maxGames=None, progress=None, progressEvery=5.0):
+    games = readGames(lines)
+    if maxGames is not None:
+        games = (text for i, text in zip(range(maxGames), games))
+    start = time.perf_counter()
+    lastReport = start
+    gameCount = positionCount = 0
+
+    def write(record):
+        nonlocal gameCount, positionCount, lastReport
+        out.write(json.dumps(record) + "\n")
+        gameCount += 1
+        positionCount += record["plies"] + 1
+        now = time.perf_counter()
+        if progress is not None and now - lastReport >= progressEvery:
+            lastReport = now
+            reportRates(progress, gameCount, positionCount, now - start)
+
+    if workers <= 1:
+        searcher = None
+        if analyseDepth:
+            import ChessAI
+            searcher = ChessAI.Searcher(1 << 16)
+        for text in games:
+            write(processGame(text, analyseDepth, searcher))
+    else:
+        with multiprocessing.get_context("spawn").Pool(workers, _initWorker) as pool:
+            inFlight = collections.deque()
+            for text in games:
+                inFlight.append(pool.apply_async(_processInWorker, (text, analyseDepth)))
+                if len(inFlight) >= workers * 4:
+                    write(inFlight.popleft().get())
+            while inFlight:
+                write(inFlight.popleft().get())
+    out.flush()
+    return gameCount, positionCount, time.perf_counter() - start
+
+
+def reportRates(out, games, positions, seconds):
+    seconds = max(seconds, 1e-9)
+    print("%d games, %d positions in %.1fs: %.1f games/s, %.0f positions/s" %
+          (games, positions, seconds, games / seconds, positions / seconds), file=out)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay and analyse the games of a PGN file")
+    parser.add_argument("pgn", help="PGN file, or - for stdin")
+    parser.add_argument("--out", help="JSON lines output file (default stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--analyse", action="store_true", help="search every position as well")
+    parser.add_argument("--depth", type=int, default=2, help="search depth with --analyse")
+    parser.add_argument("--max-games", type=int)
+    args = parser.parse_args()
+    source = sys.stdin if args.pgn == "-" else open(args.pgn, encoding="utf-8", errors="replace")
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        games, positions, seconds = processStream(source, out, args.workers, args.depth if args.analyse else None,
+                                                  args.max_games, progress=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    reportRates(sys.stderr, games, positions, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Parallel search. CPython threads can't run a pure-Python search on more than one core, so the root moves are split
+between worker processes: each worker gets its own copy of the GameState and runs the ChessAI search, with iterative
+deepening, over its share of the root moves. The deepest depth completed by every worker decides the best move.
+With one worker the search runs in this process and is fully deterministic.
+"""
+import multiprocessing
+import os
+import time
+
+import ChessAI
+
+_workerSearcher = None  # one Searcher per worker process, so its transposition table survives between searches
+
+
+def _initWorker(ttSize):
+    global _workerSearcher
+    _workerSearcher = ChessAI.Searcher(ttSize)
+
+
+def _searchRootMoves(gs, rootMoveIDs, maxDepth, timeLimit, nodeLimit):
+    results = []
+    _workerSearcher.search(gs, maxDepth, timeLimit, nodeLimit, onIteration=results.append, rootMoveIDs=rootMoveIDs)
+    return results
+
+
+class ParallelSearcher():
+    def __init__(self, workers=None, ttSize=1 << 18):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.ttSize = ttSize
+        self.pool = None
+        self.searcher = None
+        if self.workers > 1:
+            self.pool = multiprocessing.get_context("spawn").Pool(self.workers, _initWorker, (ttSize,))
+        else:
+            self.searcher = ChessAI.Searcher(ttSize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    '''
+    Search gs within the budget and return a ChessAI.SearchResult. The nodes and nps cover all workers.
+    '''
+    def search(self, gs, maxDepth=64, timeLimit=None, nodeLimit=None):
+        if self.pool is None:
+            return self.searcher.search(gs, maxDepth, timeLimit, nodeLimit)
+        start = time.perf_counter()
+        moves = gs.getValidMoves()
+        if len(moves) <= 1:  # nothing to split, a single worker-sized search is enough
+            if self.searcher is None:
+                self.searcher = ChessAI.Searcher(self.ttSize)
+            return self.searcher.search(gs, maxDepth, timeLimit, nodeLimit)
+        # Deal the root moves out round robin after a cheap ordering, so every worker gets some promising moves
+        moves.sort(key=ChessAI.mvvLva, reverse=True)
+        shares = [set() for _ in range(min(self.workers, len(moves)))]
+        for i, move in enumerate(moves):
+            shares[i % len(shares)].add(move.moveID)
+        workerNodeLimit = nodeLimit // len(shares) if nodeLimit is not None else None
+        pending = [self.pool.apply_async(_searchRootMoves, (gs, share, maxDepth, timeLimit, workerNodeLimit))
+                   for share in shares]
+        workerResults = [job.get() for job in pending]
+        return combineResults(workerResults, time.perf_counter() - start)
+
+
+'''
+Merge the per-iteration results of each worker: a forced mate found by any worker wins outright, otherwise the best
+score at the deepest depth every worker completed
+'''
+def combineResults(workerResults, seconds):
+    workerResults = [results for results in workerResults if results and results[-1].bestMove is not None]
+    nodes = sum(results[-1].nodes for results in workerResults)
+    mates = [result for results in workerResults for result in results if result.score > ChessAI.MATE_BOUND]
+    if mates:
+        best = max(mates, key=lambda result: result.score)
+    else:
+        # a worker whose moves all get mated stops deepening early, so it doesn't hold the common depth back
+        alive = [results for results in workerResults if results[-1].score >= -ChessAI.MATE_BOUND] or workerResults
+        commonDepth = min(results[-1].depth for results in alive)
+        best = max((results[min(commonDepth, len(results)) - 1] for results in workerResults),
+                   key=lambda result: result.score)
+    return ChessAI.SearchResult(best.bestMove, best.score, best.depth, nodes, seconds, best.pv)
@@ -0,0 +1,144 @@
+"""
+Perft: count the leaf nodes of the legal move tree to a fixed depth. The counts for well known positions are published,
+so perft both verifies the move generator and measures its speed. Runs headless, e.g.
+    python ChessPerft.py 4                          # start position, depths 1 to 4
+    python ChessPerft.py 3 --position kiwipete --divide
+    python ChessPerft.py --verify --min-nps 20000   # check every reference position, exit 1 on a mismatch
+"""
+import sys
+import time
+
+import ChessEngine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# name: (FEN, node counts for depth 1, 2, ...). The engine always promotes to a queen, so the trees are chosen
+# to be free of promotions at these depths.
+REFERENCE_POSITIONS = {
+    "start": (START_FEN, (20, 400, 8902, 197281)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", (48, 2039, 97862)),
+    "enpassant-pin": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", (14, 191, 2812, 43238, 674624)),
+    "enpassant-illegal-rank": ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", (18, 92, 1670, 10138)),
+    "enpassant-illegal-diagonal": ("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", (13, 102, 1266, 10276)),
+    "enpassant-gives-check": ("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", (15, 126, 1928, 13931)),
+    "castling": ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", (26, 568, 13744, 314346)),
+    "castling-short-check": ("5k2/8/8/8/8/8/8/4K2R w K - 0 1", (15, 66, 1198, 6399)),
+    "castling-long-check": ("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", (16, 71, 1286, 7418)),
+    "castling-rights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", (26, 1141, 27826)),
+    "castling-prevented": ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", (44, 1494, 50509)),
+    "double-check": ("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", (37, 183, 6559, 23527)),
+}
+
+
+'''
+Count the leaf nodes of the legal move tree below gs, depth plies deep. The last ply is counted from the length of the
+move list (bulk counting) rather than played out.
+'''
+def perft(gs, depth):
+    if depth <= 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+'''
+Perft split by root move: returns a dict of move notation to the node count below that move, empty for depth 0
+'''
+def divide(gs, depth):
+    counts = {}
+    if depth <= 0:
+        return counts
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+'''
+Run perft for depths 1 to maxDepth and return a list of (depth, nodes, seconds)
+'''
+def perftByDepth(gs, maxDepth):
+    results = []
+    for depth in range(1, maxDepth + 1):
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        results.append((depth, nodes, time.perf_counter() - start))
+    return results
+
+
+'''
+Check every reference position up to maxDepth. Returns a list of failure messages, empty when everything matches
+and the overall speed is at least minNps nodes per second.
+'''
+def verify(maxDepth, gameStateClass=ChessEngine.GameState, minNps=0, out=sys.stdout):
+    failures = []
+    totalNodes = 0
+    totalTime = 0.0
+    for name, (fen, expected) in REFERENCE_POSITIONS.items():
+        gs = gameStateClass.fromFen(fen)
+        for depth, nodes, seconds in perftByDepth(gs, min(maxDepth, len(expected))):
+            totalNodes += nodes
+            totalTime += seconds
+            status = "ok" if nodes == expected[depth - 1] else "MISMATCH (expected %d)" % expected[depth - 1]
+            if nodes != expected[depth - 1]:
+                failures.append("%s depth %d: %d nodes, expected %d" % (name, depth, nodes, expected[depth - 1]))
+            print("%-28s depth %d %10d nodes  %s" % (name, depth, nodes, status), file=out)
+    nps = totalNodes / totalTime if totalTime > 0 else 0.0
+    print("total %d nodes in %.2fs, %.0f nodes/s" % (totalNodes, totalTime, nps), file=out)
+    if nps < minNps:
+        failures.append("throughput %.0f nodes/s is below the minimum of %.0f" % (nps, minNps))
+    return failures
+
+
+def main():
+    import argparse
+    import ChessBitboard
+
+    def depthArgument(text):
+        depth = int(text)
+        if depth < 0:
+            raise argparse.ArgumentTypeError("depth must be 0 or more, not %d" % depth)
+        return depth
+
+    parser = argparse.ArgumentParser(description="Perft move generation counter and regression check")
+    parser.add_argument("depth", type=depthArgument, nargs="?", default=3)
+    parser.add_argument("--position", choices=sorted(REFERENCE_POSITIONS), default="start")
+    parser.add_argument("--fen", help="FEN of the position to count (overrides --position)")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    parser.add_argument("--verify", action="store_true", help="check all reference positions up to depth")
+    parser.add_argument("--min-nps", type=float, default=0, help="with --verify, fail below this many nodes/s")
+    args = parser.parse_args()
+    gameStateClass = ChessBitboard.BitboardGameState if args.bitboard else ChessEngine.GameState
+
+    if args.verify:
+        failures = verify(args.depth, gameStateClass, args.min_nps)
+        for failure in failures:
+            print("FAIL:", failure)
+        sys.exit(1 if failures else 0)
+
+    gs = gameStateClass.fromFen(args.fen or REFERENCE_POSITIONS[args.position][0])
+    if args.divide:
+        start = time.perf_counter()
+        counts = divide(gs, args.depth)
+        seconds = time.perf_counter() - start
+        for notation in sorted(counts):
+            print("%s: %d" % (notation, counts[notation]))
+        total = sum(counts.values())
+        print("\nmoves: %d  nodes: %d  time: %.2fs  nps: %.0f" %
+              (len(counts), total, seconds, total / max(seconds, 1e-9)))
+        return
+    for depth, nodes, seconds in perftByDepth(gs, args.depth):
+        print("depth %d  nodes %10d  time %7.2fs  nps %9.0f" % (depth, nodes, seconds, nodes / max(seconds, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Multi-game server: one asyncio process hosts many games over a local TCP socket. An idle game is kept as its 32 byte
+ChessBinary position plus the Zobrist keys needed for repetition draws, not as a GameState, so thousands of open games
+cost little memory. Engine moves are searched in a process pool; at most maxPending searches are queued at once, and
+a connection's commands are handled one at a time, so a client that sends faster than the engines keep up is slowed
+down by TCP itself. The protocol is one command per line, answered by one line starting with "ok" or "error":
+    new [fen]           ok <game id>
+    move <id> <uci>     ok <result>                  result is 1-0, 0-1, 1/2-1/2 or * while the game goes on
+    go <id> [depth]     ok <uci move> <score> <result>, the engine's move, which is also played; depth is 1 to maxDepth
+    fen <id>            ok <fen>
+    close <id>          ok
+    stats               ok games <n> searching <n>
+e.g.
+    python ChessServer.py --port 8765 --workers 4
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+from array import array
+
+import ChessAI
+import ChessBinary
+import ChessEngine
+import ChessUCI
+
+
+class Game():
+    __slots__ = ("position", "history", "busy")
+
+    def __init__(self, position, history):
+        self.position = position  # ChessBinary packed bytes
+        self.history = history  # array('Q') of Zobrist keys since the last capture or pawn move, this position last
+        self.busy = False  # an engine search is running for it
+
+
+'''
+Load a stored game into gs, including the Zobrist history the repetition rule looks at
+'''
+def loadGame(game, gs):
+    ChessBinary.unpackPosition(game.position, gs)
+    gs.zobristLog = array('Q', game.history)
+    return gs
+
+
+def storeGame(game, gs):
+    game.position = ChessBinary.packPosition(gs)
+    game.history = gs.zobristLog[-(gs.halfmoveClock + 1):]
+
+
+_workerSearcher = None
+_workerState = None
+
+
+def _initWorker(ttSize):
+    global _workerSearcher, _workerState
+    _workerSearcher = ChessAI.Searcher(ttSize)
+    _workerState = ChessEngine.GameState()
+
+
+def _searchInWorker(position, history, depth, timeLimit):
+    gs = loadGame(Game(position, history), _workerState)
+    result = _workerSearcher.search(gs, depth, timeLimit)
+    if result is None or result.bestMove is None:
+        return None, 0
+    return ChessUCI.moveToUci(result.bestMove), result.score
+
+
+class GameServer():
+    def __init__(self, workers=1, maxPending=64, depth=3, timeLimit=10.0, ttSize=1 << 16, maxDepth=8):
+        self.games = {}
+        self.nextGameID = 1
+        self.depth = depth
+        self.maxDepth = maxDepth  # deepest search a client may ask for
+        self.timeLimit = timeLimit  # and the longest any one search may hold a worker
+        self.scratch = ChessEngine.GameState()  # every command loads its game into this one state
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers, multiprocessing.get_context("spawn"),
+                                                               _initWorker, (ttSize,))
+        self.searchSlots = asyncio.Semaphore(maxPending)
+        self.searching = 0
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def newGame(self, fen=None):
+        gs = ChessEngine.GameState.fromFen(fen) if fen else ChessEngine.GameState()
+        gameID = self.nextGameID
+        self.nextGameID += 1
+        self.games[gameID] = Game(ChessBinary.packPosition(gs), gs.zobristLog[-1:])
+        return gameID
+
+    def getGame(self, text):
+        game = self.games.get(int(text)) if text.isdigit() else None
+        if game is None:
+            raise KeyError("no game " + text)
+        if game.busy:
+            raise KeyError("game %s is searching" % text)
+        return game
+
+    '''
+    Carry out one command line and return the answer line. Any error, including one raised by the search in a worker,
+    is answered with an error line rather than dropping the connection.
+    '''
+    async def execute(self, line):
+        tokens = line.split()
+        if not tokens:
+            return "error empty command"
+        command, args = tokens[0], tokens[1:]
+        try:
+            if command == "new":
+                return "ok %d" % self.newGame(" ".join(args))
+            if command == "stats":
+                return "ok games %d searching %d" % (len(self.games), self.searching)
+            if not args:
+                return "error %s needs a game id" % command
+            game = self.getGame(args[0])
+            if command == "fen":
+                return "ok " + loadGame(game, self.scratch).getFen()
+            if command == "close":
+                del self.games[int(args[0])]
+                return "ok"
+            if command == "move" and len(args) == 2:
+                gs = loadGame(game, self.scratch)
+                move = ChessUCI.parseUciMove(gs, args[1])
+                if move is None:
+                    return "error illegal move " + args[1]
+                gs.makeMove(move)
+                storeGame(game, gs)
+                return "ok " + gs.getResult()
+            if command == "go":
+                depth = int(args[1]) if len(args) > 1 else self.depth
+                if not 1 <= depth <= self.maxDepth:
+                    return "error depth must be from 1 to %d" % self.maxDepth
+                return await self.engineMove(game, depth)
+        except (KeyError, ValueError) as error:  # KeyError's str() would quote the message
+            return "error %s" % (error.args[0] if len(error.args) == 1 and isinstance(error.args[0], str) else error,)
+        except Exception as error:
+            return "error %s: %s" % (type(error).__name__, error)
+        return "error unknown command " + line.strip()
+
+    async def engineMove(self, game, depth):
+        game.busy = True
+        try:
+            async with self.searchSlots:
+                self.searching += 1
+                try:
+                    uci, score = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, _searchInWorker, game.position, game.history, depth, self.timeLimit)
+                finally:
+                    self.searching -= 1
+        finally:
+            game.busy = False
+        gs = loadGame(game, self.scratch)
+        if uci is None:
+            return "error no legal moves, " + gs.getResult()
+        gs.makeMove(ChessUCI.parseUciMove(gs, uci))
+        storeGame(game, gs)
+        return "ok %s %d %s" % (uci, score, gs.getResult())
+
+    async def handleConnection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((await self.execute(line.decode("ascii", "replace")) + "\n").encode("ascii"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, ready=None):
+        server = await asyncio.start_server(self.handleConnection, host, port)
+        if ready is not None:
+            ready.set_result(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Host many chess games over a local socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="engine search processes")
+    parser.add_argument("--max-pending", type=int, default=64, help="searches queued at most before clients wait")
+    parser.add_argument("--depth", type=int, default=3, help="default search depth for go")
+    parser.add_argument("--max-depth", type=int, default=8, help="deepest search a client may ask for")
+    parser.add_argument("--time", type=float, default=10.0, help="time limit per engine move in seconds")
+    args = parser.parse_args()
+
+    async def run():
+        server = GameServer(args.workers, args.max_pending, args.depth, args.time, maxDepth=args.max_depth)
+        try:
+            await server.serve(args.host, args.port)
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Opt-in instrumentation. Nothing is measured until enable() is called: it then swaps the hot GameState methods and Move
+construction for wrappers that count and time every call, and disable() puts the originals back, so when it is off
+the engine runs exactly the code it would without this module. Callers time their own phases with record() or phase(),
+which do nothing while disabled. The numbers come out as a dict, JSON or Prometheus text, e.g.
+    ChessStats.enable()
+    ChessPerft.perft(gs, 3)
+    print(ChessStats.toJson())
+"""
+import contextlib
+import functools
+import inspect
+import json
+import time
+from array import array
+
+import ChessEngine
+
+SAMPLE_SIZE = 4096  # the latest durations each timer keeps for its percentiles
+PERCENTILES = (50, 90, 99)
+TIMED_METHODS = ("getValidMoves", "generateMoves", "isLegal", "squareUnderAttack", "makeMove", "undoMove")
+
+enabled = False
+timers = {}
+counters = {}
+_patched = []  # (class, attribute, original) of every wrapper installed by enable()
+
+
+class Timer():
+    '''
+    Call count and total time, plus a ring of the latest SAMPLE_SIZE durations for percentiles
+    '''
+    __slots__ = ("calls", "total", "samples")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.total = 0.0
+        self.samples = array('d')
+
+    def add(self, seconds):
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.calls % SAMPLE_SIZE] = seconds
+        self.calls += 1
+        self.total += seconds
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) * q // 100, len(ordered) - 1)]
+
+    def summary(self):
+        result = {"calls": self.calls, "total_seconds": self.total,
+                  "mean_us": self.total / self.calls * 1e6 if self.calls else 0.0}
+        for q in PERCENTILES:
+            result["p%d_us" % q] = self.percentile(q) * 1e6
+        return result
+
+
+def getTimer(name):
+    timer = timers.get(name)
+    if timer is None:
+        timer = timers[name] = Timer()
+    return timer
+
+
+def record(name, seconds):
+    if enabled:
+        getTimer(name).add(seconds)
+
+
+def count(name, amount=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+class _Phase():
+    __slots__ = ("timer", "start")
+
+    def __init__(self, name):
+        self.timer = getTimer(name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *excInfo):
+        self.timer.add(time.perf_counter() - self.start)
+
+
+_NOT_TIMED = contextlib.nullcontext()
+
+
+'''
+A context manager timing its block under name, or a shared do-nothing one while disabled
+'''
+def phase(name):
+    return _Phase(name) if enabled else _NOT_TIMED
+
+
+def _timedMethod(name, method):
+    timer = getTimer(name)
+    clock = time.perf_counter
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        start = clock()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timer.add(clock() - start)
+    return timed
+
+
+'''
+The generator version: one sample per generator, the time spent inside it until it is exhausted or closed. The
+consumer's work between moves, e.g. the search below each move, is not counted.
+'''
+def _timedGenerator(name, method):
+    timer = getTimer(name)
+    clock = time.perf_counter
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        generator = method(*args, **kwargs)
+        spent = 0.0
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    spent += clock() - start
+                yield item
+        finally:
+            generator.close()
+            timer.add(spent)
+    return timed
+
+
+def _countedInit(init):
+    @functools.wraps(init)
+    def counted(self, *args, **kwargs):
+        counters["Move"] = counters.get("Move", 0) + 1
+        init(self, *args, **kwargs)
+    return counted
+
+
+def _gameStateClasses():
+    classes = [ChessEngine.GameState]
+    for cls in classes:
+        classes.extend(sub for sub in cls.__subclasses__() if sub not in classes)
+    return classes
+
+
+'''
+Start measuring: wrap the TIMED_METHODS of GameState and every subclass defining its own (a subclass's timers are
+named after it, e.g. "BitboardGameState.getValidMoves"), and count Move objects created. Subclasses imported later
+are only covered by calling enable() again.
+'''
+def enable():
+    global enabled
+    enabled = True
+    for cls in _gameStateClasses():
+        for name in TIMED_METHODS:
+            method = cls.__dict__.get(name)
+            if method is None or hasattr(method, "__wrapped__"):
+                continue
+            timerName = name if cls is ChessEngine.GameState else "%s.%s" % (cls.__name__, name)
+            _patched.append((cls, name, method))
+            wrap = _timedGenerator if inspect.isgeneratorfunction(method) else _timedMethod
+            setattr(cls, name, wrap(timerName, method))
+    init = ChessEngine.Move.__init__
+    if not hasattr(init, "__wrapped__"):
+        _patched.append((ChessEngine.Move, "__init__", init))
+        ChessEngine.Move.__init__ = _countedInit(init)
+
+
+def disable():
+    global enabled
+    enabled = False
+    while _patched:
+        cls, name, original = _patched.pop()
+        setattr(cls, name, original)
+
+
+'''
+Zero every timer and counter. The timers are cleared in place, since the installed wrappers hold on to them.
+'''
+def reset():
+    for timer in timers.values():
+        timer.clear()
+    counters.clear()
+
+
+def snapshot():
+    return {"enabled": enabled, "timers": {name: timer.summary() for name, timer in sorted(timers.items())},
+            "counters": dict(sorted(counters.items()))}
+
+
+def toJson(indent=2):
+    return json.dumps(snapshot(), indent=indent)
+
+
+'''
+The snapshot in the Prometheus text exposition format
+'''
+def toPrometheus(prefix="chess"):
+    data = snapshot()
+    lines = ["# TYPE %s_calls_total counter" % prefix]
+    lines += ['%s_calls_total{name="%s"} %d' % (prefix, name, timer["calls"])
+              for name, timer in data["timers"].items()]
+    lines.append("# TYPE %s_seconds_total counter" % prefix)
+    lines += ['%s_seconds_total{name="%s"} %.9f' % (prefix, name, timer["total_seconds"])
+              for name, timer in data["timers"].items()]
+    lines.append("# TYPE %s_latency_seconds summary" % prefix)
+    for name, timer in data["timers"].items():
+        for q in PERCENTILES:
+            lines.append('%s_latency_seconds{name="%s",quantile="%.2f"} %.9f' %
+                         (prefix, name, q / 100, timer["p%d_us" % q] / 1e6))
+    lines.append("# TYPE %s_events_total counter" % prefix)
+    lines += ['%s_events_total{name="%s"} %d' % (prefix, name, value) for name, value in data["counters"].items()]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    import argparse
+    import ChessPerft
+    parser = argparse.ArgumentParser(description="Run perft with the engine instrumented and print the stats")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--fen", default=ChessPerft.START_FEN)
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    args = parser.parse_args()
+    gs = ChessEngine.GameState.fromFen(args.fen)
+    plain = time.perf_counter()
+    ChessPerft.perft(gs, args.depth)
+    plain = time.perf_counter() - plain
+    enable()
+    instrumented = time.perf_counter()
+    ChessPerft.perft(gs, args.depth)
+    instrumented = time.perf_counter() - instrumented
+    disable()
+    if args.format == "json":
+        print(toJson())
+    else:
+        print(toPrometheus(), end="")
+    print("perft %d: %.2fs plain, %.2fs instrumented" % (args.depth, plain, instrumented))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Endgame tablebases for a king and one piece against a bare king: KQK, KRK and KPK. Each table holds, for every
+position, whether the side to move wins, draws or loses and in how many plies the game ends in mate with best play.
+Tables are built by retrograde analysis: every position is expanded once with the engine's own move generation, and
+the results are then propagated backwards from the checkmates, one ply at a time. Expanding positions is the slow part
+and is spread over a process pool.
+
+Positions are stored for white as the side with the piece; a position where black has it is probed with the colors
+swapped. Pawnless tables use all eight board symmetries (the white king is moved into the a1-d1-d4 triangle), the pawn
+table only the mirror between the a-d and e-h files. A table file is a 16 byte header followed by one byte per
+position, and is probed through a read-only memory map. e.g.
+    python ChessTablebase.py generate --dir tablebases --workers 4
+    python ChessTablebase.py probe --dir tablebases --fen "8/8/8/4k3/8/8/8/4K2Q w - - 0 1"
+"""
+import array
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+import ChessEngine
+
+TABLES = ("KQK", "KRK", "KPK")  # in generation order, KPK promotes into KQK
+TABLE_SUFFIX = ".ctb"
+MAGIC = b"CTB1"
+_HEADER = struct.Struct(">4s4sI4x")  # magic, table name, number of positions
+
+# Probe results, from the point of view of the side to move
+WIN, DRAW, LOSS = 1, 0, -1
+
+# Stored values: 0 a draw, 1-127 the side to move mates in that many plies, 128 + n it is mated in n plies
+_DRAW_VALUE = 0
+_LOSS_VALUE = 128
+_UNKNOWN_VALUE = 254  # only during generation
+_ILLEGAL_VALUE = 255
+
+# The white king squares each kind of table is reduced to, as row * 8 + col
+_PAWNLESS_KING_SQUARES = [r * 8 + c for r in range(8) for c in range(4) if 7 - r <= c]
+_PAWN_KING_SQUARES = [r * 8 + c for r in range(8) for c in range(4)]
+_KING_SLOTS = {False: {sq: slot for slot, sq in enumerate(_PAWNLESS_KING_SQUARES)},
+               True: {sq: slot for slot, sq in enumerate(_PAWN_KING_SQUARES)}}
+
+
+def tableSize(name):
+    return len(_PAWN_KING_SQUARES if name[1] == 'P' else _PAWNLESS_KING_SQUARES) * 64 * 64 * 2
+
+
+def tablePath(directory, name):
+    return os.path.join(directory, name + TABLE_SUFFIX)
+
+
+'''
+The index of the position with the white king, black king and white piece on the given squares (row * 8 + col).
+Applies the symmetries that bring the white king into the squares the table covers.
+'''
+def positionIndex(whiteKing, blackKing, piece, whiteToMove, hasPawn):
+    if whiteKing & 7 > 3:
+        whiteKing, blackKing, piece = whiteKing ^ 7, blackKing ^ 7, piece ^ 7  # mirror files
+    if not hasPawn:
+        if whiteKing < 32:
+            whiteKing, blackKing, piece = whiteKing ^ 56, blackKing ^ 56, piece ^ 56  # mirror ranks
+        if 7 - (whiteKing >> 3) > whiteKing & 7:
+            whiteKing, blackKing, piece = _transpose(whiteKing), _transpose(blackKing), _transpose(piece)
+    return ((_KING_SLOTS[hasPawn][whiteKing] * 64 + blackKing) * 64 + piece) * 2 + (not whiteToMove)
+
+
+def _transpose(sq):  # mirror in the a1-h8 diagonal
+    return (7 - (sq & 7)) * 8 + 7 - (sq >> 3)
+
+
+def decodeValue(value):
+    if value == _ILLEGAL_VALUE:
+        return None
+    if value == _DRAW_VALUE:
+        return DRAW, 0
+    if value < _LOSS_VALUE:
+        return WIN, value
+    return LOSS, value - _LOSS_VALUE
+
+
+class Tablebase():
+    '''
+    One table file, memory-mapped read-only
+    '''
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, size = _HEADER.unpack_from(self.data)
+        self.name = name.rstrip(b"\0").decode("ascii")
+        if magic != MAGIC or self.name not in TABLES or size != tableSize(self.name) or \
+                len(self.data) != _HEADER.size + size:
+            self.close()
+            raise ValueError("%s is not a valid tablebase file" % path)
+        self.hasPawn = self.name[1] == 'P'
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probeSquares(self, whiteKing, blackKing, piece, whiteToMove):
+        return self.data[_HEADER.size + positionIndex(whiteKing, blackKing, piece, whiteToMove, self.hasPawn)]
+
+
+class Tablebases():
+    '''
+    Every table found in a directory. Tables that haven't been generated are simply not probed.
+    '''
+    def __init__(self, directory):
+        self.tables = {}
+        for name in TABLES:
+            path = tablePath(directory, name)
+            if os.path.exists(path):
+                self.tables[name] = Tablebase(path)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    '''
+    Look up gs and return (WIN, DRAW or LOSS for the side to move, plies to mate), or None when no table covers the
+    position. Positions with castling rights left are never covered.
+    '''
+    def probe(self, gs):
+        white, black = gs.pieceSquares['w'], gs.pieceSquares['b']
+        if len(white) + len(black) != 3 or gs.castlingRights:
+            return None
+        strong = 'w' if len(white) == 2 else 'b'
+        kingSquare = gs.whiteKingLocation if strong == 'w' else gs.blackKingLocation
+        r, c = next(sq for sq in gs.pieceSquares[strong] if sq != kingSquare)
+        table = self.tables.get('K' + gs.board[r][c][1] + 'K')
+        if table is None:
+            return None
+        whiteKing = gs.whiteKingLocation[0] * 8 + gs.whiteKingLocation[1]
+        blackKing = gs.blackKingLocation[0] * 8 + gs.blackKingLocation[1]
+        if strong == 'w':
+            value = table.probeSquares(whiteKing, blackKing, r * 8 + c, gs.whiteToMove)
+        else:  # swap the colors, which also mirrors the ranks
+            value = table.probeSquares(blackKing ^ 56, whiteKing ^ 56, (r * 8 + c) ^ 56, not gs.whiteToMove)
+        return decodeValue(value)
+
+
+'''
+Set up the position of a table index on gs. Returns False when the index isn't a legal position: pieces on the same
+square, a pawn on the first or last rank, or the side that just moved left in check.
+'''
+def _setIndexPosition(gs, name, index):
+    kingSquares = _PAWN_KING_SQUARES if name[1] == 'P' else _PAWNLESS_KING_SQUARES
+    whiteToMove = not index & 1
+    index >>= 1
+    piece = index & 63
+    blackKing = (index >> 6) & 63
+    whiteKing = kingSquares[index >> 12]
+    if len({whiteKing, blackKing, piece}) < 3 or (name[1] == 'P' and not 8 <= piece < 56):
+        return False
+    board = [["--"] * 8 for _ in range(8)]
+    board[whiteKing >> 3][whiteKing & 7] = "wK"
+    board[blackKing >> 3][blackKing & 7] = "bK"
+    board[piece >> 3][piece & 7] = 'w' + name[1]
+    gs.setPosition(board, whiteToMove, 0)
+    waitingKing = blackKing if whiteToMove else whiteKing
+    for _ in gs.iterAttackers(waitingKing >> 3, waitingKing & 7, 'w' if whiteToMove else 'b'):
+        return False
+    return True
+
+
+_workerTablebases = None
+
+
+def _initWorker(directory):
+    global _workerTablebases
+    _workerTablebases = Tablebases(directory)
+
+
+'''
+Expand the positions start to end - 1 of a table. Returns the values of the positions already decided (illegal,
+checkmate, stalemate; _UNKNOWN_VALUE for the rest) and their successors in compressed rows: the successors of position
+start + i are successors[offsets[i]:offsets[i + 1]]. A successor is a position index of the same table, or -(value + 1)
+for a move that leaves the table, a capture (a draw) or a promotion (looked up in KQK).
+'''
+def _expandPositions(name, start, end):
+    hasPawn = name[1] == 'P'
+    gs = ChessEngine.GameState()
+    values = bytearray(end - start)
+    offsets = array.array('I', [0])
+    successors = array.array('i')
+    queens = _workerTablebases.tables.get("KQK") if _workerTablebases is not None else None
+    for i, index in enumerate(range(start, end)):
+        if not _setIndexPosition(gs, name, index):
+            values[i] = _ILLEGAL_VALUE
+            offsets.append(len(successors))
+            continue
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            values[i] = _LOSS_VALUE if gs.checkmate else _DRAW_VALUE
+            offsets.append(len(successors))
+            continue
+        values[i] = _UNKNOWN_VALUE
+        whiteKing = gs.whiteKingLocation[0] * 8 + gs.whiteKingLocation[1]
+        blackKing = gs.blackKingLocation[0] * 8 + gs.blackKingLocation[1]
+        piece = next(r * 8 + c for r, c in gs.pieceSquares['w'] if gs.board[r][c][1] != 'K')
+        for move in moves:
+            startSq, endSq = move.startRow * 8 + move.startCol, move.endRow * 8 + move.endCol
+            if move.pieceCaptured != "--":
+                successors.append(-(_DRAW_VALUE + 1))
+            elif move.isPawnPromotion:
+                if queens is None:
+                    raise RuntimeError("the KQK table is needed to generate %s" % name)
+                successors.append(-(queens.probeSquares(whiteKing, blackKing, endSq, False) + 1))
+            elif startSq == whiteKing:
+                successors.append(positionIndex(endSq, blackKing, piece, not gs.whiteToMove, hasPawn))
+            elif startSq == blackKing:
+                successors.append(positionIndex(whiteKing, endSq, piece, not gs.whiteToMove, hasPawn))
+            else:
+                successors.append(positionIndex(whiteKing, blackKing, endSq, not gs.whiteToMove, hasPawn))
+        offsets.append(len(successors))
+    return start, values, offsets, successors
+
+
+'''
+Propagate the results backwards from the checkmates. A position wins in n + 1 plies when some move reaches a position
+lost in n, and loses in n + 1 when every move reaches a position won in at most n. The positions are settled in order
+of their distance, so each gets the shortest win and the longest loss. Whatever is never settled is a draw.
+'''
+def _solve(values, offsets, successors):
+    size = len(values)
+    predecessorCounts = array.array('I', bytes(4 * (size + 1)))
+    for child in successors:
+        if child >= 0:
+            predecessorCounts[child + 1] += 1
+    for i in range(size):
+        predecessorCounts[i + 1] += predecessorCounts[i]
+    predecessorStarts = predecessorCounts
+    predecessors = array.array('I', bytes(4 * predecessorStarts[size]))
+    fill = array.array('I', predecessorStarts[:size])
+    remaining = array.array('H', bytes(2 * size))
+    longestWin = bytearray(size)
+    buckets = [[] for _ in range(_LOSS_VALUE)]  # buckets[n]: (position, value) settled n plies from mate
+
+    for i in range(size):
+        first, last = offsets[i], offsets[i + 1]
+        if values[i] == _LOSS_VALUE:
+            values[i] = _UNKNOWN_VALUE
+            buckets[0].append((i, _LOSS_VALUE))
+        remaining[i] = last - first
+        for k in range(first, last):
+            child = successors[k]
+            if child >= 0:
+                predecessors[fill[child]] = i
+                fill[child] += 1
+                continue
+            childValue = -child - 1
+            if childValue >= _LOSS_VALUE:
+                plies = childValue - _LOSS_VALUE + 1
+                buckets[plies].append((i, plies))
+            elif childValue != _DRAW_VALUE:
+                remaining[i] -= 1
+                longestWin[i] = max(longestWin[i], childValue)
+        if last > first and remaining[i] == 0:
+            buckets[longestWin[i] + 1].append((i, _LOSS_VALUE + longestWin[i] + 1))
+
+    for plies, bucket in enumerate(buckets):
+        for i, value in bucket:
+            if values[i] != _UNKNOWN_VALUE:
+                continue
+            values[i] = value
+            for k in range(predecessorStarts[i], predecessorStarts[i + 1]):
+                parent = predecessors[k]
+                if values[parent] != _UNKNOWN_VALUE:
+                    continue
+                if value >= _LOSS_VALUE:
+                    if plies + 1 >= _LOSS_VALUE:
+                        raise OverflowError("distance to mate doesn't fit the table format")
+                    buckets[plies + 1].append((parent, plies + 1))
+                else:
+                    remaining[parent] -= 1
+                    longestWin[parent] = max(longestWin[parent], plies)
+                    if remaining[parent] == 0:
+                        buckets[longestWin[parent] + 1].append((parent, _LOSS_VALUE + longestWin[parent] + 1))
+    for i in range(size):
+        if values[i] == _UNKNOWN_VALUE:
+            values[i] = _DRAW_VALUE
+    return values
+
+
+'''
+Build one table and write it to directory. The positions are expanded by a pool of worker processes (in this process
+with one worker); the backward pass runs here. Returns the seconds taken.
+'''
+def generateTable(name, directory, workers=1, chunkSize=4096):
+    start = time.perf_counter()
+    size = tableSize(name)
+    values = bytearray(size)
+    offsets = array.array('I', [0])
+    successors = array.array('i')
+    chunks = [(name, first, min(first + chunkSize, size)) for first in range(0, size, chunkSize)]
+    if workers > 1:
+        with multiprocessing.get_context("spawn").Pool(workers, _initWorker, (directory,)) as pool:
+            expanded = pool.starmap(_expandPositions, chunks)
+    else:
+        _initWorker(directory)
+        expanded = (_expandPositions(*chunk) for chunk in chunks)
+    for first, chunkValues, chunkOffsets, chunkSuccessors in expanded:
+        values[first:first + len(chunkValues)] = chunkValues
+        base = len(successors)
+        offsets.extend(base + offset for offset in chunkOffsets[1:])
+        successors.extend(chunkSuccessors)
+    if workers <= 1:
+        _workerTablebases.close()
+    values = _solve(values, offsets, successors)
+    path = tablePath(directory, name)
+    with open(path + ".tmp", "wb") as out:
+        out.write(_HEADER.pack(MAGIC, name.encode("ascii"), size))
+        out.write(values)
+    os.replace(path + ".tmp", path)
+    return time.perf_counter() - start
+
+
+'''
+Count the positions of a table file by result, and find the longest win
+'''
+def tableStatistics(table):
+    counts = {WIN: 0, DRAW: 0, LOSS: 0}
+    longest = 0
+    for value in table.data[_HEADER.size:]:
+        result = decodeValue(value)
+        if result is not None:
+            counts[result[0]] += 1
+            longest = max(longest, result[1] if result[0] == WIN else 0)
+    return counts, longest
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate and probe the KQK, KRK and KPK endgame tablebases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate = subparsers.add_parser("generate", help="build the tables by retrograde analysis")
+    generate.add_argument("--dir", default="tablebases", help="directory the tables are written to")
+    generate.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    generate.add_argument("--tables", nargs="+", choices=TABLES, default=list(TABLES))
+    probe = subparsers.add_parser("probe", help="look up a position")
+    probe.add_argument("--dir", default="tablebases")
+    probe.add_argument("--fen", required=True)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        os.makedirs(args.dir, exist_ok=True)
+        for name in TABLES:  # keep the generation order whatever order they were asked for in
+            if name not in args.tables:
+                continue
+            seconds = generateTable(name, args.dir, args.workers)
+            table = Tablebase(tablePath(args.dir, name))
+            counts, longest = tableStatistics(table)
+            table.close()
+            print("%s: %d positions in %.1fs with %d workers, %d wins, %d draws, %d losses, longest mate %d plies" %
+                  (name, tableSize(name), seconds, args.workers, counts[WIN], counts[DRAW], counts[LOSS], longest))
+        return
+
+    with Tablebases(args.dir) as tablebases:
+        result = tablebases.probe(ChessEngine.GameState.fromFen(args.fen))
+    if result is None:
+        print("not in the tablebases")
+        sys.exit(1)
+    outcome, plies = result
+    print({WIN: "win, mate in %d plies", LOSS: "loss, mated in %d plies", DRAW: "draw"}[outcome] %
+          ((plies,) if outcome != DRAW else ()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Self-play tournaments between engine configurations. Every pair of engines plays every opening of a suite twice, once
+with each color, and the games run in a process pool. Results are decided by the GameState's own checkmate, stalemate
+and draw detection, or adjudicated as a draw at a move limit. Each game is appended to a PGN file and a JSON lines file
+as soon as it ends. The report gives games per hour, the engines' nodes/s and the Elo difference of each pair with a 95%
+error margin. e.g.
+    python ChessTournament.py --engine "d2:depth=2" --engine "d3:depth=3" --rounds 2 --pgn games.pgn --out games.jsonl
+An engine is "name:option=value,..." with the options depth, time (seconds per move), nodes, tt (table slots),
+book (Polyglot file) and tablebases (directory).
+"""
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessAI
+import ChessEngine
+import ChessPGN
+import ChessUCI
+
+# Short opening lines in UCI notation; a line containing '/' is read as a FEN instead
+OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5",        # Ruy Lopez
+    "e2e4 e7e5 g1f3 b8c6 f1c4",        # Italian
+    "e2e4 c7c5 g1f3 d7d6 d2d4",        # Sicilian
+    "e2e4 e7e6 d2d4 d7d5",             # French
+    "e2e4 c7c6 d2d4 d7d5",             # Caro-Kann
+    "d2d4 d7d5 c2c4 e7e6",             # Queen's Gambit Declined
+    "d2d4 d7d5 c2c4 d5c4",             # Queen's Gambit Accepted
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7",   # King's Indian
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4",   # Nimzo-Indian
+    "c2c4 e7e5 b1c3 g8f6",             # English
+    "g1f3 d7d5 g2g3 g8f6 f1g2",        # Reti
+    "e2e4 d7d5 e4d5 d8d5 b1c3",        # Scandinavian
+]
+
+ENGINE_OPTIONS = {"depth": int, "time": float, "nodes": int, "tt": int, "book": str, "tablebases": str}
+
+
+'''
+Parse "name:option=value,..." into a dict of the engine's name and options
+'''
+def parseEngine(spec):
+    name, _, optionText = spec.partition(':')
+    config = {"name": name, "depth": 64, "time": None, "nodes": None, "tt": 1 << 16, "book": None, "tablebases": None}
+    for option in filter(None, optionText.split(',')):
+        key, _, value = option.partition('=')
+        if key not in ENGINE_OPTIONS:
+            raise ValueError("unknown engine option %r in %r" % (key, spec))
+        config[key] = ENGINE_OPTIONS[key](value)
+    if config["depth"] == 64 and config["time"] is None and config["nodes"] is None:
+        config["depth"] = 3  # without any limit the search would never end
+    return config
+
+
+'''
+The Elo difference that a score of wins + draws / 2 out of all games means, and the margin of its 95% confidence
+interval, from the spread of the individual game results. Both are infinite for a clean sweep.
+'''
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    spread = 1.96 * math.sqrt(variance / games)
+
+    def elo(p):
+        if p <= 0:
+            return -math.inf
+        if p >= 1:
+            return math.inf
+        return -400 * math.log10(1 / p - 1) + 0.0  # + 0.0 turns -0.0 into 0.0
+
+    if score in (0, 1):
+        return elo(score), math.inf
+    return elo(score), (elo(min(score + spread, 1)) - elo(max(score - spread, 0))) / 2
+
+
+_workerSearchers = {}
+
+
+def _getSearcher(config):
+    searcher = _workerSearchers.get(config["name"])
+    if searcher is None:
+        book = tablebases = None
+        if config["book"]:
+            import ChessBook
+            book = ChessBook.PolyglotBook(config["book"])
+        if config["tablebases"]:
+            import ChessTablebase
+            tablebases = ChessTablebase.Tablebases(config["tablebases"])
+        searcher = _workerSearchers[config["name"]] = ChessAI.Searcher(config["tt"], book, tablebases)
+    return searcher
+
+
+'''
+Play one game between two engine configurations from an opening and return a JSON-ready record of it, PGN included
+'''
+def playGame(white, black, opening, maxPlies=400, event="Self-play", round=1):
+    start = time.perf_counter()
+    headers = {"Event": event, "Site": "ChessTournament", "Date": time.strftime("%Y.%m.%d"), "Round": round,
+               "White": white["name"], "Black": black["name"], "Result": "*"}
+    sans = []
+    if '/' in opening:
+        gs = ChessEngine.GameState.fromFen(opening)
+        headers["SetUp"] = "1"
+        headers["FEN"] = opening
+    else:  # the opening moves are part of the game score
+        gs = ChessEngine.GameState()
+        for text in opening.split():
+            moves = gs.getValidMoves()
+            move = ChessUCI.parseUciMove(gs, text, moves)
+            if move is None:
+                raise ValueError("illegal opening move %s in %r" % (text, opening))
+            sans.append(ChessPGN.moveToSan(gs, move, moves))
+            gs.makeMove(move)
+    startWhite, startNumber = (gs.whiteToMove, gs.fullmoveNumber) if "FEN" in headers else (True, 1)
+    stats = {white["name"]: [0, 0.0], black["name"]: [0, 0.0]}  # nodes and search seconds of each engine
+    for config in (white, black):
+        _getSearcher(config).tt.clear()  # each game starts from an empty table, so games don't depend on their order
+    plies = 0
+    while True:
+        moves = gs.getValidMoves()
+        if gs.checkmate:
+            result, termination = ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+            break
+        if gs.stalemate:
+            result, termination = "1/2-1/2", "stalemate"
+            break
+        if gs.draw:
+            result, termination = "1/2-1/2", gs.drawReason
+            break
+        if plies >= maxPlies:
+            result, termination = "1/2-1/2", "adjudicated at %d plies" % maxPlies
+            break
+        config = white if gs.whiteToMove else black
+        searchResult = _getSearcher(config).search(gs, config["depth"], config["time"], config["nodes"])
+        stats[config["name"]][0] += searchResult.nodes
+        stats[config["name"]][1] += searchResult.seconds
+        sans.append(ChessPGN.moveToSan(gs, searchResult.bestMove, moves))
+        gs.makeMove(searchResult.bestMove)
+        plies += 1
+    headers["Result"] = result
+    headers["Termination"] = termination
+    return {"round": round, "white": white["name"], "black": black["name"], "opening": opening, "result": result,
+            "termination": termination, "plies": plies, "nodes": {name: value[0] for name, value in stats.items()},
+            "searchSeconds": {name: value[1] for name, value in stats.items()},
+            "seconds": time.perf_counter() - start,
+            "pgn": ChessPGN.formatGame(headers, sans, result, startWhite, startNumber)}
+
+
+def _playInWorker(job):
+    return playGame(*job)
+
+
+'''
+Every game of the tournament as playGame arguments: each pair of engines plays each opening with both colors, rounds
+times over
+'''
+def schedule(engines, openings, rounds=1, maxPlies=400, event="Self-play"):
+    jobs = []
+    for round in range(1, rounds + 1):
+        for first, second in itertools.combinations(engines, 2):
+            for opening in openings:
+                jobs.append((first, second, opening, maxPlies, event, round))
+                jobs.append((second, first, opening, maxPlies, event, round))
+    return jobs
+
+
+class Standings():
+    '''
+    Running totals over finished games: results per pair of engines, and nodes and search time per engine
+    '''
+    def __init__(self, engines):
+        self.names = [engine["name"] for engine in engines]
+        self.pairs = {pair: [0, 0, 0] for pair in itertools.combinations(self.names, 2)}  # wins, draws, losses
+        self.nodes = dict.fromkeys(self.names, 0)
+        self.searchSeconds = dict.fromkeys(self.names, 0.0)
+        self.games = 0
+
+    def add(self, record):
+        self.games += 1
+        for name in (record["white"], record["black"]):
+            self.nodes[name] += record["nodes"][name]
+            self.searchSeconds[name] += record["searchSeconds"][name]
+        pair = (record["white"], record["black"])
+        whiteScore = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}[record["result"]]  # index into wins, draws, losses
+        if pair in self.pairs:
+            self.pairs[pair][whiteScore] += 1
+        else:
+            self.pairs[(record["black"], record["white"])][2 - whiteScore] += 1
+
+    def report(self, seconds, workers, out=sys.stdout):
+        print("%d games in %.1fs: %.0f games/hour with %d workers" %
+              (self.games, seconds, self.games / max(seconds, 1e-9) * 3600, workers), file=out)
+        totalNodes = sum(self.nodes.values())
+        totalSeconds = sum(self.searchSeconds.values())
+        print("average %.0f nodes/s per worker" % (totalNodes / totalSeconds if totalSeconds else 0.0), file=out)
+        for name in self.names:
+            print("  %-16s %10d nodes  %8.0f nodes/s" %
+                  (name, self.nodes[name], self.nodes[name] / self.searchSeconds[name] if self.searchSeconds[name]
+                   else 0.0), file=out)
+        for (first, second), (wins, draws, losses) in self.pairs.items():
+            elo, margin = eloDifference(wins, draws, losses)
+            print("%s vs %s: +%d =%d -%d  Elo %+.0f +/- %.0f" % (first, second, wins, draws, losses, elo, margin),
+                  file=out)
+
+
+'''
+Play every scheduled game in a pool of workers processes (in this process with one worker), writing each game to the
+PGN and JSON lines outputs as it finishes. Returns the Standings and the seconds taken.
+'''
+def runTournament(engines, openings, rounds=1, workers=1, maxPlies=400, pgnOut=None, jsonOut=None, progress=None,
+                  progressEvery=30.0):
+    jobs = schedule(engines, openings, rounds, maxPlies)
+    standings = Standings(engines)
+    start = time.perf_counter()
+    lastReport = start
+    if workers > 1:
+        pool = multiprocessing.get_context("spawn").Pool(workers)
+        records = pool.imap_unordered(_playInWorker, jobs)
+    else:
+        pool = None
+        records = (_playInWorker(job) for job in jobs)
+    try:
+        for record in records:
+            standings.add(record)
+            if pgnOut is not None:
+                pgnOut.write(record["pgn"] + "\n")
+                pgnOut.flush()
+            if jsonOut is not None:
+                jsonOut.write(json.dumps({key: value for key, value in record.items() if key != "pgn"}) + "\n")
+                jsonOut.flush()
+            now = time.perf_counter()
+            if progress is not None and now - lastReport >= progressEvery:
+                lastReport = now
+                print("%d/%d games" % (standings.games, len(jobs)), file=progress)
+                standings.report(now - start, workers, progress)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return standings, time.perf_counter() - start
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Self-play tournament between engine configurations")
+    parser.add_argument("--engine", action="append", required=True,
+                        help='"name:option=value,..." with depth, time, nodes, tt, book, tablebases; at least two')
+    parser.add_argument("--openings", help="file with one opening per line, UCI moves or a FEN (default built in)")
+    parser.add_argument("--rounds", type=int, default=1, help="times every opening is played with both colors")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-plies", type=int, default=400, help="adjudicate a draw after this many plies")
+    parser.add_argument("--pgn", help="PGN file the games are appended to")
+    parser.add_argument("--out", help="JSON lines file the game records are appended to")
+    args = parser.parse_args()
+
+    engines = [parseEngine(spec) for spec in args.engine]
+    if len(engines) < 2 or len({engine["name"] for engine in engines}) != len(engines):
+        parser.error("give at least two engines with different names")
+    openings = OPENINGS
+    if args.openings:
+        with open(args.openings) as source:
+            openings = [line.split('#')[0].strip() for line in source if line.split('#')[0].strip()]
+    pgnOut = open(args.pgn, "a") if args.pgn else None
+    jsonOut = open(args.out, "a") if args.out else None
+    try:
+        standings, seconds = runTournament(engines, openings, args.rounds, args.workers, args.max_plies, pgnOut,
+                                           jsonOut, progress=sys.stderr)
+    finally:
+        for out in (pgnOut, jsonOut):
+            if out is not None:
+                out.close()
+    standings.report(seconds, args.workers)
+
+
+if __name__ == "__main__":
+    main()
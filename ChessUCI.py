@@ -0,0 +1,214 @@
+"""
+UCI front end, so the engine can be driven by standard chess GUIs and match runners over stdin/stdout. e.g.
+    python ChessUCI.py
+    position startpos moves e2e4 e7e5
+    go movetime 2000
+The search runs in a thread, so "stop" and "isready" are answered while it thinks.
+"""
+import sys
+import threading
+
+import ChessAI
+import ChessEngine
+
+ENGINE_NAME = "Chess-Python"
+ENGINE_AUTHOR = "tejas-rathi05"
+HASH_ENTRY_BYTES = 128  # rough size of one transposition table slot, to turn the Hash option into a slot count
+
+
+'''
+The UCI notation of a move: start and end square, with the promotion piece appended
+'''
+def moveToUci(move):
+    return move.getChessNotation() + ('q' if move.isPawnPromotion else '')
+
+
+'''
+The legal move of gs that a UCI move string names, or None. The engine only promotes to a queen, so an underpromotion
+is refused.
+'''
+def parseUciMove(gs, text, moves=None):
+    if len(text) not in (4, 5) or text[0] not in ChessEngine.Move.filesToCol or \
+            text[2] not in ChessEngine.Move.filesToCol or text[1] not in ChessEngine.Move.rankToRows or \
+            text[3] not in ChessEngine.Move.rankToRows:
+        return None
+    startSq = (ChessEngine.Move.rankToRows[text[1]], ChessEngine.Move.filesToCol[text[0]])
+    endSq = (ChessEngine.Move.rankToRows[text[3]], ChessEngine.Move.filesToCol[text[2]])
+    for move in moves if moves is not None else gs.getValidMoves():
+        if (move.startRow, move.startCol) == startSq and (move.endRow, move.endCol) == endSq:
+            if move.isPawnPromotion != (len(text) == 5) or (len(text) == 5 and text[4] != 'q'):
+                return None
+            return move
+    return None
+
+
+'''
+Seconds to spend on a move from the clock: an even share of the time left over the moves to go (30 when unknown)
+plus most of the increment, never more than half of what is left
+'''
+def timeForMove(timeLeft, increment=0, movesToGo=None):
+    budget = timeLeft / (movesToGo or 30) + increment * 0.8
+    return max(min(budget, timeLeft / 2), 0.01) / 1000
+
+
+class UCIEngine():
+    def __init__(self, out=sys.stdout, ttSize=1 << 18):
+        self.out = out
+        self.outputLock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        self.searcher = ChessAI.Searcher(ttSize)
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    '''
+    Act on one line of input. Returns False after "quit".
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 4096" %
+                      max(self.searcher.tt.size * HASH_ENTRY_BYTES >> 20, 1))
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.tt.clear()
+            self.gs = ChessEngine.GameState()
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(args)
+        elif command == "go":
+            self.stopSearch()
+            self.go(args)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def setOption(self, args):
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        value = value.strip()
+        if name == "hash":
+            try:
+                megabytes = int(value)
+            except ValueError:
+                self.send("info string bad Hash value " + value)
+                return
+            self.searcher.tt = ChessAI.TranspositionTable(max(megabytes, 1) * (1 << 20) // HASH_ENTRY_BYTES)
+        elif name == "bookfile":
+            if self.searcher.book is not None:
+                self.searcher.book.close()
+                self.searcher.book = None
+            if value and value != "<empty>":
+                import ChessBook
+                self.searcher.book = ChessBook.PolyglotBook(value)
+        elif name == "tablebasepath":
+            if self.searcher.tablebases is not None:
+                self.searcher.tablebases.close()
+                self.searcher.tablebases = None
+            if value and value != "<empty>":
+                import ChessTablebase
+                self.searcher.tablebases = ChessTablebase.Tablebases(value)
+        else:
+            self.send("info string unknown option " + name)
+
+    '''
+    position startpos | fen <fen> [moves <move> ...]
+    '''
+    def setPosition(self, args):
+        moves = []
+        if "moves" in args:
+            moves = args[args.index("moves") + 1:]
+            args = args[:args.index("moves")]
+        try:
+            gs = ChessEngine.GameState.fromFen(" ".join(args[1:])) if args[:1] == ["fen"] else ChessEngine.GameState()
+        except ValueError as error:
+            self.send("info string bad position: %s" % error)
+            return
+        for text in moves:
+            move = parseUciMove(gs, text)
+            if move is None:
+                self.send("info string illegal move " + text)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    '''
+    go [depth n] [nodes n] [movetime ms] [wtime ms btime ms winc ms binc ms movestogo n] [infinite]
+    '''
+    def go(self, args):
+        options = {}
+        infinite = "infinite" in args or "ponder" in args
+        for i, token in enumerate(args[:-1]):
+            if token in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo"):
+                try:
+                    options[token] = int(args[i + 1])
+                except ValueError:
+                    self.send("info string bad %s value %s" % (token, args[i + 1]))
+                    return
+        timeLimit = None
+        if "movetime" in options:
+            timeLimit = options["movetime"] / 1000
+        elif not infinite and ("wtime" if self.gs.whiteToMove else "btime") in options:
+            side = 'w' if self.gs.whiteToMove else 'b'
+            timeLimit = timeForMove(options[side + "time"], options.get(side + "inc", 0), options.get("movestogo"))
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.runSearch, daemon=True,
+                                             args=(options.get("depth", 64), timeLimit, options.get("nodes"), infinite))
+        self.searchThread.start()
+
+    def runSearch(self, depth, timeLimit, nodeLimit, infinite):
+        result = self.searcher.search(self.gs, depth, timeLimit, nodeLimit, onIteration=self.sendInfo,
+                                      shouldStop=self.stopEvent.is_set)
+        if infinite:
+            self.stopEvent.wait()  # UCI only wants the best move of an infinite search once it is stopped
+        if result is None or result.bestMove is None:
+            moves = self.gs.getValidMoves()  # stopped before the first iteration completed
+            self.send("bestmove " + (moveToUci(moves[0]) if moves else "0000"))
+        else:
+            self.send("bestmove " + moveToUci(result.bestMove))
+
+    def sendInfo(self, result):
+        self.send("info depth %d score %s nodes %d nps %.0f time %d pv %s" %
+                  (result.depth, ChessAI.formatScore(result.score), result.nodes, result.nps, result.seconds * 1000,
+                   " ".join(moveToUci(move) for move in result.pv)))
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stopSearch()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Background engine worker for the GUI. Move generation for the next position, the AI's search and pondering on the
+opponent's time all run in a separate process, so the pygame loop in ChessMain only ever polls for results and never
+blocks. Every request carries the generation it was made in; cancel() moves to a new generation, which stops the
+running search and makes the worker drop any queued or finished work from before.
+"""
+import multiprocessing
+import queue
+import time
+
+import ChessAI
+import ChessStats
+
+# Request and result kinds
+MOVES, SEARCH, PONDER = "moves", "search", "ponder"
+
+
+def _workerLoop(requests, results, generation, ttSize, bookPath=None, tablebaseDir=None):
+    book = tablebases = None  # opened here, a memory map can't be sent to the process
+    if bookPath is not None:
+        import ChessBook
+        book = ChessBook.PolyglotBook(bookPath)
+    if tablebaseDir is not None:
+        import ChessTablebase
+        tablebases = ChessTablebase.Tablebases(tablebaseDir)
+    # shared by searches and pondering, so a ponder hit finds a warm table
+    searcher = ChessAI.Searcher(ttSize, book, tablebases)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        kind, jobGeneration, gs, options = request
+        if jobGeneration != generation.value:
+            continue  # cancelled while it was queued
+
+        def cancelled():
+            return generation.value != jobGeneration
+
+        if kind == MOVES:
+            start = time.perf_counter()
+            moves = gs.getValidMoves()
+            seconds = time.perf_counter() - start  # reported for the GUI's stats overlay
+            results.put((MOVES, jobGeneration, (moves, gs.checkmate, gs.stalemate, gs.drawReason, seconds)))
+        elif kind == SEARCH:
+            if options.get("stats"):
+                ChessStats.enable()
+            result = searcher.search(gs, options.get("depth", 64), options.get("timeLimit"),
+                                     options.get("nodeLimit"), shouldStop=cancelled)
+            timers = None
+            if ChessStats.enabled:  # where this search spent its time, for the GUI's stats overlay
+                timers = {name: ChessStats.timers[name].total for name in ChessStats.TIMED_METHODS
+                          if name in ChessStats.timers}
+                ChessStats.disable()
+                ChessStats.reset()
+            if not cancelled():
+                results.put((SEARCH, jobGeneration, (result, timers)))
+        elif kind == PONDER:
+            searcher.search(gs, options.get("depth", 64), shouldStop=cancelled)  # runs until cancelled
+
+
+class EngineWorker():
+    def __init__(self, ttSize=1 << 18, bookPath=None, tablebaseDir=None):
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.generation = context.Value('i', 0, lock=False)
+        self.process = context.Process(target=_workerLoop, args=(self.requests, self.results, self.generation, ttSize,
+                                                                       bookPath, tablebaseDir), daemon=True)
+        self.process.start()
+        self.pending = set()  # kinds requested in the current generation that haven't answered yet
+
+    '''
+    Stop whatever the worker is doing and forget every outstanding request
+    '''
+    def cancel(self):
+        self.generation.value += 1
+        self.pending.clear()
+
+    def requestValidMoves(self, gs):
+        self.submit(MOVES, gs, {})
+
+    '''
+    Search gs for the best move. With stats the search is instrumented, and the result comes with the seconds spent
+    in each of ChessStats.TIMED_METHODS.
+    '''
+    def requestSearch(self, gs, timeLimit=None, depth=64, nodeLimit=None, stats=False):
+        self.submit(SEARCH, gs, {"timeLimit": timeLimit, "depth": depth, "nodeLimit": nodeLimit, "stats": stats})
+
+    '''
+    Search gs until the next cancel(). Nothing is returned; the point is to fill the worker's transposition table
+    with the position the opponent is most likely to leave us.
+    '''
+    def ponder(self, gs):
+        self.requests.put((PONDER, self.generation.value, gs, {}))
+
+    def submit(self, kind, gs, options):
+        self.pending.add(kind)
+        self.requests.put((kind, self.generation.value, gs, options))
+
+    def isBusy(self, kind):
+        return kind in self.pending
+
+    '''
+    Return the (kind, value) results of the current generation that have arrived, without blocking
+    '''
+    def poll(self):
+        finished = []
+        while True:
+            try:
+                kind, jobGeneration, value = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            if jobGeneration == self.generation.value:
+                self.pending.discard(kind)
+                finished.append((kind, value))
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
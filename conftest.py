@@ -0,0 +1,15 @@
+"""
+Fixtures shared by the test modules
+"""
+import pytest
+
+import ChessBitboard
+import ChessEngine
+
+
+'''
+Each GameState backend in turn: the list-of-strings board and the bitboard subclass
+'''
+@pytest.fixture(params=[ChessEngine.GameState, ChessBitboard.BitboardGameState], ids=lambda backend: backend.__name__)
+def backend(request):
+    return request.param
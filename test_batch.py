@@ -0,0 +1,71 @@
+"""
+Batch evaluation: the NumPy encodings and scores against the scalar engine, position by position. Skipped when NumPy
+is not installed, since only ChessBatch needs it.
+"""
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import ChessAI  # noqa: E402
+import ChessBatch  # noqa: E402
+import ChessBinary  # noqa: E402
+import ChessEngine  # noqa: E402
+import ChessPerft  # noqa: E402
+
+
+def samplePositions():
+    states = [ChessEngine.GameState.fromFen(fen) for fen, _ in ChessPerft.REFERENCE_POSITIONS.values()]
+    rng = random.Random(7)
+    gs = ChessEngine.GameState()
+    for _ in range(60):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+        states.append(ChessEngine.GameState.fromFen(gs.getFen()))
+    return states
+
+
+'''
+The knight, bishop, rook and queen moves of color, pins and checks ignored, from the scalar move generator
+'''
+def pseudoLegalMobility(gs, color):
+    gs = ChessEngine.GameState.fromFen(gs.getFen())
+    gs.whiteToMove = color == 'w'
+    return sum(1 for move in gs.getAllPossibleMoves() if move.pieceMoved[1] in "NBRQ")
+
+
+def test_scores_match_the_scalar_evaluation():
+    states = samplePositions()
+    codes, whiteToMove = ChessBatch.encodeStates(states)
+    assert codes.shape == (len(states), 64)
+    assert list(whiteToMove) == [gs.whiteToMove for gs in states]
+    assert list(ChessBatch.evaluateBatch(codes, whiteToMove, mobilityWeight=0)) == \
+        [ChessAI.evaluate(gs) for gs in states]
+    linear = ChessBatch.LinearEvaluator.fromStatic().evaluate(ChessBatch.features(codes, whiteToMove))
+    assert np.allclose(linear, ChessBatch.staticScores(codes))
+
+
+def test_mobility_matches_the_move_generator():
+    states = samplePositions()
+    counts = ChessBatch.mobility(ChessBatch.encodeStates(states)[0])
+    assert [tuple(row) for row in counts] == \
+        [(pseudoLegalMobility(gs, 'w'), pseudoLegalMobility(gs, 'b')) for gs in states]
+
+
+def test_packed_buffer_and_one_hot_planes():
+    states = samplePositions()
+    codes, whiteToMove = ChessBatch.encodeStates(states)
+    packedCodes, packedWhiteToMove = ChessBatch.encodePacked(ChessBinary.packPositions(states))
+    assert np.array_equal(packedCodes, codes)
+    assert np.array_equal(packedWhiteToMove, whiteToMove)
+    planes = ChessBatch.oneHot(codes)
+    assert planes.shape == (len(states), 12, 8, 8)
+    for gs, positionPlanes in zip(states, planes):
+        for i, piece in enumerate(ChessBatch.PIECE_CODES):
+            assert {(r, c) for r, c in zip(*np.nonzero(positionPlanes[i]))} == \
+                {(r, c) for r in range(8) for c in range(8) if gs.board[r][c] == piece}
+    with pytest.raises(ValueError):
+        ChessBatch.encodePacked(bytes(ChessBinary.POSITION_SIZE + 1))
@@ -0,0 +1,96 @@
+"""
+Polyglot books: the keys against the test vectors published with the Polyglot format, and lookups in small books
+written for the test, including castling, promotions and moves that aren't legal in the position.
+"""
+import random
+import struct
+
+import pytest
+
+import ChessBook
+import ChessEngine
+
+# (moves from the start position, Polyglot key) from the format's documentation
+KEY_VECTORS = [
+    ((), 0x463b96181691fc9c),
+    (("e2e4",), 0x823c9b50fd114196),
+    (("e2e4", "d7d5"), 0x0756b94461c50fb0),
+    (("e2e4", "d7d5", "e4e5"), 0x662fafb965db29d4),
+    (("e2e4", "d7d5", "e4e5", "f7f5"), 0x22a48b5a8e47ff78),
+    (("e2e4", "d7d5", "e4e5", "f7f5", "e1e2"), 0x652a607ca3f242c1),
+    (("e2e4", "d7d5", "e4e5", "f7f5", "e1e2", "e8f7"), 0x00fdd303c946bdd9),
+    (("a2a4", "b7b5", "h2h4", "b5b4", "c2c4"), 0x3c8123ea7b067637),
+    (("a2a4", "b7b5", "h2h4", "b5b4", "c2c4", "b4c3", "a1a3"), 0x5c3f9b829b279560),
+]
+
+
+def play(gs, moves):
+    for text in moves:
+        gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == text))
+    return gs
+
+
+@pytest.mark.parametrize("moves, key", KEY_VECTORS, ids=lambda value: " ".join(value) if isinstance(value, tuple)
+                         else "%016x" % value)
+def test_key_vectors(moves, key):
+    assert ChessBook.polyglotKey(play(ChessEngine.GameState(), moves)) == key
+
+
+'''
+A Polyglot move from UCI squares: to file, to rank, from file, from rank and promotion, three bits each
+'''
+def bookMove(text, promotion=0):
+    files, ranks = "abcdefgh", "12345678"
+    return (files.index(text[2]) | ranks.index(text[3]) << 3 | files.index(text[0]) << 6 | ranks.index(text[1]) << 9 |
+            promotion << 12)
+
+
+def writeBook(path, entries):
+    with open(path, "wb") as out:
+        for key, move, weight in sorted(entries):
+            out.write(struct.pack(">QHHI", key, move, weight, 0))
+    return ChessBook.PolyglotBook(str(path))
+
+
+def notations(candidates):
+    return {(move.getChessNotation(), weight) for move, weight in candidates}
+
+
+def test_lookup_keeps_legal_moves_only(tmp_path):
+    start = ChessEngine.GameState()
+    key = ChessBook.polyglotKey(start)
+    entries = [(key, bookMove("e2e4"), 3), (key, bookMove("d2d4"), 1), (key, bookMove("e2e5"), 9),
+               (key - 1, bookMove("g1f3"), 5), (key + 1, bookMove("c2c4"), 5)]
+    entries += [(random.Random(i).getrandbits(64), bookMove("b1c3"), 1) for i in range(100)]
+    with writeBook(tmp_path / "book.bin", entries) as book:
+        assert notations(book.getMoves(start)) == {("e2e4", 3), ("d2d4", 1)}
+        rng = random.Random(0)
+        picks = {book.chooseMove(start, rng).getChessNotation() for _ in range(50)}
+        assert picks == {"e2e4", "d2d4"}
+        assert book.getMoves(play(ChessEngine.GameState(), ["h2h3"])) == []
+        assert book.chooseMove(play(ChessEngine.GameState(), ["h2h3"])) is None
+
+
+def test_castling_and_promotions(tmp_path):
+    castling = ChessEngine.GameState.fromFen("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    rookMove = ChessEngine.GameState.fromFen("4k3/8/8/8/8/8/8/K3R3 w - - 0 1")
+    promotion = ChessEngine.GameState.fromFen("4k3/P7/8/8/8/8/8/4K3 w - - 0 1")
+    entries = [(ChessBook.polyglotKey(castling), bookMove("e1h1"), 1),
+               (ChessBook.polyglotKey(castling), bookMove("e1a1"), 1),
+               (ChessBook.polyglotKey(rookMove), bookMove("e1h1"), 1),
+               (ChessBook.polyglotKey(promotion), bookMove("a7a8", 4), 1),
+               (ChessBook.polyglotKey(promotion), bookMove("a7a8", 1), 1)]
+    with writeBook(tmp_path / "book.bin", entries) as book:
+        moves = book.getMoves(castling)
+        assert notations(moves) == {("e1g1", 1), ("e1c1", 1)}
+        assert all(move.isCastleMove for move, _ in moves)
+        assert notations(book.getMoves(rookMove)) == {("e1h1", 1)}  # a rook, not a king, moving onto h1
+        moves = book.getMoves(promotion)
+        assert len(moves) == 1 and moves[0][0].isPawnPromotion  # the knight promotion is dropped
+
+
+def test_empty_book(tmp_path):
+    (tmp_path / "empty.bin").write_bytes(b"")
+    with ChessBook.PolyglotBook(str(tmp_path / "empty.bin")) as book:
+        assert book.getMoves(ChessEngine.GameState()) == []
+        assert book.chooseMove(ChessEngine.GameState()) is None
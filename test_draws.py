@@ -0,0 +1,72 @@
+"""
+Draw detection: threefold repetition, the fifty-move rule and insufficient material, as getValidMoves flags them and
+getResult reports them, on both backends.
+"""
+import pytest
+
+
+def play(gs, *moves):
+    for text in moves:
+        gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == text))
+    gs.getValidMoves()  # sets the flags for the position reached
+    return gs
+
+
+def test_threefold_repetition(backend):
+    shuffle = ("g1f3", "g8f6", "f3g1", "f6g8")
+    gs = play(backend(), *shuffle)
+    assert gs.repetitionCount() == 2 and not gs.draw
+    play(gs, *shuffle)
+    assert gs.repetitionCount() == 3
+    assert gs.draw and gs.drawReason == "threefold repetition"
+    assert gs.getResult() == "1/2-1/2"
+    gs.undoMove()
+    gs.getValidMoves()
+    assert not gs.draw and gs.drawReason is None and gs.getResult() == "*"
+
+
+def test_repetition_needs_the_same_side_to_move_and_rights(backend):
+    gs = play(backend(), "e2e4", "e7e5", "e1e2", "e8e7", "e2e1", "e7e8", "e1e2", "e8e7", "e2e1", "e7e8")
+    assert gs.repetitionCount() == 2  # the first time this board was seen both sides could still castle
+    assert not gs.draw
+
+
+def test_fifty_move_rule(backend):
+    gs = play(backend.fromFen("4k3/8/8/8/8/8/8/R3K3 w - - 99 80"), "a1a2")
+    assert gs.halfmoveClock == 100
+    assert gs.draw and gs.drawReason == "fifty-move rule"
+    gs = play(backend.fromFen("4k3/8/8/8/8/8/P7/R3K3 w - - 99 80"), "a2a3")  # a pawn move resets the count
+    assert gs.halfmoveClock == 0 and not gs.draw
+
+
+def test_mate_on_the_hundredth_ply_still_wins(backend):
+    gs = play(backend.fromFen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 99 80"), "a1a8")
+    assert gs.halfmoveClock == 100
+    assert gs.checkmate and not gs.draw
+    assert gs.getResult() == "1-0"
+
+
+@pytest.mark.parametrize("fen, insufficient", [
+    ("4k3/8/8/8/8/8/8/4K3 w - - 0 1", True),
+    ("4k3/8/8/8/8/8/8/2B1K3 w - - 0 1", True),
+    ("4k3/8/8/8/8/8/8/1N2K3 b - - 0 1", True),
+    ("2b1k3/8/8/8/8/8/8/3BK3 w - - 0 1", True),     # bishops on squares of one colour
+    ("3bk3/8/8/8/8/8/8/3BK3 w - - 0 1", False),     # opposite coloured bishops can still mate
+    ("4k3/8/8/8/8/8/8/1NB1K3 w - - 0 1", False),
+    ("4k3/8/8/8/8/8/8/1n2K1N1 w - - 0 1", False),
+    ("4k3/8/8/8/8/8/4P3/4K3 w - - 0 1", False),
+    ("4k3/8/8/8/8/8/8/R3K3 w - - 0 1", False),
+])
+def test_insufficient_material(backend, fen, insufficient):
+    gs = backend.fromFen(fen)
+    gs.getValidMoves()
+    assert gs.isInsufficientMaterial() == insufficient
+    assert gs.draw == insufficient
+    assert (gs.drawReason == "insufficient material") == insufficient
+    assert gs.getResult() == ("1/2-1/2" if insufficient else "*")
+
+
+def test_stalemate_and_mate_results(backend):
+    assert backend.fromFen("7k/8/6QK/8/8/8/8/8 b - - 0 1").getResult() == "1/2-1/2"
+    assert backend.fromFen("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1").getResult() == "1-0"
+    assert backend.fromFen("8/8/8/8/8/6k1/6q1/7K w - - 0 1").getResult() == "0-1"
@@ -0,0 +1,108 @@
+"""
+Legal move generation: the pin and check based generator against plain make/undo filtering of the pseudo-legal moves,
+the staged generator and hasLegalMove against getValidMoves, and the bitboard backend against the board backend, over
+seeded random games and a few hand-checked positions.
+"""
+import random
+
+import pytest
+
+import ChessAI
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+
+GAMES = 12
+PLIES = 80
+
+
+'''
+The legal moves found the slow way: every pseudo-legal move is made, and kept when it leaves the mover's king safe
+'''
+def bruteForceMoveIDs(gs):
+    moves = gs.getAllPossibleMoves()
+    kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    gs.getCastleMoves(kingRow, kingCol, moves)
+    legal = set()
+    for move in moves:
+        gs.makeMove(move)
+        gs.whiteToMove = not gs.whiteToMove
+        if not gs.inCheck():
+            legal.add(move.moveID)
+        gs.whiteToMove = not gs.whiteToMove
+        gs.undoMove()
+    return legal
+
+
+def randomGames():
+    rng = random.Random(1)
+    names = ("start", "kiwipete", "castling", "enpassant-pin")
+    for game in range(GAMES):
+        name = names[game % len(names)]
+        yield pytest.param(ChessPerft.REFERENCE_POSITIONS[name][0], rng.randrange(1 << 30), id="%s-%d" % (name, game))
+
+
+@pytest.mark.parametrize("fen, seed", list(randomGames()))
+def test_random_games(fen, seed):
+    rng = random.Random(seed)
+    gs = ChessEngine.GameState.fromFen(fen)
+    bitboard = ChessBitboard.BitboardGameState.fromFen(fen)
+    for _ in range(PLIES):
+        moves = gs.getValidMoves()
+        moveIDs = {move.moveID for move in moves}
+        assert len(moveIDs) == len(moves), gs.getFen()
+        assert moveIDs == bruteForceMoveIDs(gs), gs.getFen()
+        assert moveIDs == {move.moveID for move in gs.generateMoves()}, gs.getFen()
+        assert moveIDs == {move.moveID for move in bitboard.getValidMoves()}, gs.getFen()
+        assert gs.hasLegalMove() == bool(moves)
+        if not moves:
+            break
+        fen = gs.getFen()
+        for move in moves:
+            gs.makeMove(move)
+            gs.undoMove()
+        assert gs.getFen() == fen
+        move = rng.choice(moves)
+        gs.makeMove(move)
+        bitboard.makeMove(next(m for m in bitboard.getValidMoves() if m.moveID == move.moveID))
+        assert bitboard.getFen() == gs.getFen()
+
+
+def destinations(moves, square):
+    return {move.getRankFile(move.endRow, move.endCol) for move in moves
+            if move.getRankFile(move.startRow, move.startCol) == square}
+
+
+def test_pinned_rook_stays_on_the_pin_line(backend):
+    moves = backend.fromFen("4r2k/8/8/8/8/8/4R3/4K3 w - - 0 1").getValidMoves()
+    assert destinations(moves, "e2") == {"e3", "e4", "e5", "e6", "e7", "e8"}
+    assert destinations(moves, "e1") == {"d1", "d2", "f1", "f2"}
+
+
+def test_double_check_only_moves_the_king(backend):
+    gs = backend.fromFen("4r2k/8/8/8/8/3n4/8/4K2R w K - 0 1")  # rook e8 and knight d3 both give check
+    moves = gs.getValidMoves()
+    assert moves and all(move.pieceMoved == "wK" for move in moves)
+    assert not any(move.isCastleMove for move in moves)
+
+
+def test_en_passant_that_uncovers_the_king_is_refused(backend):
+    gs = backend.fromFen("8/8/8/KPp4r/8/8/8/7k w - c6 0 1")  # bxc6 would leave the a5 king to the h5 rook
+    assert destinations(gs.getValidMoves(), "b5") == {"b6"}
+
+
+def test_mate_and_stalemate_flags(backend):
+    gs = backend.fromFen("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1")
+    assert gs.getValidMoves() == [] and gs.checkmate and not gs.stalemate
+    gs = backend.fromFen("7k/8/6QK/8/8/8/8/8 b - - 0 1")
+    assert gs.getValidMoves() == [] and gs.stalemate and not gs.checkmate
+
+
+def test_no_castling_without_the_rook(backend):
+    gs = backend.fromFen("4k3/8/8/8/8/8/8/RN2K3 w KQkq - 0 1")
+    gs.castlingRights = ChessEngine.ALL_CASTLING  # rights out of step with the board, as loadFen no longer allows
+    assert not any(move.isCastleMove for move in gs.getValidMoves())
+    assert not any(move.isCastleMove for move in gs.generateMoves())
+    fen = gs.getFen()
+    assert ChessAI.Searcher(1 << 10).search(gs, 2).bestMove is not None
+    assert gs.getFen() == fen
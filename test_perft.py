@@ -0,0 +1,42 @@
+"""
+Perft regression tests: the node counts of every reference position on both backends, and a throughput floor. The
+floor is deliberately low so slow CI machines pass; set PERFT_MIN_NPS to tighten it, e.g. PERFT_MIN_NPS=100000 pytest.
+"""
+import io
+import os
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+
+MAX_DEPTH = 3  # ChessPerft.py --verify goes deeper; this keeps the suite to a few seconds
+MIN_NPS = float(os.environ.get("PERFT_MIN_NPS", 20000))
+
+
+@pytest.mark.parametrize("name", sorted(ChessPerft.REFERENCE_POSITIONS))
+def test_reference_counts(backend, name):
+    fen, expected = ChessPerft.REFERENCE_POSITIONS[name]
+    gs = backend.fromFen(fen)
+    for depth, nodes in enumerate(expected[:MAX_DEPTH], 1):
+        assert ChessPerft.perft(gs, depth) == nodes, "%s depth %d" % (name, depth)
+    assert gs.getFen() == fen  # every makeMove was undone
+
+
+def test_divide_adds_up(backend):
+    fen, expected = ChessPerft.REFERENCE_POSITIONS["kiwipete"]
+    counts = ChessPerft.divide(backend.fromFen(fen), 2)
+    assert len(counts) == expected[0]
+    assert sum(counts.values()) == expected[1]
+
+
+def test_depth_zero_or_below():
+    gs = ChessEngine.GameState()
+    assert ChessPerft.perft(gs, 0) == 1
+    assert ChessPerft.perft(gs, -1) == 1
+    assert ChessPerft.divide(gs, -1) == {}
+
+
+def test_throughput(backend):
+    failures = ChessPerft.verify(MAX_DEPTH, backend, MIN_NPS, out=io.StringIO())
+    assert failures == []
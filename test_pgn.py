@@ -0,0 +1,68 @@
+"""
+SAN and PGN text: moveToSan and parseSan round trip every legal move of seeded random games, hand-checked SAN for
+disambiguation, promotion, castling, check and mate, and formatGame output read back by readGames and parseGame.
+"""
+import random
+
+import pytest
+
+import ChessEngine
+import ChessPGN
+import ChessPerft
+
+
+@pytest.mark.parametrize("name", ["start", "kiwipete", "castling", "enpassant-pin"])
+def test_san_round_trip(name):
+    rng = random.Random(name)
+    gs = ChessEngine.GameState.fromFen(ChessPerft.REFERENCE_POSITIONS[name][0])
+    for _ in range(60):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        fen = gs.getFen()
+        sans = [ChessPGN.moveToSan(gs, move, moves) for move in moves]
+        assert len(set(sans)) == len(sans), fen
+        assert gs.getFen() == fen  # moveToSan takes its trial move back
+        for move, san in zip(moves, sans):
+            assert ChessPGN.parseSan(gs, san, moves).moveID == move.moveID, san
+        gs.makeMove(rng.choice(moves))
+
+
+@pytest.mark.parametrize("fen, uci, san", [
+    ("4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1", "b1d2", "Nbd2"),           # the file tells the knights apart
+    ("4k3/8/8/R7/8/8/8/R3K3 w - - 0 1", "a1a3", "R1a3"),            # the rooks share a file, so the rank
+    ("2k5/8/8/8/4Q2Q/8/8/K6Q w - - 0 1", "h4e1", "Qh4e1"),           # neither alone is enough
+    ("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2", "e4d5", "exd5"),
+    ("k7/2P5/1K6/8/8/8/8/8 w - - 0 1", "c7c8", "c8=Q#"),
+    ("k7/4P3/8/8/8/8/8/K7 w - - 0 1", "e7e8", "e8=Q+"),
+    ("7k/8/6K1/8/8/8/8/R7 w - - 0 1", "a1a8", "Ra8#"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "e1g1", "O-O"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", "e8c8", "O-O-O"),
+])
+def test_san(fen, uci, san):
+    gs = ChessEngine.GameState.fromFen(fen)
+    move = next(move for move in gs.getValidMoves() if move.getChessNotation() == uci)
+    assert ChessPGN.moveToSan(gs, move) == san
+    assert ChessPGN.parseSan(gs, san).moveID == move.moveID
+
+
+def test_parse_san_errors():
+    gs = ChessEngine.GameState.fromFen("4k3/8/8/8/8/5N2/8/1N2K3 w - - 0 1")
+    for san in ("Nd2", "Nd5", "Qd2", "z9"):  # ambiguous, unreachable, no queen, nonsense
+        with pytest.raises(ChessPGN.IllegalMoveError):
+            ChessPGN.parseSan(gs, san)
+
+
+def test_format_game_reads_back():
+    headers = {"Event": 'A "quoted" event', "White": "a", "Black": "b", "Result": "1-0"}
+    sans = ["e4", "e5", "Bc4", "Nc6", "Qh5", "Nf6", "Qxf7#"] * 4  # long enough to wrap
+    text = ChessPGN.formatGame(headers, sans, "1-0")
+    assert all(len(line) <= 80 for line in text.splitlines())
+    assert text.splitlines()[-1].endswith("1-0")
+    games = list(ChessPGN.readGames((text + "\n" + text).splitlines(True)))
+    assert len(games) == 2
+    readHeaders, readSans = ChessPGN.parseGame(games[0])
+    assert readSans == sans
+    assert readHeaders["White"] == "a" and readHeaders["Result"] == "1-0"
+    assert ChessPGN.formatGame({}, ["e5", "Nf3"], "*", startWhite=False, startNumber=3).split() == \
+        ["3...", "e5", "4.", "Nf3", "*"]
@@ -0,0 +1,107 @@
+"""
+Position formats: FEN and EPD round trips, malformed FEN, and the 32 byte ChessBinary packing on both backends.
+"""
+import random
+
+import pytest
+
+import ChessBinary
+import ChessEngine
+import ChessPerft
+
+FENS = [fen for fen, _ in ChessPerft.REFERENCE_POSITIONS.values()] + [
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2",
+    "rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 3",
+    "8/8/8/4k3/8/8/4P3/4K2R w K - 37 59",
+]
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_fen_round_trip(backend, fen):
+    assert backend.fromFen(fen).getFen() == fen
+
+
+def test_default_counters_and_epd():
+    gs = ChessEngine.GameState.fromFen("4k3/8/8/8/8/8/8/4K3 b - -")
+    assert (gs.halfmoveClock, gs.fullmoveNumber) == (0, 1)
+    operations = gs.loadEpd('4k3/8/8/8/8/8/4Q3/4K3 w - - bm Qe7+; id "test 1"; hmvc 12; fmvn 40;')
+    assert operations == {"bm": "Qe7+", "id": "test 1", "hmvc": "12", "fmvn": "40"}
+    assert gs.getFen() == "4k3/8/8/8/8/8/4Q3/4K3 w - - 12 40"
+    assert gs.getEpd({"bm": "Qe7+", "id": "test 1"}) == '4k3/8/8/8/8/8/4Q3/4K3 w - - bm Qe7+; id "test 1";'
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",     # seven ranks
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq z9 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - a 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w",
+])
+def test_malformed_fen_raises(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.fromFen(fen)
+
+
+@pytest.mark.parametrize("fen", [
+    "4k3/8/8/8/8/8/8/RN6 w - - 0 1",                       # no white king
+    "4k3/8/8/8/8/8/8/RN1KK3 w - - 0 1",                    # two white kings
+    "8/8/8/8/8/8/8/4K3 b - - 0 1",                          # no black king
+    "P3k3/8/8/8/8/8/8/4K3 w - - 0 1",                       # pawn on the last rank
+    "4k3/8/8/8/8/8/8/4K2p b - - 0 1",                       # pawn on the first rank
+    "4k3/8/8/3pP3/8/8/8/4K3 w - d3 0 1",                    # en passant square behind a white pawn
+    "4k3/8/8/8/3pP3/8/8/4K3 b - e6 0 1",
+])
+def test_unreachable_position_raises(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.fromFen(fen)
+
+
+@pytest.mark.parametrize("fen, rights", [
+    ("4k3/8/8/8/8/8/8/RN2K3 w KQkq - 0 1", "Q"),           # no rook on h1, and black has no rooks at all
+    ("r3k2r/8/8/8/8/8/8/R2K3R w KQkq - 0 1", "kq"),         # the white king has left e1
+    ("1r2k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", "KQk"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "KQkq"),
+])
+def test_castling_rights_need_the_king_and_rook_at_home(fen, rights):
+    assert ChessEngine.GameState.fromFen(fen).getFen().split()[2] == rights
+
+
+def sampleStates():
+    rng = random.Random(3)
+    states = [ChessEngine.GameState.fromFen(fen) for fen in FENS]
+    gs = ChessEngine.GameState()
+    for _ in range(60):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+        states.append(ChessEngine.GameState.fromFen(gs.getFen()))
+    return states
+
+
+def test_binary_round_trip(backend):
+    states = sampleStates()
+    for gs in states:
+        packed = ChessBinary.packPosition(gs)
+        assert len(packed) == ChessBinary.POSITION_SIZE
+        unpacked = ChessBinary.unpackPosition(packed)
+        assert unpacked.getFen() == gs.getFen()
+        assert unpacked.zobristKey == gs.zobristKey
+    buffer = ChessBinary.packPositions(states)
+    assert len(buffer) == len(states) * ChessBinary.POSITION_SIZE
+    assert [gs.getFen() for gs in ChessBinary.unpackPositions(buffer)] == [gs.getFen() for gs in states]
+    reused = ChessEngine.GameState()
+    assert [gs.getFen() for gs in ChessBinary.unpackPositions(buffer, reused)] == [gs.getFen() for gs in states]
+    unpacked = ChessBinary.unpackPositions(buffer, gameStateClass=backend)
+    assert [gs.getFen() for gs in unpacked] == [gs.getFen() for gs in states]
+
+
+def test_binary_rejects_bad_input():
+    with pytest.raises(ValueError):
+        list(ChessBinary.unpackPositions(bytes(ChessBinary.POSITION_SIZE + 1)))
+    packed = bytearray(ChessBinary.packPosition(ChessEngine.GameState()))
+    packed[8] = 0xF0  # piece code 15 on a8
+    with pytest.raises(ValueError):
+        ChessBinary.unpackPosition(packed)
@@ -0,0 +1,82 @@
+"""
+Instrumentation: the counters and timers grow while the engine works with ChessStats enabled, stop when it is
+disabled, and come out in the JSON and Prometheus formats.
+"""
+import json
+import time
+
+import pytest
+
+import ChessAI
+import ChessEngine
+import ChessPerft
+import ChessStats
+
+
+@pytest.fixture
+def stats():
+    ChessStats.reset()
+    ChessStats.enable()
+    yield ChessStats
+    ChessStats.disable()
+    ChessStats.reset()
+
+
+def calls(name):
+    return ChessStats.snapshot()["timers"].get(name, {"calls": 0})["calls"]
+
+
+def test_counters_grow_during_a_search(stats):
+    gs = ChessEngine.GameState.fromFen(ChessPerft.REFERENCE_POSITIONS["kiwipete"][0])
+    before = {name: calls(name) for name in ("generateMoves", "isLegal", "makeMove", "undoMove")}
+    result = ChessAI.Searcher(1 << 12).search(gs, 2)
+    after = {name: calls(name) for name in before}
+    assert all(after[name] > before[name] for name in before), after
+    assert after["makeMove"] == after["undoMove"]  # the search undoes every move it makes
+    assert ChessStats.counters["Move"] > 0
+    assert ChessStats.timers["generateMoves"].total < result.seconds
+    moves = ChessStats.counters["Move"]
+    ChessAI.Searcher(1 << 12).search(gs, 1)
+    assert calls("makeMove") > after["makeMove"] and ChessStats.counters["Move"] > moves
+
+
+def test_generator_timer_leaves_out_the_consumer(stats):
+    gs = ChessEngine.GameState()
+    start = time.perf_counter()
+    for _ in gs.generateMoves():
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    timer = ChessStats.timers["generateMoves"]
+    assert timer.calls == 1
+    assert timer.total < elapsed / 2  # the 20 sleeps between moves are not counted
+
+
+def test_reset_while_enabled_keeps_counting(stats):
+    ChessPerft.perft(ChessEngine.GameState(), 2)
+    ChessStats.reset()
+    assert calls("makeMove") == 0 and ChessStats.counters == {}
+    ChessPerft.perft(ChessEngine.GameState(), 2)  # the leaves are counted from the move list, not made
+    assert calls("makeMove") == 20
+
+
+def test_disabled_measures_nothing():
+    ChessStats.reset()
+    ChessStats.enable()
+    ChessStats.disable()
+    assert not hasattr(ChessEngine.GameState.makeMove, "__wrapped__")
+    assert not hasattr(ChessEngine.Move.__init__, "__wrapped__")
+    ChessPerft.perft(ChessEngine.GameState(), 2)
+    ChessStats.record("frame", 1.0)
+    with ChessStats.phase("frame.events"):
+        pass
+    assert all(timer["calls"] == 0 for timer in ChessStats.snapshot()["timers"].values())
+    assert ChessStats.counters == {}
+
+
+def test_exports(stats):
+    ChessPerft.perft(ChessEngine.GameState(), 3)
+    data = json.loads(ChessStats.toJson())
+    assert data["enabled"] and data["timers"]["makeMove"]["calls"] == 420
+    text = ChessStats.toPrometheus()
+    assert 'chess_calls_total{name="makeMove"} 420' in text.splitlines()
+    assert '# TYPE chess_latency_seconds summary' in text
@@ -0,0 +1,119 @@
+"""
+Tablebases: the tables are generated once per test session (or taken from CHESS_TABLEBASE_DIR when it names a directory
+that holds them) and checked for their statistics, a few hand-checked probes, and agreement of every sampled position
+with a one ply search over its probed successors.
+"""
+import os
+import random
+
+import pytest
+
+import ChessEngine
+import ChessTablebase
+from ChessTablebase import DRAW, LOSS, WIN
+
+# name: (wins, draws, losses, longest mate in plies)
+STATISTICS = {
+    "KQK": (22589, 3590, 31378, 19),
+    "KRK": (27352, 3467, 31501, 31),
+    "KPK": (62477, 54397, 48802, 55),
+}
+SAMPLES = 300  # random positions per table checked against their successors
+
+
+@pytest.fixture(scope="module")
+def tablebaseDir(tmp_path_factory):
+    directory = os.environ.get("CHESS_TABLEBASE_DIR")
+    if directory and all(os.path.exists(ChessTablebase.tablePath(directory, name)) for name in ChessTablebase.TABLES):
+        return directory
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    for name in ChessTablebase.TABLES:  # KPK needs KQK for its promotions
+        ChessTablebase.generateTable(name, directory, os.cpu_count() or 1)
+    return directory
+
+
+@pytest.fixture(scope="module")
+def tablebases(tablebaseDir):
+    with ChessTablebase.Tablebases(tablebaseDir) as tablebases:
+        yield tablebases
+
+
+@pytest.mark.parametrize("name", ChessTablebase.TABLES)
+def test_statistics(tablebases, name):
+    counts, longest = ChessTablebase.tableStatistics(tablebases.tables[name])
+    assert (counts[WIN], counts[DRAW], counts[LOSS], longest) == STATISTICS[name]
+
+
+@pytest.mark.parametrize("fen, expected", [
+    ("7k/8/6K1/8/8/8/Q7/8 w - - 0 1", (WIN, 1)),            # Qa8#
+    ("7k/6Q1/6K1/8/8/8/8/8 b - - 0 1", (LOSS, 0)),          # already mated
+    ("8/8/8/8/8/8/6Qk/4K3 b - - 0 1", (DRAW, 0)),           # the king takes the queen
+    ("7k/8/6QK/8/8/8/8/8 b - - 0 1", (DRAW, 0)),            # stalemate
+    ("8/q7/8/8/8/6k1/8/7K b - - 0 1", (WIN, 1)),            # the first position with the colors swapped
+    ("7k/8/6K1/8/8/8/8/R7 w - - 0 1", (WIN, 1)),            # Ra8#
+    ("k7/8/8/8/8/8/P7/K7 w - - 0 1", (DRAW, 0)),            # rook pawn, the defending king holds the corner
+    ("k7/4P3/8/8/8/8/8/4K3 w - - 0 1", (WIN, 15)),          # e8=Q, then the white king has to come over
+])
+def test_probes(tablebases, fen, expected):
+    result = tablebases.probe(ChessEngine.GameState.fromFen(fen))
+    assert result is not None and result[0] == expected[0]
+    if expected[0] != DRAW:
+        assert result[1] == expected[1]
+
+
+@pytest.mark.parametrize("fen", [
+    "r3k3/8/8/8/8/8/8/4K3 w q - 0 1",                       # castling rights left
+    "4k3/8/8/8/8/8/8/3QK2R w - - 0 1",                      # four pieces
+    "4k3/8/8/8/8/8/8/3BK3 w - - 0 1",                       # no KBK table
+])
+def test_positions_not_covered(tablebases, fen):
+    assert tablebases.probe(ChessEngine.GameState.fromFen(fen)) is None
+
+
+def randomPosition(rng, piece):
+    while True:
+        whiteKing, blackKing, square = rng.sample(range(64), 3)
+        if piece == 'P' and square // 8 in (0, 7):
+            continue
+        if abs(whiteKing // 8 - blackKing // 8) <= 1 and abs(whiteKing % 8 - blackKing % 8) <= 1:
+            continue
+        board = [["--"] * 8 for _ in range(8)]
+        board[whiteKing // 8][whiteKing % 8] = "wK"
+        board[blackKing // 8][blackKing % 8] = "bK"
+        board[square // 8][square % 8] = "w" + piece
+        gs = ChessEngine.GameState()
+        gs.setPosition(board, rng.random() < 0.5, 0)
+        gs.whiteToMove = not gs.whiteToMove
+        leftInCheck = gs.inCheck()  # the side that just moved can't be in check
+        gs.whiteToMove = not gs.whiteToMove
+        if not leftInCheck:
+            return gs
+
+
+'''
+The value of gs from the probes of its successors: a win in one ply more than the quickest lost successor, a draw
+when a successor is drawn, otherwise a loss in one ply more than the slowest won successor
+'''
+def searchOnePly(tablebases, gs):
+    moves = gs.getValidMoves()
+    if not moves:
+        return (LOSS, 0) if gs.checkmate else (DRAW, 0)
+    results = []
+    for move in moves:
+        gs.makeMove(move)
+        results.append(tablebases.probe(gs) or (DRAW, 0))  # no table covers the two kings left after a capture
+        gs.undoMove()
+    lost = [plies for outcome, plies in results if outcome == LOSS]
+    if lost:
+        return WIN, min(lost) + 1
+    if any(outcome == DRAW for outcome, _ in results):
+        return DRAW, 0
+    return LOSS, max(plies for _, plies in results) + 1
+
+
+@pytest.mark.parametrize("name", ChessTablebase.TABLES)
+def test_probes_agree_with_successors(tablebases, name):
+    rng = random.Random(name)
+    for _ in range(SAMPLES):
+        gs = randomPosition(rng, name[1])
+        assert tablebases.probe(gs) == searchOnePly(tablebases, gs), gs.getFen()
@@ -0,0 +1,56 @@
+"""
+Self-play tournaments: a short tournament in this process writes PGN that replays cleanly and JSON lines that agree
+with it, and the Elo arithmetic behind the report.
+"""
+import io
+import json
+import math
+
+import pytest
+
+import ChessPGN
+import ChessTournament
+
+OPENINGS = ["e2e4 e7e5 g1f3",
+            "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"]  # a FEN with black to move
+
+
+def test_short_tournament_writes_valid_pgn():
+    engines = [ChessTournament.parseEngine("d1:depth=1,tt=1024"), ChessTournament.parseEngine("d2:depth=2,tt=1024")]
+    pgnOut, jsonOut = io.StringIO(), io.StringIO()
+    standings, _ = ChessTournament.runTournament(engines, OPENINGS, maxPlies=12, pgnOut=pgnOut, jsonOut=jsonOut)
+    records = [json.loads(line) for line in jsonOut.getvalue().splitlines()]
+    games = list(ChessPGN.readGames(io.StringIO(pgnOut.getvalue())))
+    assert standings.games == len(records) == len(games) == 4  # each opening with both colors
+    assert sum(sum(results) for results in standings.pairs.values()) == 4
+    for record, text in zip(records, games):
+        headers, sans = ChessPGN.parseGame(text)
+        assert (headers["White"], headers["Black"], headers["Result"]) == \
+            (record["white"], record["black"], record["result"])
+        assert ("FEN" in headers) == ('/' in record["opening"])
+        replay = ChessPGN.processGame(text)
+        assert replay["error"] is None, replay["error"]
+        openingPlies = 0 if "FEN" in headers else len(record["opening"].split())
+        assert replay["plies"] == len(sans) == openingPlies + record["plies"]
+        if record["result"] == "1/2-1/2" and record["termination"].startswith("adjudicated"):
+            assert record["plies"] == 12
+    report = io.StringIO()
+    standings.report(1.0, 1, report)
+    assert "d1 vs d2: +" in report.getvalue()
+
+
+def test_engine_specs():
+    assert ChessTournament.parseEngine("fast")["depth"] == 3  # some limit is always set
+    config = ChessTournament.parseEngine("t:time=0.5,nodes=1000")
+    assert (config["name"], config["time"], config["nodes"]) == ("t", 0.5, 1000)
+    with pytest.raises(ValueError):
+        ChessTournament.parseEngine("x:speed=9")
+
+
+def test_elo_difference():
+    assert ChessTournament.eloDifference(5, 0, 5)[0] == 0.0
+    elo, margin = ChessTournament.eloDifference(30, 0, 10)  # a 75% score
+    assert elo == pytest.approx(190.85, abs=0.01) and 0 < margin < math.inf
+    assert ChessTournament.eloDifference(0, 2, 4)[0] < 0
+    assert ChessTournament.eloDifference(4, 0, 0) == (math.inf, math.inf)
+    assert ChessTournament.eloDifference(0, 0, 0) == (0.0, math.inf)
@@ -0,0 +1,59 @@
+"""
+Incremental Zobrist keys: the key makeMove and undoMove keep up to date must always equal the key computed from
+scratch, on both backends, and equal positions reached by different move orders must share a key.
+"""
+import random
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+
+
+@pytest.mark.parametrize("name", ["start", "kiwipete", "castling", "enpassant-pin"])
+def test_incremental_key_matches_a_fresh_one(backend, name):
+    rng = random.Random(name)
+    gs = backend.fromFen(ChessPerft.REFERENCE_POSITIONS[name][0])
+    keys = [gs.zobristKey]
+    for _ in range(100):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+        assert gs.zobristKey == gs.computeZobristKey(), gs.getFen()
+        assert gs.zobristKey == ChessEngine.GameState.fromFen(gs.getFen()).zobristKey, gs.getFen()
+        assert gs.zobristLog[-1] == gs.zobristKey
+        keys.append(gs.zobristKey)
+    while gs.moveLog:
+        assert gs.zobristKey == keys.pop()
+        gs.undoMove()
+    assert gs.zobristKey == keys.pop() == gs.computeZobristKey()
+    assert list(gs.zobristLog) == [gs.zobristKey]
+
+
+def play(gs, *moves):
+    for text in moves:
+        move = next(move for move in gs.getValidMoves() if move.getChessNotation() == text)
+        gs.makeMove(move)
+    return gs
+
+
+def test_transpositions_share_a_key():
+    first = play(ChessEngine.GameState(), "g1f3", "g8f6", "b1c3", "b8c6")
+    second = play(ChessEngine.GameState(), "b1c3", "b8c6", "g1f3", "g8f6")
+    assert first.zobristKey == second.zobristKey
+    back = play(ChessEngine.GameState(), "g1f3", "g8f6", "f3g1", "f6g8")
+    assert back.zobristKey == ChessEngine.GameState().zobristKey
+
+
+def test_side_to_move_castling_and_en_passant_change_the_key():
+    keys = {ChessEngine.GameState.fromFen(fen).zobristKey for fen in (
+        "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R w Kkq - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R w - - 0 1",
+    )}
+    assert len(keys) == 4
+    withCapture = ChessEngine.GameState.fromFen("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1").zobristKey
+    withoutCapture = ChessEngine.GameState.fromFen("4k3/8/8/3pP3/8/8/8/4K3 w - - 0 1").zobristKey
+    assert withCapture != withoutCapture